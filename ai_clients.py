@@ -0,0 +1,75 @@
+import os
+import threading
+from functools import lru_cache
+
+# google.generativeaiの読み込みとAPIキーの設定は重いため，初めて使われるときまで遅らせる
+_configure_lock = threading.Lock()
+_configured = False
+
+
+def _load_api_key() -> str | None:
+    """
+    GeminiのAPIキーを読み込む．.streamlit/secrets.tomlを優先し，なければ環境変数を使う．
+    """
+    try:
+        import streamlit as st
+        return st.secrets["GEMINI_API_KEY"]
+    except Exception:
+        return os.getenv("GEMINI_API_KEY")
+
+
+def get_genai():
+    """
+    初回呼び出し時にgoogle.generativeaiを読み込んでAPIキーを設定し，モジュールを返す．
+    """
+    global _configured
+    import google.generativeai as genai
+    with _configure_lock:
+        if not _configured:
+            api_key = _load_api_key()
+            if not api_key:
+                raise ValueError("エラー: GEMINI_API_KEYが.streamlit/secrets.tomlファイルに設定されていません。")
+            genai.configure(api_key=api_key)
+            _configured = True
+    return genai
+
+
+@lru_cache(maxsize=None)
+def get_generative_model(model_name: str, system_instruction: str | None = None):
+    """
+    モデル名とシステム指示に対応するGenerativeModelを返す．同じ組み合わせのインスタンスはプロセス内で使い回す．
+    """
+    return get_genai().GenerativeModel(model_name, system_instruction=system_instruction)
+
+
+# テキスト生成・埋め込みに使うバックエンド（初めて使うときに環境変数LLM_BACKENDから決める）
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    テキスト生成・埋め込みに使うバックエンドを返す．
+    環境変数LLM_BACKENDが"local"の場合は，Gemini APIを呼ばないローカルのスタブを使う．
+    スタブの応答遅延は環境変数LLM_STUB_LATENCY_SECONDSで指定できる．
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            import llm_backends
+            if os.getenv("LLM_BACKEND", "gemini") == "local":
+                _backend = llm_backends.LocalStubBackend(
+                    latency_seconds=float(os.getenv("LLM_STUB_LATENCY_SECONDS", "0"))
+                )
+            else:
+                _backend = llm_backends.GeminiBackend()
+        return _backend
+
+
+def set_backend(backend) -> None:
+    """
+    使用するバックエンドを差し替える（負荷試験やテストで使う）．
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -1,73 +1,232 @@
-import google.generativeai as genai
 import json
-from typing import Dict, Any, List
+import os
+import re
+import copy
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Any, List, Callable, Optional, Sequence, Iterator, Tuple
 from dict_types import UserInput 
-import streamlit as st
+import cache_utils
+import ai_clients
 
 # --- 初期設定 ---
-# APIキーを安全に読み込む
-GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
-if not GEMINI_API_KEY:
-    raise ValueError("エラー: GEMINI_API_KEYが.streamlit/secrets.tomlファイルに設定されていません。")
-genai.configure(api_key=GEMINI_API_KEY)
+# 使用するモデルを定義（呼び出し先のバックエンドは，初めて使うときにai_clientsで決まる）
+TEXT_GENERATION_MODEL_NAME = 'gemini-2.5-flash'
 
-# 使用するモデルを定義
-text_generation_model = genai.GenerativeModel('gemini-2.5-flash')
+# プロンプトのバージョン（プロンプトを変更したら値を上げ，古いキャッシュを無効にする）
+INTRODUCTION_PROMPT_VERSION = "2"
+ANIMAL_PROMPT_VERSION = "2"
+FULL_PROFILE_PROMPT_VERSION = "2"
+CONVERSATION_PROMPT_VERSION = "2"
+
+# 各プロンプトが実際に使用するユーザー入力の項目（プロンプトへの埋め込みとキャッシュキーの計算に使用）
+INTRODUCTION_PROMPT_FIELDS = (
+    "nickname", "birth_date", "university", "hometown",
+    "hobbies", "happy_topic", "expert_topic"
+)
+ANIMAL_PROMPT_FIELDS = ("university", "hometown", "hobbies", "happy_topic", "expert_topic")
+FULL_PROFILE_PROMPT_FIELDS = INTRODUCTION_PROMPT_FIELDS
+CONVERSATION_PROMPT_FIELDS = INTRODUCTION_PROMPT_FIELDS + ("tags",)
+
+# プロンプトに埋め込むときの各項目の見出し
+PROMPT_FIELD_LABELS = {
+    "nickname": "ニックネーム",
+    "birth_date": "生年月日",
+    "university": "大学",
+    "hometown": "出身地",
+    "hobbies": "趣味",
+    "happy_topic": "話しかけられて嬉しい話題",
+    "expert_topic": "ちょっと詳しいこと",
+    "tags": "タグ",
+}
+
+# 動物分類で，先にローカルの分類器（animal_classifier）を試すかどうか（環境変数LOCAL_ANIMAL_CLASSIFIER_ENABLEDが"1"の場合）
+# AIによる分類との一致率をbenchmarks/bench_animal_classifier.pyで確認してから有効にする
+LOCAL_ANIMAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_ANIMAL_CLASSIFIER_ENABLED", "0") == "1"
+
+# AI生成結果のキャッシュ
+# 1段目はメモリ上のLRU，2段目は環境変数AI_CACHE_DB_PATHが設定されている場合のみSQLiteに保存する
+AI_CACHE_MAX_ENTRIES = 1024
+AI_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+_ai_cache_db_path = os.getenv("AI_CACHE_DB_PATH")
+ai_result_cache = cache_utils.TieredCache(
+    cache_utils.TTLCache(maxsize=AI_CACHE_MAX_ENTRIES, ttl=AI_CACHE_TTL_SECONDS),
+    cache_utils.SQLiteCache(_ai_cache_db_path, ttl=AI_CACHE_TTL_SECONDS) if _ai_cache_db_path else None
+)
+
+# 動物分類の候補リスト
+ANIMAL_CANDIDATES = [
+    "ライオン", "トラ", "ワシ", "馬", "オオカミ",
+    "フクロウ", "イルカ", "ネコ", "カラス", "タカ",
+    "犬", "サル", "ペンギン", "カメ", "カンガルー",
+    "ウサギ", "コアラ", "パンダ", "羊", "カワウソ"
+]
+
+# 動物分類のカテゴリ
+ANIMAL_CATEGORIES = [
+    "リーダーシップ全開タイプ",
+    "頭脳派・ミステリアスタイプ",
+    "ムードメーカー・元気いっぱいタイプ",
+    "癒し系・ほんわかタイプ",
+    "自由人・マイペースタイプ"
+]
+
+# 一括生成モードで使用するレスポンスのJSONスキーマ
+FULL_PROFILE_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "catchphrase": {"type": "string"},
+        "introduction_text": {"type": "string"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "animal_name": {"type": "string", "enum": ANIMAL_CANDIDATES},
+        "animal_category": {"type": "string", "enum": ANIMAL_CATEGORIES},
+        "animal_reason": {"type": "string"}
+    },
+    "required": [
+        "catchphrase", "introduction_text", "tags",
+        "animal_name", "animal_category", "animal_reason"
+    ]
+}
+
+# --- システム指示 ---
+# 呼び出しごとに変わらない役割・命令・出力例はシステム指示として渡し，プロンプトにはユーザー情報だけを入れる
+# （Geminiのコンテキストキャッシュは最小トークン数に満たないため使わない）
+_PROFILE_WRITER_ROLE = "あなたは、プロのプロフィールライターです。与えられた簡単なアンケート結果から、その人の魅力や個性が最大限に引き出され、初対面でも会話が弾むような、親しみやすい自己紹介カードを作成するのがあなたの仕事です。"
+
+INTRODUCTION_SYSTEM_INSTRUCTION = f"""{_PROFILE_WRITER_ROLE}
+ユーザー情報を元に、ライターとしてのセンスを最大限に発揮し、以下のキーを持つJSONオブジェクトだけを出力してください。
+- "catchphrase": ユーザーの魅力を表す、ユニークなキャッチコピーを、**必ず`【】`（隅付き括弧）で囲んで**生成してください。
+- "introduction_text": 本人が語っているような、自然な一人称の自己紹介文（ですます調）を生成してください。
+- "tags": 会話のきっかけになりそうなキーワードを3つ抽出し、文字列の配列として生成してください。
+出力例:
+{{"catchphrase": "【一杯のコーヒーから物語を紡ぐ、シネマティック・トラベラー】", "introduction_text": "はじめまして、さきです！休日はカフェでのんびりしたり...", "tags": ["#カフェ部", "#映画好きと繋がりたい", "#ハンドドリップ派"]}}"""
+
+ANIMAL_SYSTEM_INSTRUCTION = f"""ユーザー情報をもとに、次のカテゴリのいずれかに分類し、最も適切な動物を候補から1つ選び、理由も述べてください。
+カテゴリ: {"、".join(ANIMAL_CATEGORIES)}
+動物の候補: {"、".join(ANIMAL_CANDIDATES)}
+出力形式は必ずJSONで:
+{{"animal_name": "...", "animal_category": "...", "animal_reason": "..."}}"""
+
+FULL_PROFILE_SYSTEM_INSTRUCTION = f"""{_PROFILE_WRITER_ROLE}
+ユーザー情報を元に、以下の項目を生成してください。
+- "catchphrase": ユーザーの魅力を表す、ユニークなキャッチコピーを、**必ず`【】`（隅付き括弧）で囲んで**生成してください。
+- "introduction_text": 本人が語っているような、自然な一人称の自己紹介文（ですます調）を生成してください。
+- "tags": 会話のきっかけになりそうなキーワードを3つ抽出してください。（例: "#カフェ部", "#映画好きと繋がりたい"）
+- "animal_category": ユーザーをカテゴリのいずれかに分類してください。
+- "animal_name": 最も適切な動物を候補から1つ選んでください。
+- "animal_reason": その動物を選んだ理由を述べてください。"""
+
+CONVERSATION_SYSTEM_INSTRUCTION = """あなたは、初対面の二人が仲良くなるための会話をサポートする、優れたアイスブレイク・アシスタントです。
+2人のプロフィールを比較し、「あなた（ユーザーA）」が「相手（ユーザーB）」と楽しく会話を始めるための「きっかけ」を生成してください。
+- "common_points": 「あなた」と「相手」のプロフィールから、**会話のきっかけとして面白い、ユニークな共通点**を3つまで、**短い単語やフレーズ**で挙げてください。
+- **【重要】以下の当たり前の共通点は除外してください：** 年齢が近いこと、学生であること、（今回の集まりの）内定者であること
+- 表面的な一致だけでなく、地理的（例：関西出身）、カテゴリ的（例：インドアな趣味）など、**より深いレベルでの意外な共通点**を優先してください。共通点がない場合は、その旨を正直に記載してください。
+- "topics": 「あなた」が「相手」に質問するための、具体的で面白い話題を3つ提案してください。提案は必ず「相手の〇〇について、△△と質問してみましょう。」というアドバイス形式で、あなた（ユーザーA）へのメッセージとして作成してください。提案文の中では、相手のニックネームを直接使わないでください。
+必ず、以下の例のようなJSON形式で出力してください。
+{"common_points": ["福岡県出身", "映画鑑賞が趣味", "九州地方の大学"], "topics": ["相手の趣味である「カフェ巡り」について、「普段はどんなカフェに行かれるんですか？」と質問してみましょう。", "出身地が同じ福岡県なので、「福岡で一番好きなラーメン屋さんはどこですか？」と聞いてみるのはどうでしょう。", "相手はコーヒーの淹れ方が得意とのことなので、「おすすめの豆や淹れ方をぜひ教えてほしいです！」とお願いしてみましょう。"]}"""
+
+# --- トークン数の記録 ---
+# 関数ごとの呼び出し回数・入出力トークン数・プロンプトの文字数・所要時間の合計
+_usage_lock = threading.Lock()
+_usage_totals: Dict[str, Dict[str, float]] = defaultdict(
+    lambda: {"calls": 0, "input_tokens": 0, "output_tokens": 0, "prompt_chars": 0, "seconds": 0.0}
+)
+
+def _record_usage(function_name: str, prompt: str, input_tokens: int, output_tokens: int, seconds: float) -> None:
+    """
+    AI呼び出し1回分のトークン数と所要時間を記録する．
+    """
+    with _usage_lock:
+        totals = _usage_totals[function_name]
+        totals["calls"] += 1
+        totals["input_tokens"] += input_tokens
+        totals["output_tokens"] += output_tokens
+        totals["prompt_chars"] += len(prompt)
+        totals["seconds"] += seconds
+
+def get_usage_stats() -> Dict[str, Dict[str, float]]:
+    """
+    関数ごとの呼び出し回数・トークン数の合計と，1回あたりの平均（トークン数・プロンプトの文字数・所要時間）を返す．
+    """
+    with _usage_lock:
+        stats = {}
+        for function_name, totals in _usage_totals.items():
+            calls = totals["calls"]
+            stats[function_name] = {
+                **totals,
+                "avg_input_tokens": totals["input_tokens"] / calls,
+                "avg_output_tokens": totals["output_tokens"] / calls,
+                "avg_prompt_chars": totals["prompt_chars"] / calls,
+                "avg_seconds": totals["seconds"] / calls,
+            }
+        return stats
+
+def reset_usage_stats() -> None:
+    """
+    記録したトークン数を消去する．
+    """
+    with _usage_lock:
+        _usage_totals.clear()
 
 # --- 関数定義 ---
+def _format_profile_fields(profile_data: Dict[str, Any], fields: Sequence[str]) -> str:
+    """
+    プロフィールのうちfieldsの項目だけを，「見出し:値」の1行ずつに変換する．値が空の項目は省く．
+    """
+    lines = []
+    for field in fields:
+        value = profile_data.get(field)
+        if isinstance(value, (list, tuple)):
+            value = "、".join(str(item) for item in value if item)
+        if value:
+            lines.append(f"{PROMPT_FIELD_LABELS[field]}:{value}")
+    return "\n".join(lines)
+
+def _generate_text(function_name: str, system_instruction: str, prompt: str,
+                   response_schema: Optional[Dict[str, Any]] = None) -> str:
+    """
+    バックエンドを呼び出してテキストを生成し，トークン数と所要時間を関数名ごとに記録する．
+    """
+    start = time.perf_counter()
+    response = ai_clients.get_backend().generate(
+        TEXT_GENERATION_MODEL_NAME,
+        prompt,
+        response_schema=response_schema,
+        system_instruction=system_instruction
+    )
+    _record_usage(
+        function_name, prompt, response.get("input_tokens", 0), response.get("output_tokens", 0),
+        time.perf_counter() - start
+    )
+    return response["text"]
+
+def _generate_with_cache(task: str, prompt_version: str, profile_data: UserInput,
+                         fields: Sequence[str], generate: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    プロンプトが使用する項目・モデル名・プロンプトのバージョンから求めたキーでキャッシュを引き，
+    ヒットしなければgenerateを呼び出して結果を保存する．失敗した結果（例外）は保存しない．
+    """
+    used_fields = {field: profile_data.get(field) for field in fields}
+    key = cache_utils.make_cache_key(task, TEXT_GENERATION_MODEL_NAME, prompt_version, used_fields)
+    cached = ai_result_cache.get(key)
+    if cached is not None:
+        # 呼び出し側での変更がキャッシュに波及しないよう，コピーを返す
+        return copy.deepcopy(cached)
+    result = generate()
+    ai_result_cache.set(key, copy.deepcopy(result))
+    return result
+
 def generate_introduction_text(profile_data: UserInput) -> Dict[str, Any]:
     """
     ユーザの入力を元に，自己紹介文・キャッチフレーズ・タグを生成する．
+    同じ入力に対する生成結果はキャッシュから返す．
     """
-    
-    # 1. プロンプトを完成させる
-    prompt = f"""
-        # あなたへの役割
-        あなたは、プロのプロフィールライターです。与えられた簡単なアンケート結果から、その人の魅力や個性が最大限に引き出され、初対面でも会話が弾むような、親しみやすい自己紹介カードを作成するのがあなたの仕事です。
-
-        # ユーザー情報
-        - ニックネーム: {profile_data['nickname']}
-        - 生年月日: {profile_data['birth_date']}
-        - 出身大学: {profile_data['university']}
-        - 出身地: {profile_data['hometown']}
-        - 趣味や好きなこと: {', '.join(profile_data['hobbies'])}
-        - 話しかけられるなら、どんな話題が一番嬉しいですか？: {profile_data['happy_topic']}
-        - 「実は、〇〇にはちょっと詳しいです！」と自慢できることは何ですか？: {profile_data['expert_topic']}
-
-        # 命令
-        上記のユーザー情報を元に、あなたのライターとしてのセンスを最大限に発揮し、以下のキーを持つJSONオブジェクトを生成してください。
-        - "catchphrase": ユーザーの魅力を表す、ユニークなキャッチコピーを、**必ず`【】`（隅付き括弧）で囲んで**生成してください。
-        - "introduction_text": 本人が語っているような、自然な一人称の自己紹介文（ですます調）を生成してください。
-        - "tags": 会話のきっかけになりそうなキーワードを3つ抽出し、文字列の配列（リスト）として生成してください。
-
-        # 出力形式
-        必ず、以下の例のようなJSON形式で出力してください。
-        {{
-        "catchphrase": "【一杯のコーヒーから物語を紡ぐ、シネマティック・トラベラー】",
-        "introduction_text": "はじめまして、さきです！休日はカフェでのんびりしたり...",
-        "tags": ["#カフェ部", "#映画好きと繋がりたい", "#ハンドドリップ派"]
-        }}
-    """
-    
     try:
-        # 2. Gemini APIを呼び出してテキスト生成
-        response = text_generation_model.generate_content(prompt)
-        ai_response_text = response.text
-        
-        # 3. AIの返事からJSON部分だけを賢く抜き出す
-        start_index = ai_response_text.find('{')
-        end_index = ai_response_text.rfind('}')
-        
-        if start_index != -1 and end_index != -1:
-            json_string = ai_response_text[start_index : end_index + 1]
-            # 4. 文字列をPythonの辞書に「翻訳」する
-            ai_response_dict = json.loads(json_string)
-            # 5. 本物のAIの生成結果を返す
-            return ai_response_dict
-        else:
-            # AIの返事にJSONが見つからなかった場合、エラーを発生させる
-            raise ValueError("AIのレスポンスに有効なJSONが含まれていません。")
-
+        return _generate_with_cache(
+            "introduction", INTRODUCTION_PROMPT_VERSION, profile_data, INTRODUCTION_PROMPT_FIELDS,
+            lambda: _request_introduction_text(profile_data)
+        )
     except Exception as e:
         print(f"AIによるテキスト生成でエラーが発生しました: {e}")
         # エラーが発生した場合は、失敗したことが分かる情報を返す
@@ -77,6 +236,32 @@ def generate_introduction_text(profile_data: UserInput) -> Dict[str, Any]:
             "tags": []
         }
 
+def _request_introduction_text(profile_data: UserInput) -> Dict[str, Any]:
+    """
+    Gemini APIを呼び出して，自己紹介文・キャッチフレーズ・タグを生成する．
+    失敗した場合は例外を送出する．
+    """
+    
+    # 1. プロンプトを完成させる（役割や出力形式はシステム指示で渡す）
+    prompt = f"# ユーザー情報\n{_format_profile_fields(profile_data, INTRODUCTION_PROMPT_FIELDS)}"
+
+    # 2. Gemini APIを呼び出してテキスト生成
+    ai_response_text = _generate_text("generate_introduction_text", INTRODUCTION_SYSTEM_INSTRUCTION, prompt)
+    
+    # 3. AIの返事からJSON部分だけを賢く抜き出す
+    start_index = ai_response_text.find('{')
+    end_index = ai_response_text.rfind('}')
+    
+    if start_index != -1 and end_index != -1:
+        json_string = ai_response_text[start_index : end_index + 1]
+        # 4. 文字列をPythonの辞書に「翻訳」する
+        ai_response_dict = json.loads(json_string)
+        # 5. 本物のAIの生成結果を返す
+        return ai_response_dict
+    else:
+        # AIの返事にJSONが見つからなかった場合、エラーを発生させる
+        raise ValueError("AIのレスポンスに有効なJSONが含まれていません。")
+
 
 def classify_animal_type(profile_data: UserInput) -> Dict[str, str]:
     """
@@ -90,39 +275,32 @@ def classify_animal_type(profile_data: UserInput) -> Dict[str, str]:
         分類された動物の名前と，その理由を含む辞書．
         例: {"animal_name": "フクロウ", "animal_reason": "知的な探究心が強いため..."}
     """
-    # 1. 動物候補リストを定義
-    ANIMAL_CANDIDATES = [
-        "ライオン", "トラ", "ワシ", "馬", "オオカミ",
-        "フクロウ", "イルカ", "ネコ", "カラス", "タカ",
-        "犬", "サル", "ペンギン", "カメ", "カンガルー",
-        "ウサギ", "コアラ", "パンダ", "羊", "カワウソ"
-    ]
-
-    # 2. プロンプトを作成
-    prompt=f"""
-        以下のユーザー情報をもとに，次の5カテゴリのいずれかに分類し，
-        最も適切な動物を {ANIMAL_CANDIDATES} から1つ選び，理由も述べてください。
+    return _generate_with_cache(
+        "animal", ANIMAL_PROMPT_VERSION, profile_data, ANIMAL_PROMPT_FIELDS,
+        lambda: _request_animal_type(profile_data)
+    )
 
-        カテゴリ:
-        リーダーシップ全開タイプ
-        頭脳派・ミステリアスタイプ
-        ムードメーカー・元気いっぱいタイプ
-        癒し系・ほんわかタイプ
-        自由人・マイペースタイプ
-
-        出力形式は必ずJSONで:
-        {{
-            "animal_name": "...",
-            "animal_category": "...",
-            "animal_reason": "..."
-        }}
-
-        ユーザー情報: {profile_data}
+def _request_animal_type(profile_data: UserInput) -> Dict[str, str]:
+    """
+    動物タイプを分類する．まずローカルの分類器を試し，自信がない場合だけGemini APIに問い合わせる．
+    失敗した場合はValueErrorを送出する．
     """
+    if LOCAL_ANIMAL_CLASSIFIER_ENABLED:
+        # numpy等の読み込みを遅らせるため，使うときに読み込む
+        import animal_classifier
+        try:
+            local_result = animal_classifier.classify(profile_data)
+        except Exception as e:
+            print(f"ローカルの動物分類でエラーが発生しました（AIによる分類に切り替えます）: {e}")
+            local_result = None
+        if local_result is not None:
+            return local_result
+
+    # 1. プロンプトには分類に使う項目だけを渡す（カテゴリ・動物候補・出力形式はシステム指示で渡す）
+    prompt = f"ユーザー情報:\n{_format_profile_fields(profile_data, ANIMAL_PROMPT_FIELDS)}"
 
     try:
-        response = text_generation_model.generate_content(prompt)
-        ai_response_text = response.text 
+        ai_response_text = _generate_text("classify_animal_type", ANIMAL_SYSTEM_INSTRUCTION, prompt)
 
         # JSON部分を抜き出す処理
         start_index = ai_response_text.find('{')
@@ -137,79 +315,71 @@ def classify_animal_type(profile_data: UserInput) -> Dict[str, str]:
         print(f"AIによる動物分類でエラーが発生しました: {e}")
         raise ValueError("動物分類に失敗しました。") from e
 
+def generate_full_profile(profile_data: UserInput) -> Dict[str, Any]:
+    """
+    自己紹介文・キャッチフレーズ・タグの生成と動物分類を，1回のリクエストでまとめて行う．
+    generate_introduction_textとclassify_animal_typeを個別に呼ぶ場合と比べて，
+    ユーザー情報の送信が1回で済み，レスポンスはJSONスキーマで構造化される．
+
+    Args:
+        profile_data: ユーザーが入力した情報の辞書．
+
+    Returns:
+        catchphrase, introduction_text, tags, animal_name, animal_category, animal_reason を含む辞書．
+    """
+    return _generate_with_cache(
+        "full_profile", FULL_PROFILE_PROMPT_VERSION, profile_data, FULL_PROFILE_PROMPT_FIELDS,
+        lambda: _request_full_profile(profile_data)
+    )
+
+def _request_full_profile(profile_data: UserInput) -> Dict[str, Any]:
+    """
+    Gemini APIを1回呼び出して，プロフィールの全項目を生成する．失敗した場合はValueErrorを送出する．
+    """
+    prompt = f"# ユーザー情報\n{_format_profile_fields(profile_data, FULL_PROFILE_PROMPT_FIELDS)}"
+
+    try:
+        # カテゴリ・動物の候補はレスポンスのJSONスキーマのenumで指定する
+        ai_response_text = _generate_text(
+            "generate_full_profile",
+            FULL_PROFILE_SYSTEM_INSTRUCTION,
+            prompt,
+            response_schema=FULL_PROFILE_RESPONSE_SCHEMA
+        )
+        return json.loads(ai_response_text)
+    except Exception as e:
+        print(f"AIによるプロフィールの一括生成でエラーが発生しました: {e}")
+        raise ValueError("プロフィールの一括生成に失敗しました。") from e
+
+def conversation_profile_hash(profile: Dict[str, Any]) -> str:
+    """
+    会話のきっかけ生成に使うプロフィール項目とプロンプトのバージョンから，内容のハッシュを求める。
+    事前計算した会話のきっかけが，現在のプロフィールに対して有効かどうかの判定に使う。
+    """
+    used_fields = {field: profile.get(field) for field in CONVERSATION_PROMPT_FIELDS}
+    return cache_utils.make_cache_key("conversation", TEXT_GENERATION_MODEL_NAME, CONVERSATION_PROMPT_VERSION, used_fields)
+
+def _build_conversation_prompt(profile_a: Dict[str, Any], profile_b: Dict[str, Any]) -> str:
+    """
+    会話のきっかけ生成用のプロンプトを作成する。
+    """
+    # 役割・命令・出力形式はシステム指示で渡し，2人のプロフィールだけを埋め込む
+    return (
+        f"## あなた（ユーザーA）\n{_format_profile_fields(profile_a, CONVERSATION_PROMPT_FIELDS)}\n"
+        f"## 相手（ユーザーB）\n{_format_profile_fields(profile_b, CONVERSATION_PROMPT_FIELDS)}"
+    )
+
 def create_conversation_starters(profile_a: Dict[str, Any], profile_b: Dict[str, Any]) -> Dict[str, List[str]]:
     """
     2人のプロフィール情報を元に、会話のきっかけとなる共通点や質問をAIに生成させる。
     @クマペンギン
     """
-    
-    # 1. 2人のプロフィール情報から、AIに渡すための要約を作成
-    your_info = f"""
-- ニックネーム: {profile_a.get('nickname')}
-- 誕生日: {profile_a.get('birth_date')}
-- 大学: {profile_a.get('university')}
-- 出身地: {profile_a.get('hometown')}
-- 趣味: {', '.join(profile_a.get('hobbies', []))}
-- 好きな話題: {profile_a.get('happy_topic')}
-- 得意なこと: {profile_a.get('expert_topic')}
-- タグ: {', '.join(profile_a.get('tags', []))}
-"""
-
-    opponent_info = f"""
-- ニックネーム: {profile_b.get('nickname')}
-- 誕生日: {profile_b.get('birth_date')}
-- 大学: {profile_b.get('university')}
-- 出身地: {profile_b.get('hometown')}
-- 趣味: {', '.join(profile_b.get('hobbies', []))}
-- 好きな話題: {profile_b.get('happy_topic')}
-- 得意なこと: {profile_b.get('expert_topic')}
-- タグ: {', '.join(profile_b.get('tags', []))}
-"""
-
-    # 2. プロンプトを作成
-    prompt = f"""
-# あなたへの役割
-あなたは、初対面の二人が仲良くなるための会話をサポートする、優れたアイスブレイク・アシスタントです。
-
-# 2人のプロフィール情報
-## あなた（ユーザーA）
-{your_info}
-
-## 相手（ユーザーB）
-{opponent_info}
-
-# 命令
-上記の2人のプロフィールを比較し、「あなた」が「相手」と楽しく会話を始めるための「きっかけ」を生成してください。
-- "common_points": 「あなた」と「相手」のプロフィールから、**会話のきっかけとして面白い、ユニークな共通点**を3つまで、**短い単語やフレーズ**で挙げてください。
-- **【重要】以下の当たり前の共通点は除外してください：**
-  - 年齢が近いこと
-  - 学生であること
-  - （今回の集まりの）内定者であること
-- 表面的な一致だけでなく、地理的（例：関西出身）、カテゴリ的（例：インドアな趣味）など、**より深いレベルでの意外な共通点**を優先してください。共通点がない場合は、その旨を正直に記載してください。
-- "topics": 「あなた」が「相手」に質問するための、具体的で面白い話題を3つ提案してください。提案は必ず「相手の〇〇について、△△と質問してみましょう。」というアドバイス形式で、あなた（ユーザーA）へのメッセージとして作成してください。提案文の中では、相手のニックネームを直接使わないでください。
-
-# 出力形式
-必ず、以下の例のようなJSON形式で出力してください。
-{{
-  "common_points": [
-    "福岡県出身",
-    "映画鑑賞が趣味",
-    "九州地方の大学"
-  ],
-  "topics": [
-    "相手の趣味である「カフェ巡り」について、「普段はどんなカフェに行かれるんですか？」と質問してみましょう。",
-    "出身地が同じ福岡県なので、「福岡で一番好きなラーメン屋さんはどこですか？」と聞いてみるのはどうでしょう。",
-    "相手はコーヒーの淹れ方が得意とのことなので、「おすすめの豆や淹れ方をぜひ教えてほしいです！」とお願いしてみましょう。"
-  ]
-}}
-"""
+    prompt = _build_conversation_prompt(profile_a, profile_b)
     
     try:
         # 3. Gemini APIを呼び出してテキスト生成
         # 応答時間の関係で，1.5-flashを使用
-        conv_starter_model = genai.GenerativeModel('gemini-2.5-flash')
-        response = conv_starter_model.generate_content(prompt)
-        ai_response_text = response.text
+        ai_response_text = _generate_text("create_conversation_starters", CONVERSATION_SYSTEM_INSTRUCTION, prompt)
         
         # 4. AIの返事からJSON部分だけを賢く抜き出す
         start_index = ai_response_text.find('{')
@@ -226,6 +396,82 @@ def create_conversation_starters(profile_a: Dict[str, Any], profile_b: Dict[str,
         print(f"会話のきっかけ生成でエラーが発生しました: {e}")
         raise ValueError("会話のきっかけ生成に失敗しました。") from e
 
+# 会話のきっかけのJSONで，逐次取り出す配列のキー（出力される順）
+CONVERSATION_STARTER_KEYS = ("common_points", "topics")
+
+def _parse_streamed_items(buffer: str, key: str) -> List[str]:
+    """
+    受信途中のJSON文字列から，指定したキーの配列のうち，閉じ引用符まで受信済みの文字列要素を取り出す。
+    """
+    match = re.search(rf'"{key}"\s*:\s*\[', buffer)
+    if not match:
+        return []
+    decoder = json.JSONDecoder()
+    items = []
+    position = match.end()
+    while True:
+        # 要素間の空白とカンマを読み飛ばす
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position >= len(buffer) or buffer[position] != '"':
+            break
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # 文字列の途中までしか受信していない
+            break
+        items.append(item)
+    return items
+
+def stream_conversation_starters(profile_a: Dict[str, Any], profile_b: Dict[str, Any]) -> Iterator[Tuple[str, str]]:
+    """
+    create_conversation_startersのストリーミング版。
+    Geminiの応答を逐次受信し，共通点・話題の各要素が完成した時点で (キー, 要素) の組をyieldする。
+    キーは "common_points" または "topics"。
+    """
+    prompt = _build_conversation_prompt(profile_a, profile_b)
+    yielded_counts = {key: 0 for key in CONVERSATION_STARTER_KEYS}
+    buffer = ""
+
+    def new_items():
+        for key in CONVERSATION_STARTER_KEYS:
+            items = _parse_streamed_items(buffer, key)
+            for item in items[yielded_counts[key]:]:
+                yielded_counts[key] += 1
+                yield key, item
+
+    try:
+        start = time.perf_counter()
+        stream = ai_clients.get_backend().generate_stream(
+            TEXT_GENERATION_MODEL_NAME, prompt, system_instruction=CONVERSATION_SYSTEM_INSTRUCTION
+        )
+        while True:
+            try:
+                buffer += next(stream)
+            except StopIteration as finished:
+                # ストリームの戻り値として，受信完了後のトークン数が返される
+                usage = finished.value or {}
+                break
+            yield from new_items()
+        _record_usage(
+            "stream_conversation_starters", prompt, usage.get("input_tokens", 0), usage.get("output_tokens", 0),
+            time.perf_counter() - start
+        )
+
+        # 受信完了後，全体をJSONとして解釈し，逐次解析で取りこぼした要素があれば返す
+        start_index = buffer.find('{')
+        end_index = buffer.rfind('}')
+        if start_index == -1 or end_index == -1:
+            raise ValueError("AIのレスポンスに有効なJSONが含まれていません。")
+        ai_response_dict = json.loads(buffer[start_index : end_index + 1])
+        for key in CONVERSATION_STARTER_KEYS:
+            for item in ai_response_dict.get(key, [])[yielded_counts[key]:]:
+                yielded_counts[key] += 1
+                yield key, item
+    except Exception as e:
+        print(f"会話のきっかけ生成でエラーが発生しました: {e}")
+        raise ValueError("会話のきっかけ生成に失敗しました。") from e
+
 # --- ここからがテスト用のコードです ---
 if __name__ == '__main__':
     # --- テスト1: 自己紹介文の生成 ---
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import cache_utils
+import embedding_generator
+
+# 各動物のカテゴリと，その動物らしさを表すキーワード
+# キーワードごとの埋め込みの平均（重心）を，その動物の代表ベクトルとして使う
+ANIMAL_PROTOTYPES: Dict[str, Dict[str, Any]] = {
+    "ライオン": {"category": "リーダーシップ全開タイプ", "keywords": ["リーダー", "統率力", "堂々としている", "部長", "責任感", "人前で話す"]},
+    "トラ": {"category": "リーダーシップ全開タイプ", "keywords": ["挑戦", "情熱", "行動力", "勝負", "スポーツ", "負けず嫌い"]},
+    "ワシ": {"category": "リーダーシップ全開タイプ", "keywords": ["高い目標", "視野が広い", "戦略", "起業", "経営", "ビジョン"]},
+    "オオカミ": {"category": "リーダーシップ全開タイプ", "keywords": ["仲間思い", "チームワーク", "団体競技", "キャプテン", "信頼", "絆"]},
+    "フクロウ": {"category": "頭脳派・ミステリアスタイプ", "keywords": ["読書", "知識", "研究", "哲学", "歴史", "博識"]},
+    "イルカ": {"category": "頭脳派・ミステリアスタイプ", "keywords": ["知的好奇心", "語学", "海", "科学", "留学", "コミュニケーション"]},
+    "カラス": {"category": "頭脳派・ミステリアスタイプ", "keywords": ["プログラミング", "分析", "謎解き", "ミステリー", "パズル", "ボードゲーム"]},
+    "タカ": {"category": "頭脳派・ミステリアスタイプ", "keywords": ["集中力", "観察", "データ分析", "数学", "将棋", "チェス"]},
+    "犬": {"category": "ムードメーカー・元気いっぱいタイプ", "keywords": ["人懐っこい", "友達", "飲み会", "明るい", "散歩", "誰とでも仲良く"]},
+    "サル": {"category": "ムードメーカー・元気いっぱいタイプ", "keywords": ["お笑い", "遊び", "ダンス", "盛り上げ役", "いたずら", "好奇心旺盛"]},
+    "ペンギン": {"category": "ムードメーカー・元気いっぱいタイプ", "keywords": ["愛嬌", "イベント", "音楽フェス", "水泳", "元気", "仲間と騒ぐ"]},
+    "カンガルー": {"category": "ムードメーカー・元気いっぱいタイプ", "keywords": ["運動", "エネルギッシュ", "フットワーク", "旅行", "アウトドア", "筋トレ"]},
+    "ウサギ": {"category": "癒し系・ほんわかタイプ", "keywords": ["かわいいもの", "優しい", "雑貨", "スイーツ", "聞き上手", "癒し"]},
+    "コアラ": {"category": "癒し系・ほんわかタイプ", "keywords": ["のんびり", "睡眠", "昼寝", "カフェ巡り", "リラックス", "おうち時間"]},
+    "パンダ": {"category": "癒し系・ほんわかタイプ", "keywords": ["おっとり", "食べること", "グルメ", "動物", "ほっこり", "料理"]},
+    "羊": {"category": "癒し系・ほんわかタイプ", "keywords": ["穏やか", "手芸", "編み物", "自然", "温泉", "平和"]},
+    "馬": {"category": "自由人・マイペースタイプ", "keywords": ["自由", "一人旅", "ドライブ", "乗馬", "ランニング", "バイク"]},
+    "ネコ": {"category": "自由人・マイペースタイプ", "keywords": ["マイペース", "気まぐれ", "一人の時間", "ゲーム", "アニメ", "猫"]},
+    "カメ": {"category": "自由人・マイペースタイプ", "keywords": ["コツコツ", "長く続ける", "盆栽", "釣り", "落ち着き", "慎重"]},
+    "カワウソ": {"category": "自由人・マイペースタイプ", "keywords": ["遊び心", "水辺", "キャンプ", "好きなことに夢中", "趣味人", "DIY"]},
+}
+
+# 1位と2位の類似度の差がこの値以上のときだけ，ローカルの分類結果を採用する（環境変数で調整できる）
+# 既定値は仮の値．benchmarks/bench_animal_classifier.py でAIによる分類との一致率を計測して決めること
+MIN_CONFIDENCE_MARGIN = float(os.getenv("ANIMAL_CLASSIFIER_MIN_MARGIN", "0.03"))
+# 事前計算した重心の保存先．デプロイ時に `python animal_classifier.py` を実行して作成する
+# （アプリは重心を計算しない．ファイルがない，または設定と一致しない場合はAIによる分類を使う）
+CENTROIDS_PATH = Path(os.getenv("ANIMAL_CENTROIDS_PATH", Path(__file__).resolve().parent / "animal_centroids.json"))
+
+_centroids_lock = threading.Lock()
+_centroids: Optional[np.ndarray] = None
+# 保存済みの重心を読み込もうとしたかどうか（使えないファイルを毎回読み直さない）
+_centroids_checked = False
+_animal_names: List[str] = list(ANIMAL_PROTOTYPES.keys())
+
+
+def _prototype_fingerprint() -> str:
+    """重心の計算に使った埋め込みモデルとキーワードを識別するハッシュ．"""
+    return cache_utils.make_cache_key(embedding_generator.EMBEDDING_MODEL, ANIMAL_PROTOTYPES)
+
+
+def compute_centroids() -> np.ndarray:
+    """
+    各動物のキーワードを埋め込み，動物ごとの平均を正規化した重心の行列（動物数×次元）を返す．
+    """
+    texts = []
+    owners = []
+    for index, animal_name in enumerate(_animal_names):
+        for keyword in ANIMAL_PROTOTYPES[animal_name]["keywords"]:
+            texts.append(keyword)
+            owners.append(index)
+
+    vectors = np.asarray(embedding_generator.embed_documents(texts, "RETRIEVAL_DOCUMENT"), dtype=np.float32)
+    owners = np.asarray(owners)
+
+    centroids = np.stack([vectors[owners == index].mean(axis=0) for index in range(len(_animal_names))])
+    return centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+
+
+def save_centroids(path: Path = CENTROIDS_PATH) -> None:
+    """
+    重心を計算してファイルに保存する．キーワードや埋め込みモデルを変えたら実行し直す．
+    """
+    centroids = compute_centroids()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "fingerprint": _prototype_fingerprint(),
+            "animal_names": _animal_names,
+            "centroids": centroids.tolist(),
+        }, f, ensure_ascii=False)
+
+
+def _load_centroids() -> Optional[np.ndarray]:
+    """
+    保存済みの重心を返す．ファイルがない場合や，現在の設定（埋め込みモデル・キーワード）と一致しない場合はNoneを返す．
+    重心の計算は全キーワードの埋め込みを伴うため，リクエストの処理中には行わない．
+    """
+    global _centroids, _centroids_checked
+    with _centroids_lock:
+        if not _centroids_checked:
+            _centroids_checked = True
+            try:
+                with open(CENTROIDS_PATH, encoding="utf-8") as f:
+                    saved = json.load(f)
+                if saved["fingerprint"] == _prototype_fingerprint() and saved["animal_names"] == _animal_names:
+                    _centroids = np.asarray(saved["centroids"], dtype=np.float32)
+                else:
+                    print(f"{CENTROIDS_PATH} の重心は現在の設定と一致しません（AIによる分類を使います）")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"動物の重心を読み込めませんでした（AIによる分類を使います）: {e}")
+        return _centroids
+
+
+def _build_reason(profile_data: Dict[str, Any], animal_name: str, category: str) -> str:
+    """
+    分類の理由を，ユーザーの入力と動物のキーワードから組み立てる．
+    """
+    interests = [hobby for hobby in profile_data.get("hobbies", []) if hobby][:2]
+    if profile_data.get("expert_topic"):
+        interests.append(profile_data["expert_topic"])
+    traits = "や".join(ANIMAL_PROTOTYPES[animal_name]["keywords"][:2])
+    if interests:
+        return f"「{'」「'.join(interests)}」といった関心が，{traits}が持ち味の{animal_name}と重なるため，{category}の{animal_name}タイプに分類しました。"
+    return f"{traits}が持ち味の{animal_name}に近い雰囲気があるため，{category}の{animal_name}タイプに分類しました。"
+
+
+def rank(profile_data: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+    """
+    ユーザー入力のキーワード文書の埋め込みを各動物の重心と比べ，(最も近い動物, 1位と2位の類似度の差) を返す．
+    保存済みの重心がない場合や，キーワードがない場合はNoneを返す（埋め込みのAPIも呼ばない）．
+    """
+    centroids = _load_centroids()
+    if centroids is None:
+        return None
+    query = embedding_generator.generate_embedding_query(profile_data)
+    if not query:
+        return None
+    query = np.asarray(query, dtype=np.float32)
+    if query.shape[0] != centroids.shape[1]:
+        return None
+    scores = centroids @ (query / np.linalg.norm(query))
+    first, second = np.argsort(scores)[::-1][:2]
+    return _animal_names[first], float(scores[first] - scores[second])
+
+
+def classify(profile_data: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """
+    最も近い動物に分類する．1位と2位の差がMIN_CONFIDENCE_MARGIN未満（自信がない）場合や，
+    rankがNoneを返す場合はNoneを返す（AIによる分類に切り替える）．
+    """
+    ranked = rank(profile_data)
+    if ranked is None or ranked[1] < MIN_CONFIDENCE_MARGIN:
+        return None
+
+    animal_name = ranked[0]
+    category = ANIMAL_PROTOTYPES[animal_name]["category"]
+    return {
+        "animal_name": animal_name,
+        "animal_category": category,
+        "animal_reason": _build_reason(profile_data, animal_name, category),
+    }
+
+
+if __name__ == "__main__":
+    # 重心を事前計算して保存する（デプロイの手順で実行する）
+    save_centroids()
+    print(f"✅ {CENTROIDS_PATH} に{len(_animal_names)}種類の動物の重心を保存しました。")
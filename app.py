@@ -1,5 +1,5 @@
 import streamlit as st
-from supabase import create_client, Client
+from supabase import Client
 from config import SUPABASE_URL, SUPABASE_KEY  # 設定情報をインポート
 import supabase_utils  # DB操作関数をインポート
 import profile_manager
@@ -8,11 +8,24 @@ import sys
 import os
 
 # --- アプリケーションの初期化処理 ---
-# Supabaseへの接続を確立する
-if 'supabase_client' not in st.session_state:
-    st.session_state.supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    # Profile_managerの初期化
-    st.session_state.profile_manager = profile_manager.ProfileManager(st.session_state.supabase_client)
+@st.cache_resource
+def get_shared_supabase_client() -> Client:
+    """
+    全セッションで共有するSupabaseクライアントを返す（プロセスで1回だけ作成し，接続を使い回す）．
+    """
+    return supabase_utils.create_shared_client(SUPABASE_URL, SUPABASE_KEY)
+
+def create_session_supabase_client() -> Client:
+    """
+    このセッション専用のSupabaseクライアントを作成する．ログインしたときに初めて作る．
+    """
+    return supabase_utils.create_session_client(SUPABASE_URL, SUPABASE_KEY)
+
+if 'profile_manager' not in st.session_state:
+    # Profile_managerの初期化．公開されたプロフィールの読み取りは共有のクライアントで行い，ログイン状態はセッションごとに分ける
+    st.session_state.profile_manager = profile_manager.ProfileManager(
+        get_shared_supabase_client(), session_client_factory=create_session_supabase_client
+    )
 
 # 認証状態の初期化
 if 'user' not in st.session_state:
@@ -95,7 +108,7 @@ else:
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from views import all_profiles_view, my_page_view, create_profile_view,profile_detail_view
+# 各ページのモジュールは，そのページを表示するときに初めて読み込む（初回表示を速くするため）
 
 st.set_page_config(
     page_title="内定者図鑑ジェネレーター",
@@ -117,10 +130,12 @@ render_nav_banner(pages=pages)
 if 'active_page' not in st.session_state:
     st.session_state.active_page = "みんなの図鑑"
 if st.session_state.active_page == "みんなの図鑑":
+    from views import all_profiles_view
     all_profiles_view.render_page()
 
 elif st.session_state.active_page == "マイページ":
     if st.session_state.user and st.session_state.profile_exists:
+        from views import my_page_view
         my_page_view.render_page()
     else:
         st.warning("マイページを表示するには、プロフィールを作成する必要があります。")
@@ -128,9 +143,11 @@ elif st.session_state.active_page == "マイページ":
 
 elif st.session_state.active_page == "プロフィール作成":
     if st.session_state.user:
+        from views import create_profile_view
         create_profile_view.render_page()
     else:
         st.warning("プロフィールを作成・編集するには、サイドバーからログインしてください。")
 elif st.session_state.active_page == "プロフィール詳細":
+    from views import profile_detail_view
     profile_detail_view.render_page()
     
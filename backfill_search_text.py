@@ -3,9 +3,17 @@
 import os
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from rich.progress import track
+from rich.progress import Progress
 from typing import List
 
+import supabase_utils
+
+# searchable_textの計算に使う列（サイズの大きい埋め込みは取得しない）
+SEARCH_TEXT_COLUMNS = (
+    "id, last_name, first_name, nickname, catchphrase, introduction_text, university, hometown, "
+    "happy_topic, expert_topic, hobbies, tags"
+)
+
 def create_searchable_text(profile: dict) -> str:
     """
     プロフィール辞書から、検索用の結合テキストを生成する。
@@ -46,8 +54,8 @@ def main():
     try:
         # 3. 更新に必要な全プロフィールデータを取得
         print("🔄 全ユーザーのプロフィールを取得中...")
-        # IDだけでなく、テキスト生成に必要な全カラムを取得
-        response = supabase_client.table('profiles').select("*").execute()
+        # IDと、テキスト生成に必要なカラムだけを取得
+        response = supabase_client.table('profiles').select(SEARCH_TEXT_COLUMNS).execute()
         
         if not response.data:
             print("対象のプロフィールが存在しません。")
@@ -56,18 +64,24 @@ def main():
         profiles: List[dict] = response.data
         print(f"✅ {len(profiles)}件のプロフィールが見つかりました。")
 
-        # 4. 各プロフィールのsearchable_textを計算し、DBを更新
-        for profile in track(profiles, description="searchable_textを更新中..."):
-            profile_id = profile['id']
+        # 4. 各プロフィールのsearchable_textを計算し、まとめてDBを更新
+        #    （IDとsearchable_textだけを送るため，取得した後に他の列が編集されても上書きしない．
+        #     更新だけを行うため，取得した後に削除されたユーザーは復活しない）
+        rows = [
             # Python側で検索用テキストを生成
-            search_text = create_searchable_text(profile)
-            
-            # 計算したテキストで、searchable_textカラムを明示的に更新
-            supabase_client.table('profiles').update({
-                "searchable_text": search_text
-            }).eq('id', profile_id).execute()
+            {"id": profile['id'], "searchable_text": create_searchable_text(profile)}
+            for profile in profiles
+        ]
+        with Progress() as progress:
+            task = progress.add_task("searchable_textを更新中...", total=len(rows))
+            result = supabase_utils.bulk_update_profiles(
+                supabase_client, rows, on_progress=lambda count: progress.advance(task, count)
+            )
 
-        print("\n🎉 全てのプロフィールのsearchable_textカラムの更新が完了しました！")
+        if result["failed"]:
+            failed_ids = [failure["key"]["id"] for failure in result["failed"]]
+            print(f"\n⚠️ {len(failed_ids)}件の更新に失敗しました: {', '.join(failed_ids)}")
+        print(f"\n🎉 {len(result['data'])}件のプロフィールのsearchable_textカラムの更新が完了しました！")
 
     except Exception as e:
         print(f"\n❌ エラーが発生しました: {e}")
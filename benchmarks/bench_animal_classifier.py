@@ -0,0 +1,102 @@
+"""
+ローカルの動物分類器（animal_classifier）とAIによる分類の一致率のベンチマーク．
+
+AIによる分類を正解として，ローカルの分類器が1位と2位の類似度の差（margin）のしきい値ごとに
+どれだけのプロフィールを分類でき（coverage），そのうち動物・カテゴリがどれだけ一致するか（agreement）を計測する．
+ANIMAL_CLASSIFIER_MIN_MARGIN と LOCAL_ANIMAL_CLASSIFIER_ENABLED を決めるときに使う．
+
+--input には，ユーザー入力とAIによる分類結果（animal_name, animal_category）を持つプロフィールの
+JSON配列を指定する（profilesテーブルから書き出したものなど）．
+--relabel を指定すると，保存済みの分類結果を使わず，AIに分類し直させる．
+--input を指定しない場合は，語彙から作ったプロフィールをAIに分類させる．
+
+既定ではローカルスタブ（llm_backends.LocalStubBackend）を使う．スタブの分類結果は入力と無関係なため，
+一致率は --backend gemini で確認すること（APIキーが必要）．
+
+実行方法:
+    python benchmarks/bench_animal_classifier.py [--input profiles.json] [--relabel] [--profiles 200] [--backend local]
+"""
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ai_clients  # noqa: E402
+import ai_utils  # noqa: E402
+import animal_classifier  # noqa: E402
+from llm_backends import LocalStubBackend  # noqa: E402
+
+MARGINS = (0.0, 0.01, 0.02, 0.03, 0.05, 0.08)
+VOCABULARY = [
+    "カフェ巡り", "映画鑑賞", "読書", "プログラミング", "登山", "キャンプ", "料理", "ゲーム", "アニメ", "音楽フェス",
+    "ギター", "ピアノ", "サッカー", "野球", "バスケ", "テニス", "筋トレ", "ヨガ", "旅行", "写真",
+    "釣り", "将棋", "ボードゲーム", "謎解き", "温泉", "スイーツ", "ラーメン", "コーヒー", "ワイン", "猫",
+    "犬", "ダンス", "カラオケ", "お笑い", "漫画", "歴史", "哲学", "語学", "留学", "投資",
+]
+
+
+def make_profiles(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [
+        {
+            "hobbies": rng.sample(VOCABULARY, rng.randint(2, 4)),
+            "expert_topic": rng.choice(VOCABULARY),
+            "happy_topic": rng.choice(VOCABULARY),
+        }
+        for _ in range(count)
+    ]
+
+
+def llm_label(profile: dict) -> dict:
+    # ローカルの分類器を通さずにAIに分類させる
+    ai_utils.LOCAL_ANIMAL_CLASSIFIER_ENABLED = False
+    return ai_utils._request_animal_type(profile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルの動物分類器とAIによる分類の一致率を計測します。")
+    parser.add_argument("--input", type=Path, help="AIによる分類結果を持つプロフィールのJSON配列")
+    parser.add_argument("--relabel", action="store_true", help="保存済みの分類結果を使わず，AIに分類し直させる")
+    parser.add_argument("--profiles", type=int, default=200, help="--input を指定しない場合に作るプロフィールの数")
+    parser.add_argument("--backend", choices=["local", "gemini"], default="local", help="埋め込み・分類に使うバックエンド")
+    args = parser.parse_args()
+
+    if args.backend == "local":
+        ai_clients.set_backend(LocalStubBackend())
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            profiles = json.load(f)
+    else:
+        profiles = make_profiles(args.profiles)
+
+    labels = []
+    for profile in profiles:
+        if args.relabel or not args.input or not profile.get("animal_name"):
+            labels.append(llm_label(profile))
+        else:
+            labels.append({"animal_name": profile["animal_name"], "animal_category": profile.get("animal_category")})
+
+    # 保存済みのファイルではなく，現在の設定で計算した重心を使う
+    animal_classifier._centroids = animal_classifier.compute_centroids()
+    animal_classifier._centroids_checked = True
+    ranked = [animal_classifier.rank(profile) for profile in profiles]
+    categories = {name: p["category"] for name, p in animal_classifier.ANIMAL_PROTOTYPES.items()}
+
+    print(f"profiles: {len(profiles)}  backend: {args.backend}")
+    print(f"{'margin':>7} {'coverage':>9} {'animal':>7} {'category':>9}")
+    for margin in MARGINS:
+        answered = [(r[0], label) for r, label in zip(ranked, labels) if r is not None and r[1] >= margin]
+        coverage = len(answered) / len(profiles) if profiles else 0.0
+        animal = sum(name == label["animal_name"] for name, label in answered) / len(answered) if answered else 0.0
+        category = (
+            sum(categories[name] == label.get("animal_category") for name, label in answered) / len(answered)
+            if answered else 0.0
+        )
+        print(f"{margin:>7.2f} {coverage:>9.3f} {animal:>7.3f} {category:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+app.py のコールドスタート時間を計測するベンチマーク．
+
+それぞれの計測は新しいPythonプロセスで行うため，モジュールの読み込み時間を含んだ「初回表示」の時間になる．
+- 主要モジュールの import にかかる時間（google.generativeai・NumPyを読み込んだかどうかも表示する）
+- 未ログインの訪問者が「みんなの図鑑」を初めて表示するまでの時間（streamlit.testing の AppTest で実行）
+
+Supabaseには接続できないアドレスを指定するため，DBへのアクセスは即座に失敗する（画面にはエラーが表示される）．
+
+実行方法:
+    python benchmarks/bench_cold_start.py [--repeat 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+MODULES = [
+    "supabase_utils",
+    "ai_utils",
+    "embedding_generator",
+    "profile_manager",
+]
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "genai_loaded": "google.generativeai" in sys.modules, "numpy_loaded": "numpy" in sys.modules}}))
+"""
+
+APP_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("app.py", default_timeout=120)
+app.secrets["SUPABASE_URL"] = "http://127.0.0.1:9"
+app.secrets["SUPABASE_KEY"] = "benchmark"
+app.secrets["GEMINI_API_KEY"] = "benchmark"
+app.run()
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "genai_loaded": "google.generativeai" in sys.modules, "numpy_loaded": "numpy" in sys.modules}))
+"""
+
+
+def run_snippet(snippet: str) -> dict:
+    """新しいPythonプロセスでコードを実行し，最後の行に出力されたJSONを返す．"""
+    completed = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure(label: str, snippet: str, repeat: int) -> None:
+    results = [run_snippet(snippet) for _ in range(repeat)]
+    seconds = [result["seconds"] for result in results]
+    print(
+        f"{label:<40} median {statistics.median(seconds) * 1000:8.1f} ms"
+        f"  min {min(seconds) * 1000:8.1f} ms"
+        f"  google.generativeai loaded: {results[0]['genai_loaded']}"
+        f"  numpy loaded: {results[0]['numpy_loaded']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="app.py のコールドスタート時間を計測します。")
+    parser.add_argument("--repeat", type=int, default=5, help="各項目の計測回数")
+    args = parser.parse_args()
+
+    for module in MODULES:
+        measure(f"import {module}", IMPORT_SNIPPET.format(module=module), args.repeat)
+    measure("app.py first render (anonymous)", APP_SNIPPET, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+埋め込みの次元削減・量子化による検索精度（recall@k）とサイズのベンチマーク．
+
+全次元・単精度のベクトルでの類似上位k人を正解として，
+次元削減（先頭の次元だけを残してL2正規化し直す）や float16 / int8 での保存で，
+同じ上位k人をどれだけ取り出せるかを計測する．
+
+既定ではローカルスタブ（llm_backends.LocalStubBackend）の埋め込みを使う．
+--backend gemini を指定すると，Gemini APIで実際の埋め込みを生成して計測する（APIキーが必要）．
+スタブの埋め込みは先頭の次元に情報が集まるように学習されたものではないため，
+次元削減の精度は --backend gemini で確認すること（量子化の影響はスタブでも確認できる）．
+
+実行方法:
+    python benchmarks/bench_embedding_recall.py [--profiles 2000] [--queries 200] [--k 10] [--backend local]
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ai_clients  # noqa: E402
+import embedding_codec  # noqa: E402
+import embedding_generator  # noqa: E402
+from llm_backends import LocalStubBackend  # noqa: E402
+
+FULL_DIMENSIONS = 3072
+VOCABULARY = [
+    "カフェ巡り", "映画鑑賞", "読書", "プログラミング", "登山", "キャンプ", "料理", "ゲーム", "アニメ", "音楽フェス",
+    "ギター", "ピアノ", "サッカー", "野球", "バスケ", "テニス", "筋トレ", "ヨガ", "旅行", "写真",
+    "釣り", "将棋", "ボードゲーム", "謎解き", "温泉", "スイーツ", "ラーメン", "コーヒー", "ワイン", "猫",
+    "犬", "ダンス", "カラオケ", "お笑い", "漫画", "歴史", "哲学", "語学", "留学", "投資",
+]
+HOMETOWNS = ["北海道", "東京都", "大阪府", "福岡県", "愛知県", "京都府", "沖縄県", "宮城県"]
+
+
+def make_documents(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.sample(VOCABULARY, rng.randint(3, 6)) + [rng.choice(HOMETOWNS)])
+        for _ in range(count)
+    ]
+
+
+def top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    # 自分自身は除外する
+    np.fill_diagonal(scores[:, :len(queries)], -np.inf)
+    return np.argpartition(-scores, k, axis=1)[:, :k]
+
+
+def recall(truth: np.ndarray, found: np.ndarray) -> float:
+    return float(np.mean([len(set(t) & set(f)) / len(t) for t, f in zip(truth, found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込みの次元削減・量子化によるrecall@kとサイズを計測します。")
+    parser.add_argument("--profiles", type=int, default=2000, help="検索対象のプロフィールの数")
+    parser.add_argument("--queries", type=int, default=200, help="検索に使うプロフィールの数")
+    parser.add_argument("--k", type=int, default=10, help="上位何人までを比較するか")
+    parser.add_argument("--backend", choices=["local", "gemini"], default="local", help="埋め込みの生成に使うバックエンド")
+    args = parser.parse_args()
+
+    if args.backend == "local":
+        ai_clients.set_backend(LocalStubBackend(embedding_dimensions=FULL_DIMENSIONS))
+    documents = make_documents(args.profiles)
+    full = embedding_codec.l2_normalize(embedding_generator.embed_documents(documents, "RETRIEVAL_DOCUMENT"))
+    queries = full[:args.queries]
+    truth = top_k(full, queries, args.k)
+
+    print(f"profiles: {len(full)}  queries: {len(queries)}  k: {args.k}  backend: {args.backend}")
+    print(f"{'dimensions':>10} {'format':>8} {'bytes/vector':>13} {'recall@k':>9}")
+    for dimensions in (full.shape[1], 768, 256):
+        reduced = embedding_codec.l2_normalize(full[:, :dimensions])
+        for compact_format in ("float32", "float16", "int8"):
+            if compact_format == "float32":
+                restored = reduced
+                size = reduced.shape[1] * 4
+            elif compact_format == "float16":
+                restored = reduced.astype(np.float16).astype(np.float32)
+                size = reduced.shape[1] * 2
+            else:
+                quantized, scales = embedding_codec.quantize_int8(reduced)
+                restored = embedding_codec.dequantize_int8(quantized, scales)
+                size = reduced.shape[1] + 4
+            found = top_k(restored, restored[:args.queries], args.k)
+            print(f"{dimensions:>10} {compact_format:>8} {size:>13} {recall(truth, found):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+埋め込み生成のベンチマーク．1件ずつの生成（generate_embedding_text）と
+バッチ埋め込み（generate_embeddings_batch）で，全ユーザー分のベクトル化にかかる時間を比べる．
+
+Gemini APIの代わりにローカルスタブ（llm_backends.LocalStubBackend）を使い，
+1リクエストあたりの遅延を --latency で与える．
+
+実行方法:
+    python benchmarks/bench_embeddings.py [--profiles 1000] [--latency 0.3]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ai_clients  # noqa: E402
+import embedding_generator  # noqa: E402
+from llm_backends import LocalStubBackend  # noqa: E402
+
+
+def make_profile(index: int) -> dict:
+    return {
+        "hobbies": ["カフェ巡り", f"趣味{index % 17}"],
+        "happy_topic": f"話題{index % 13}", "expert_topic": f"得意なこと{index % 11}",
+        "hometown": "福岡県",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="1件ずつの埋め込みとバッチ埋め込みの所要時間を比べます。")
+    parser.add_argument("--profiles", type=int, default=1000, help="ベクトル化するプロフィールの数")
+    parser.add_argument("--latency", type=float, default=0.3, help="スタブの1リクエストあたりの遅延（秒）")
+    parser.add_argument("--sequential-sample", type=int, default=20,
+                        help="1件ずつの方式で実際に計測する件数（全件の時間はこれから推定する）")
+    args = parser.parse_args()
+
+    ai_clients.set_backend(LocalStubBackend(latency_seconds=args.latency))
+    profiles = [make_profile(index) for index in range(args.profiles)]
+
+    sample = profiles[:args.sequential_sample]
+    start = time.perf_counter()
+    for profile in sample:
+        embedding_generator.generate_embedding_text(profile)
+    sequential = (time.perf_counter() - start) / len(sample) * len(profiles)
+
+    start = time.perf_counter()
+    embeddings = embedding_generator.generate_embeddings_batch(profiles)
+    batch = time.perf_counter() - start
+
+    print(f"profiles: {len(embeddings)}  stub latency: {args.latency * 1000:.0f} ms"
+          f"  batch size: {embedding_generator.EMBEDDING_BATCH_SIZE}"
+          f"  concurrency: {embedding_generator.EMBEDDING_BATCH_CONCURRENCY}")
+    print(f"sequential (estimated): {sequential:.1f} s")
+    print(f"batch: {batch:.2f} s  ({sequential / batch:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
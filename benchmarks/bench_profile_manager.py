@@ -0,0 +1,88 @@
+"""
+ProfileManager の負荷試験・オーバーヘッド計測ベンチマーク．
+
+Gemini APIの代わりにローカルスタブ（llm_backends.LocalStubBackend）を使い，
+Supabaseへの書き込みはメモリ上の辞書に置き換えて，create_profile を並列に実行する．
+スタブの遅延を0にすればアプリ側の処理時間だけを，遅延を与えればGeminiの遅延を模した状態での
+スループットを計測できる．
+
+実行方法:
+    python benchmarks/bench_profile_manager.py [--profiles 200] [--concurrency 16] [--latency 0.0]
+"""
+import argparse
+import statistics
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import MagicMock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ai_clients  # noqa: E402
+import ai_utils  # noqa: E402
+import supabase_utils  # noqa: E402
+from llm_backends import LocalStubBackend  # noqa: E402
+from profile_manager import ProfileManager  # noqa: E402
+
+
+def make_user_input(index: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "last_name": "山田", "first_name": f"テスト{index}", "nickname": f"テスト{index}",
+        "birth_date": "2002-08-10", "university": "福岡大学", "hometown": "福岡県",
+        "hobbies": ["カフェ巡り", f"趣味{index % 17}"],
+        "happy_topic": f"話題{index % 13}", "expert_topic": f"得意なこと{index % 11}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ProfileManager.create_profile の負荷試験を行います。")
+    parser.add_argument("--profiles", type=int, default=200, help="作成するプロフィールの数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同時に作成する数（同時に操作するユーザー数に相当）")
+    parser.add_argument("--latency", type=float, default=0.0, help="スタブの1呼び出しあたりの遅延（秒）")
+    args = parser.parse_args()
+
+    ai_clients.set_backend(LocalStubBackend(latency_seconds=args.latency))
+    # DBへの書き込みはメモリ上に保存する
+    stored = {}
+
+    def add_new_profile(client, profile_data):
+        stored[profile_data["id"]] = profile_data
+        return [profile_data]
+
+    supabase_utils.add_new_profile = add_new_profile
+    manager = ProfileManager(MagicMock())
+    ai_utils.ai_result_cache.clear()
+
+    latencies = []
+
+    def create(index: int) -> None:
+        start = time.perf_counter()
+        manager.create_profile(make_user_input(index))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(create, range(args.profiles)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"profiles: {len(stored)}  concurrency: {args.concurrency}  stub latency: {args.latency * 1000:.0f} ms")
+    print(f"throughput: {len(stored) / elapsed:.1f} profiles/s  total: {elapsed:.2f} s")
+    print(
+        f"latency median: {statistics.median(latencies) * 1000:.1f} ms"
+        f"  p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms"
+        f"  max: {latencies[-1] * 1000:.1f} ms"
+    )
+    # スタブはトークン数の代わりに文字数を返す
+    for function_name, usage in ai_utils.get_usage_stats().items():
+        print(
+            f"{function_name}: calls {usage['calls']}  avg input {usage['avg_input_tokens']:.0f}"
+            f"  avg output {usage['avg_output_tokens']:.0f}  avg prompt chars {usage['avg_prompt_chars']:.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
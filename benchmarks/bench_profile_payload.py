@@ -0,0 +1,73 @@
+"""
+一覧ページのプロフィール取得の転送量とJSONの解析時間のベンチマーク．
+全ての列（select("*")，埋め込みを含む）と，カードの列（PROFILE_CARD_COLUMNS）だけを取得した場合を比べる．
+
+PostgRESTが返すJSONを，合成したプロフィールから作って計測する（pgvectorの列は "[0.1,0.2,...]" 形式の文字列で返る）．
+
+実行方法:
+    python benchmarks/bench_profile_payload.py [--profiles 500] [--dimensions 3072]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import supabase_utils  # noqa: E402
+
+
+def make_row(index: int, dimensions: int, rng: random.Random) -> dict:
+    return {
+        "id": f"00000000-0000-0000-0000-{index:012d}",
+        "nickname": f"ユーザー{index}", "last_name": "山田", "first_name": "太郎",
+        "profile_image_url": f"https://example.com/images/{index}.png",
+        "catchphrase": "カフェと登山が好きな理系大学生", "tags": ["#カフェ巡り", "#登山", "#写真"],
+        "introduction_text": "はじめまして！週末はカフェ巡りや登山をしています。" * 4,
+        "animal_name": "フクロウ", "animal_category": "頭脳派・ミステリアスタイプ",
+        "animal_reason": "知的な探究心が強いため，フクロウタイプに分類しました。",
+        "birth_date": "2003-04-01", "university": "九州大学", "hometown": "福岡県",
+        "hobbies": ["カフェ巡り", "登山", "写真"], "happy_topic": "おすすめのカフェ", "expert_topic": "山の天気",
+        "embedding": "[" + ",".join(f"{rng.uniform(-0.05, 0.05):.9f}" for _ in range(dimensions)) + "]",
+        "embedding_hash": "0" * 64, "embedding_version": "gemini-embedding-001/default/keywords-v1",
+    }
+
+
+def measure(rows: list, repeats: int = 5):
+    body = json.dumps(rows, ensure_ascii=False).encode("utf-8")
+    start = time.perf_counter()
+    for _ in range(repeats):
+        json.loads(body)
+    return len(body), (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="一覧ページの取得の転送量とJSONの解析時間を比べます。")
+    parser.add_argument("--profiles", type=int, default=500, help="プロフィールの数")
+    parser.add_argument("--dimensions", type=int, default=3072, help="埋め込みの次元数")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    full_rows = [make_row(index, args.dimensions, rng) for index in range(args.profiles)]
+    projections = {
+        "select(*)": None,
+        "detail": supabase_utils.PROFILE_DETAIL_COLUMNS,
+        "card": supabase_utils.PROFILE_CARD_COLUMNS,
+    }
+
+    print(f"profiles: {args.profiles}  dimensions: {args.dimensions}")
+    print(f"{'columns':>10} {'bytes':>12} {'decode(ms)':>11}")
+    for label, columns in projections.items():
+        if columns is None:
+            rows = full_rows
+        else:
+            names = [name.strip() for name in columns.split(",")]
+            rows = [{name: row[name] for name in names} for row in full_rows]
+        size, decode_ms = measure(rows)
+        print(f"{label:>10} {size:>12,} {decode_ms:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+類似検索の索引（厳密な VectorIndex と近似の IVFIndex）の recall@k と検索時間のベンチマーク．
+
+クラスタ構造を持つ合成プロフィールのベクトルを 1,000 / 10,000 / 100,000 件作り，
+厳密な検索の上位k人を正解として，IVFの検索がどれだけ同じ人を返せるかと，1回あたりの検索時間を比べる．
+n_probe（検索時に調べるクラスタの数）を変えて，精度と速度の釣り合いを確認できる．
+
+実行方法:
+    python benchmarks/bench_vector_index.py [--sizes 1000 10000 100000] [--dimensions 256] [--queries 200] [--k 10]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vector_index import IVFIndex, VectorIndex  # noqa: E402
+
+
+def make_vectors(count: int, dimensions: int, seed: int = 0) -> np.ndarray:
+    """趣味の近い人同士が固まるように，いくつかの中心の周りにばらつかせたベクトルを作る．"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, count // 200), dimensions)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=count)
+    return centers[labels] + rng.normal(scale=2.0, size=(count, dimensions)).astype(np.float32)
+
+
+def build(index: VectorIndex, vectors: np.ndarray) -> float:
+    start = time.perf_counter()
+    for i, vector in enumerate(vectors):
+        index.upsert(f"user-{i}", vector)
+    return time.perf_counter() - start
+
+
+def run_queries(index: VectorIndex, queries: np.ndarray, k: int):
+    results = []
+    start = time.perf_counter()
+    for i, query in enumerate(queries):
+        results.append({item_id for item_id, _, _ in index.search(query, k=k, exclude_ids=[f"user-{i}"])})
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="厳密な索引とIVFの索引のrecall@kと検索時間を比べます。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="プロフィールの数")
+    parser.add_argument("--dimensions", type=int, default=256, help="ベクトルの次元数")
+    parser.add_argument("--queries", type=int, default=200, help="検索に使うプロフィールの数")
+    parser.add_argument("--k", type=int, default=10, help="上位何人までを比較するか")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 4, 8, 16, 32], help="IVFで調べるクラスタの数")
+    args = parser.parse_args()
+
+    print(f"dimensions: {args.dimensions}  queries: {args.queries}  k: {args.k}")
+    print(f"{'profiles':>9} {'index':>12} {'build(s)':>9} {'ms/query':>9} {'recall@k':>9}")
+    for size in args.sizes:
+        vectors = make_vectors(size, args.dimensions)
+        queries = vectors[:args.queries]
+
+        exact = VectorIndex()
+        exact_build = build(exact, vectors)
+        truth, exact_ms = run_queries(exact, queries, args.k)
+        print(f"{size:>9} {'exact':>12} {exact_build:>9.2f} {exact_ms:>9.3f} {1.0:>9.3f}")
+        del exact
+
+        ivf = IVFIndex()
+        ivf_build = build(ivf, vectors)
+        for n_probe in args.probes:
+            ivf.n_probe = n_probe
+            found, ivf_ms = run_queries(ivf, queries, args.k)
+            recall = np.mean([len(t & f) / len(t) for t, f in zip(truth, found)])
+            print(f"{size:>9} {f'ivf/{n_probe}':>12} {ivf_build:>9.2f} {ivf_ms:>9.3f} {recall:>9.3f}")
+
+        # 保存した索引を読み込めば，起動時にk-meansの学習をやり直さずに済む
+        with tempfile.TemporaryDirectory() as directory:
+            path = str(Path(directory) / "index.npz")
+            ivf.save(path)
+            start = time.perf_counter()
+            IVFIndex.load(path)
+            print(f"{size:>9} {'ivf load':>12} {time.perf_counter() - start:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# キャッシュに値が存在しないことを表す番兵
+_MISSING = object()
+
+
+def make_cache_key(*parts: Any) -> str:
+    """
+    任意の値の組から，内容に基づく正規化されたハッシュキーを生成する．
+    辞書のキー順や空白の違いに左右されないよう，JSONに正規化してからハッシュ化する．
+    """
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """
+    有効期限(TTL)付きのLRUキャッシュ．スレッドセーフで，ヒット・ミス・追い出しの回数を記録する．
+    """
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """キーに対応する値を返す．存在しない・期限切れの場合はdefaultを返す．"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """値を保存する．上限を超えた場合は最も古く使われたものから追い出す．"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        """キーに対応する値を削除する．"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate: Callable[[Hashable], bool]) -> int:
+        """条件に一致するキーをまとめて削除し，削除した件数を返す．"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        """全ての値と統計情報を消去する．"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        """ヒット・ミス・追い出しの回数と，現在の件数を返す．"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class SQLiteCache:
+    """
+    SQLiteファイルに値をJSONで保存する永続キャッシュ．
+    Streamlitの再起動後も値が残り，同じファイルを参照する複数のプロセス間で共有できる．
+    """
+    def __init__(self, path: str, ttl: Optional[float] = None):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL"
+                ")"
+            )
+            self._conn.commit()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """キーに対応する値を返す．存在しない・期限切れの場合はdefaultを返す．"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return default
+            value, expires_at = row
+            if expires_at is not None and expires_at <= time.time():
+                self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                self._conn.commit()
+                return default
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """値をJSONとして保存する．"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, serialized, expires_at)
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        """キーに対応する値を削除する．"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """全ての値を消去する．"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries")
+            self._conn.commit()
+
+
+class TieredCache:
+    """
+    メモリ上のTTLCacheを1段目，SQLiteCacheを2段目（任意）とする2段構成のキャッシュ．
+    2段目でヒットした値は1段目にも載せる．
+    """
+    def __init__(self, memory: TTLCache, persistent: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.persistent = persistent
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.persistent is not None:
+            try:
+                value = self.persistent.get(key, _MISSING)
+            except sqlite3.Error as e:
+                print(f"永続キャッシュの読み込み中にエラーが発生しました: {e}")
+                value = _MISSING
+            if value is not _MISSING:
+                self.memory.set(key, value)
+                return value
+        return default
+
+    def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            try:
+                self.persistent.set(key, value)
+            except sqlite3.Error as e:
+                # 永続化に失敗してもメモリ上のキャッシュは有効なので，処理は続ける
+                print(f"永続キャッシュへの書き込み中にエラーが発生しました: {e}")
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.persistent is not None:
+            self.persistent.delete(key)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+
+class SingleFlight:
+    """
+    同じキーの処理が同時に要求された場合に，最初の呼び出しだけを実行し，
+    後から来た呼び出しにはその結果（または例外）を共有する．
+    結果はキャッシュしないため，処理が終わった後の呼び出しは再び実行される．
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def join(self, key: Hashable) -> Tuple[Future, bool]:
+        """
+        キーに対応する実行中の処理のFutureと，呼び出し側が実行役かどうかを返す．
+        実行役は，処理が終わったら必ずfinishを呼び出すこと．
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self.executed += 1
+            return future, True
+
+    def finish(self, key: Hashable, future: Future, result: Any = None,
+               error: Optional[BaseException] = None) -> None:
+        """
+        実行役の処理の結果（または例外）を，待っている呼び出しに渡す．
+        """
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        キーに対応する処理が実行中ならその結果を待って返し，そうでなければfnを実行して返す．
+        待っていた呼び出しには，呼び出し側での変更が波及しないよう結果のコピーを返す．
+        """
+        future, is_leader = self.join(key)
+        if not is_leader:
+            return copy.deepcopy(future.result())
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """実行した回数，実行中の処理の結果を共有した回数，現在実行中の件数を返す．"""
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "shared": self.shared,
+                "in_flight": len(self._in_flight),
+            }
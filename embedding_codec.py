@@ -0,0 +1,85 @@
+import base64
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 埋め込みのコンパクトな保存形式
+#   "float16": 各要素を半精度浮動小数点数で保存する（サイズは単精度の1/2）
+#   "int8": ベクトルごとの最大絶対値を127に対応させた8bit整数と，その倍率で保存する（サイズは単精度の1/4）
+# DBには "形式:倍率:Base64" の文字列として保存する（float16では倍率は空）
+COMPACT_FORMATS = ("float16", "int8")
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    ベクトル（または行列の各行）をL2ノルムが1になるように正規化する．ノルムが0のベクトルはそのまま返す．
+    次元を削減した埋め込みは正規化されていないため，コサイン類似度を内積で求める前に使う．
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    各行を8bit整数に量子化し，(整数の行列, 行ごとの倍率) を返す．元の値は 整数 × 倍率 で近似できる．
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def dequantize_int8(quantized: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    quantize_int8で量子化した行列を，単精度の行列に戻す．
+    """
+    return quantized.astype(np.float32) * np.asarray(scales, dtype=np.float32)[:, None]
+
+
+def encode_embedding(vector: Sequence[float], compact_format: str) -> str:
+    """
+    埋め込みを，DBに保存するコンパクトな文字列に変換する．
+    """
+    if compact_format == "float16":
+        data = np.asarray(vector, dtype=np.float16).tobytes()
+        return f"float16::{base64.b64encode(data).decode('ascii')}"
+    if compact_format == "int8":
+        quantized, scales = quantize_int8(np.asarray(vector, dtype=np.float32))
+        return f"int8:{float(scales[0])!r}:{base64.b64encode(quantized.tobytes()).decode('ascii')}"
+    raise ValueError(f"未対応の保存形式です: {compact_format}")
+
+
+def decode_embedding(value: Any) -> Optional[np.ndarray]:
+    """
+    保存された埋め込みを単精度のベクトルに変換する．
+    encode_embeddingの文字列のほか，数値のリストや，pgvectorが返す "[0.1,0.2,...]" 形式の文字列にも対応する．
+    値が空の場合はNoneを返す．
+    """
+    if value is None or len(value) == 0:
+        return None
+    if isinstance(value, str):
+        if value.startswith("["):
+            return np.asarray(json.loads(value), dtype=np.float32)
+        compact_format, scale, data = value.split(":", 2)
+        raw = base64.b64decode(data)
+        if compact_format == "float16":
+            return np.frombuffer(raw, dtype=np.float16).astype(np.float32)
+        if compact_format == "int8":
+            return np.frombuffer(raw, dtype=np.int8).astype(np.float32) * np.float32(float(scale))
+        raise ValueError(f"未対応の保存形式です: {compact_format}")
+    return np.asarray(value, dtype=np.float32)
+
+
+def to_compact_matrix(vectors: List[np.ndarray], compact_format: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    プロセス内で保持するための，コンパクトな行列と（int8の場合の）行ごとの倍率を返す．
+    """
+    matrix = np.stack(vectors).astype(np.float32)
+    if compact_format == "float16":
+        return matrix.astype(np.float16), None
+    if compact_format == "int8":
+        return quantize_int8(matrix)
+    raise ValueError(f"未対応の保存形式です: {compact_format}")
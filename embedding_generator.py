@@ -1,10 +1,32 @@
 import os
-import google.generativeai as genai
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Sequence
+import ai_clients
+import cache_utils
 
-# Gemini APIキーの設定
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# 埋め込みの呼び出し先のバックエンドは，初めて埋め込みを生成するときにai_clientsで決まる
 EMBEDDING_MODEL = "gemini-embedding-001"
+# 埋め込みの次元数（環境変数EMBEDDING_DIMENSIONSで256や768等を指定する．未指定の場合はモデルの既定の次元数）
+# DBのembeddingカラムの次元数と揃える必要があるため，変更した場合はmigrate_embeddings.pyで全ユーザー分を再計算する
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS")) if os.getenv("EMBEDDING_DIMENSIONS") else None
+# 埋め込みのコンパクトな保存形式（"float16" または "int8"）．指定した場合は埋め込みをembedding_compactカラムだけに保存し，
+# 単精度のembeddingカラムには保存しない（DB側のpgvectorによる検索は使えないため，類似検索はメモリ上の索引で行う）
+EMBEDDING_COMPACT_FORMAT = os.getenv("EMBEDDING_COMPACT_FORMAT") or None
+# 埋め込みを保存・読み込みするカラム
+EMBEDDING_COLUMN = "embedding_compact" if EMBEDDING_COMPACT_FORMAT else "embedding"
+# 1回のバッチ埋め込みで送れる文書数の上限（Gemini APIの上限）
+EMBEDDING_BATCH_SIZE = 100
+# キーワード文書の作り方（create_keywords）の版．作り方を変えたら上げる
+KEYWORD_BUILDER_VERSION = "1"
+# 埋め込みを作った方法（モデル・次元数・キーワード文書の作り方）の版．埋め込みと一緒にembedding_versionカラムに保存し，
+# 版の異なるベクトル同士を類似検索で比べないようにする．変わった場合はmigrate_embeddings.pyで古い行だけを再計算する
+EMBEDDING_VERSION = f"{EMBEDDING_MODEL}/{EMBEDDING_DIMENSIONS or 'default'}/keywords-v{KEYWORD_BUILDER_VERSION}"
+# バッチ埋め込みで同時に送るリクエスト数（レート制限はgemini_schedulerが別途かける）
+EMBEDDING_BATCH_CONCURRENCY = int(os.getenv("EMBEDDING_BATCH_CONCURRENCY", "4"))
+
+# 最近ベクトル化したキーワード文書の埋め込み（キーはembedding_hash）
+EMBEDDING_CACHE_MAX_ENTRIES = 2048
+_document_embedding_cache = cache_utils.TTLCache(maxsize=EMBEDDING_CACHE_MAX_ENTRIES)
 
 def create_keywords(profile_data: Dict[str, Any]) -> str:
     """プロフィールデータから検索用のキーワード文書を生成する"""
@@ -24,22 +46,74 @@ def create_keywords(profile_data: Dict[str, Any]) -> str:
     final_keywords = [word for word in keywords if word]
     return " ".join(final_keywords)
 
+def has_stored_embedding(profile_data: Dict[str, Any]) -> bool:
+    """保存済みのプロフィールに，埋め込み（EMBEDDING_COLUMNのカラム）が保存されているかどうかを返す．"""
+    return bool(profile_data.get(EMBEDDING_COLUMN))
+
+def is_current_version(profile_data: Dict[str, Any]) -> bool:
+    """保存済みの埋め込みが，現在の版（EMBEDDING_VERSION）で作られたものかどうかを返す．"""
+    return profile_data.get("embedding_version") == EMBEDDING_VERSION
+
+def embedding_hash(profile_data: Dict[str, Any]) -> str:
+    """
+    検索「対象文書」用のベクトルを決める内容（キーワード文書と埋め込みモデル）のハッシュを返す。
+    埋め込みと一緒に保存し，値が変わっていなければ保存済みのベクトルを使い回す。
+    """
+    return cache_utils.make_cache_key(
+        EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, "RETRIEVAL_DOCUMENT", create_keywords(profile_data)
+    )
+
+def _embed(contents: List[str], task_type: str) -> List[List[float]]:
+    """
+    バックエンドで埋め込みを生成する．次元数を削減した場合は，L2ノルムが1になるように正規化し直す．
+    """
+    vectors = ai_clients.get_backend().embed(
+        EMBEDDING_MODEL, contents, task_type, output_dimensionality=EMBEDDING_DIMENSIONS
+    )
+    if EMBEDDING_DIMENSIONS is None:
+        return vectors
+    # NumPyは次元数を削減した場合にだけ使うため，ここで初めて読み込む（起動を速くするため）
+    import embedding_codec
+    return embedding_codec.l2_normalize(vectors).tolist()
+
+def embedding_columns(embedding: List[float], embedding_hash_value: str) -> Dict[str, Any]:
+    """
+    埋め込みを保存するときのカラムと値を返す（埋め込みを作った版も含める）．
+    EMBEDDING_COMPACT_FORMATが設定されている場合は，コンパクトな形式（embedding_compactカラム）だけに保存し，
+    単精度のembeddingカラムは空にする（以前の単精度のベクトルが古いまま残らないようにする）．
+    """
+    columns: Dict[str, Any] = {
+        "embedding_hash": embedding_hash_value,
+        "embedding_version": EMBEDDING_VERSION,
+    }
+    if EMBEDDING_COMPACT_FORMAT:
+        import embedding_codec
+        columns["embedding"] = None
+        columns["embedding_compact"] = (
+            embedding_codec.encode_embedding(embedding, EMBEDDING_COMPACT_FORMAT) if embedding else None
+        )
+    else:
+        columns["embedding"] = embedding
+    return columns
+
 def generate_embedding_text(profile_data: Dict[str, Any]) -> List[float]:
     """
     検索「対象文書」用のベクトルを生成する。
     （データベースに保存する全ユーザーのプロフィールはこちらを使う）
+    最近ベクトル化したものと同じキーワード文書であれば，APIを呼ばずにその結果を返す。
     """
     keyword_document = create_keywords(profile_data)
     
     if not keyword_document:
         return [] # キーワードが空の場合は空のリストを返す
 
-    response = genai.embed_content(
-        model=EMBEDDING_MODEL,
-        content=keyword_document,
-        task_type="RETRIEVAL_DOCUMENT"
-    )
-    return response['embedding']
+    key = embedding_hash(profile_data)
+    cached = _document_embedding_cache.get(key)
+    if cached is not None:
+        return list(cached)
+    embedding = _embed([keyword_document], "RETRIEVAL_DOCUMENT")[0]
+    _document_embedding_cache.set(key, list(embedding))
+    return embedding
 
 def generate_embedding_query(profile_data: Dict[str, Any]) -> List[float]:
     """
@@ -51,9 +125,47 @@ def generate_embedding_query(profile_data: Dict[str, Any]) -> List[float]:
     if not keyword_document:
         return []
 
-    response = genai.embed_content(
-        model=EMBEDDING_MODEL,
-        content=keyword_document,
-        task_type="RETRIEVAL_QUERY"
-    )
-    return response['embedding']
\ No newline at end of file
+    return _embed([keyword_document], "RETRIEVAL_QUERY")[0]
+
+def embed_documents(documents: Sequence[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[List[float]]:
+    """
+    複数の文書を，EMBEDDING_BATCH_SIZE件ずつのバッチ埋め込みでベクトル化する。
+    バッチはEMBEDDING_BATCH_CONCURRENCY件まで並列に送り，結果はdocumentsと同じ順序で返す。
+    """
+    chunks = [documents[start:start + EMBEDDING_BATCH_SIZE] for start in range(0, len(documents), EMBEDDING_BATCH_SIZE)]
+    if not chunks:
+        return []
+    if len(chunks) == 1:
+        return _embed(list(chunks[0]), task_type)
+
+    with ThreadPoolExecutor(max_workers=min(EMBEDDING_BATCH_CONCURRENCY, len(chunks))) as executor:
+        # mapは投入した順に結果を返すため，チャンクを連結すれば元の順序になる
+        chunk_vectors = executor.map(lambda chunk: _embed(list(chunk), task_type), chunks)
+        return [vector for vectors in chunk_vectors for vector in vectors]
+
+def generate_embeddings_batch(profiles: Sequence[Dict[str, Any]]) -> List[List[float]]:
+    """
+    複数のプロフィールの検索「対象文書」用のベクトルを，バッチ埋め込みでまとめて生成する。
+    結果はprofilesと同じ順序で返し，キーワードが空のプロフィールには空のリストを返す。
+    （一括更新のスクリプトや，埋め込みモデル変更後の再計算で使う）
+    """
+    keyword_documents = [create_keywords(profile) for profile in profiles]
+    keys = [embedding_hash(profile) for profile in profiles]
+    embeddings: List[List[float]] = [[] for _ in profiles]
+
+    # 最近ベクトル化した文書はキャッシュから返し，残りだけをAPIに送る
+    pending_indexes = []
+    for index, document in enumerate(keyword_documents):
+        if not document:
+            continue
+        cached = _document_embedding_cache.get(keys[index])
+        if cached is not None:
+            embeddings[index] = list(cached)
+        else:
+            pending_indexes.append(index)
+
+    vectors = embed_documents([keyword_documents[index] for index in pending_indexes], "RETRIEVAL_DOCUMENT")
+    for index, vector in zip(pending_indexes, vectors):
+        embeddings[index] = vector
+        _document_embedding_cache.set(keys[index], list(vector))
+    return embeddings
@@ -0,0 +1,178 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# 優先度クラス（値が小さいほど優先される）．優先度は同じプロセス内の待ち行列でだけ比べられる
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    レート制限(429)や一時的なサーバーエラーなど，時間をおいて再試行すべきエラーかどうかを判定する．
+    """
+    from google.api_core import exceptions as google_exceptions
+    return isinstance(error, (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+    ))
+
+
+class GeminiScheduler:
+    """
+    Gemini APIの呼び出しを1つのプロセスの中で調整するスケジューラ．
+    トークンバケットで呼び出し頻度を制限し，同じプロセス内の待ち行列では優先度の高い呼び出しを先に通す．
+    再試行すべきエラーは，ジッター付きの指数バックオフで再試行する．
+
+    トークンバケットと待ち行列はプロセスごとに別々に持つ．アプリと一括処理のスクリプトは別のプロセスで動くため，
+    互いの呼び出しを待たせることはない（APIの上限を分け合う場合は，各プロセスのGEMINI_*_RPMを上限より小さくする）．
+    """
+    def __init__(self, name: str, requests_per_minute: float, burst: int,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0):
+        if requests_per_minute <= 0:
+            raise ValueError(f"requests_per_minuteは正の値を指定してください: {requests_per_minute}")
+        if burst < 1:
+            raise ValueError(f"burstは1以上を指定してください: {burst}")
+        self.name = name
+        self.rate_per_second = requests_per_minute / 60.0
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._condition = threading.Condition()
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._waiters = []
+        self._sequence = itertools.count()
+
+        # メトリクス
+        self._queue_depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self._wait_count = {priority: 0 for priority in PRIORITY_NAMES}
+        self._wait_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._wait_max = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._retries = 0
+        self._failures = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate_per_second)
+        self._last_refill = now
+
+    def _acquire(self, priority: int) -> None:
+        """
+        トークンを1つ取得するまで待つ．待ち行列の先頭（優先度が最も高く，最も早く並んだもの）から順に通す．
+        """
+        ticket = (priority, next(self._sequence))
+        start = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            self._queue_depth[priority] += 1
+            acquired = False
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] == ticket and self._tokens >= 1:
+                        heapq.heappop(self._waiters)
+                        self._tokens -= 1
+                        acquired = True
+                        break
+                    if self._waiters[0] == ticket:
+                        # 次のトークンが補充されるまで待つ
+                        self._condition.wait(timeout=(1 - self._tokens) / self.rate_per_second)
+                    else:
+                        self._condition.wait()
+            finally:
+                if not acquired:
+                    # 待っている間に中断された場合は，後ろに並んだ呼び出しを塞がないよう待ち行列から外す
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                self._queue_depth[priority] -= 1
+                # 次の先頭の呼び出しに順番が回ったことを知らせる
+                self._condition.notify_all()
+
+            waited = time.monotonic() - start
+            self._wait_count[priority] += 1
+            self._wait_total[priority] += waited
+            self._wait_max[priority] = max(self._wait_max[priority], waited)
+
+    def call(self, fn: Callable[..., Any], *args: Any, priority: Optional[int] = None, **kwargs: Any) -> Any:
+        """
+        レート制限に従ってfnを呼び出す．再試行すべきエラーの場合は，指数バックオフで再試行する．
+        priorityを省略した場合は，set_default_priorityで設定した優先度を使う．
+        再試行されるのはfnの中で送出されたエラーだけなので，ストリーミングの応答を返す場合は，
+        最初のチャンクの受信までfnの中で行う（それ以降のエラーは再試行されない）．
+        """
+        if priority is None:
+            priority = _default_priority
+        for attempt in range(self.max_retries + 1):
+            self._acquire(priority)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    with self._condition:
+                        self._failures += 1
+                    raise
+                # ジッター付きの指数バックオフ
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt)) * random.uniform(0.5, 1.0)
+                with self._condition:
+                    self._retries += 1
+                print(f"Gemini APIの呼び出しを{delay:.1f}秒後に再試行します（{attempt + 1}回目）: {e}")
+                time.sleep(delay)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        待ち行列の長さ・待ち時間・再試行回数などのメトリクスを返す．
+        """
+        with self._condition:
+            per_priority = {}
+            for priority, priority_name in PRIORITY_NAMES.items():
+                count = self._wait_count[priority]
+                per_priority[priority_name] = {
+                    "queue_depth": self._queue_depth[priority],
+                    "calls": count,
+                    "avg_wait_seconds": self._wait_total[priority] / count if count else 0.0,
+                    "max_wait_seconds": self._wait_max[priority],
+                }
+            return {
+                "name": self.name,
+                "queue_depth": sum(self._queue_depth.values()),
+                "retries": self._retries,
+                "failures": self._failures,
+                "priorities": per_priority,
+            }
+
+
+# 優先度を指定しない呼び出しに使う優先度（バッチ処理のスクリプトではBATCHに変更する）
+_default_priority = INTERACTIVE
+
+
+def set_default_priority(priority: int) -> None:
+    """
+    このプロセスで，優先度を指定しない呼び出しに使う優先度を設定する．
+    他のプロセスの呼び出しとの順番には影響しない（メトリクスの分類と，同じプロセス内での順番にだけ使われる）．
+    """
+    global _default_priority
+    _default_priority = priority
+
+
+# テキスト生成用と埋め込み用で，それぞれプロセス全体で1つのスケジューラを共有する
+text_scheduler = GeminiScheduler(
+    "text_generation",
+    requests_per_minute=float(os.getenv("GEMINI_TEXT_RPM", "300")),
+    burst=int(os.getenv("GEMINI_TEXT_BURST", "10"))
+)
+embedding_scheduler = GeminiScheduler(
+    "embedding",
+    requests_per_minute=float(os.getenv("GEMINI_EMBEDDING_RPM", "1500")),
+    burst=int(os.getenv("GEMINI_EMBEDDING_BURST", "50"))
+)
@@ -1,4 +1,5 @@
 import os
+import argparse
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from rich.progress import track  # 進行状況をきれいに表示するためのライブラリ
@@ -6,12 +7,25 @@ from rich.progress import track  # 進行状況をきれいに表示するため
 
 # --- モジュールのインポート ---
 from profile_manager import ProfileManager, UserInput
+import gemini_scheduler
+import ai_utils
+import embedding_generator
 
 def main():
     """
     全ユーザーのAI関連情報を一括で再生成し、データベースを更新するスクリプト。
     """
+    parser = argparse.ArgumentParser(description="全ユーザーのAI関連情報を一括で再生成します。")
+    parser.add_argument(
+        "--combined",
+        action="store_true",
+        help="自己紹介文と動物分類を1回のAI呼び出しでまとめて生成する"
+    )
+    args = parser.parse_args()
+
     print("🚀 AI情報の一括更新スクリプトを開始します。")
+    # バッチ処理のAI呼び出しは，画面操作による呼び出しより後回しにする
+    gemini_scheduler.set_default_priority(gemini_scheduler.BATCH)
 
     # 1. 環境変数を読み込む
     load_dotenv()
@@ -24,7 +38,7 @@ def main():
 
     # 2. クライアントとマネージャーを初期化
     supabase_client: Client = create_client(supabase_url, supabase_key)
-    profile_manager = ProfileManager(supabase_client)
+    profile_manager = ProfileManager(supabase_client, combined_generation=args.combined)
 
     try:
         # 3. 全ユーザーのプロフィールを取得
@@ -34,20 +48,38 @@ def main():
         all_profiles = all_profiles_response.data
         print(f"✅ {len(all_profiles)}人のユーザーが見つかりました。")
 
-        # 4. 各ユーザーの情報をループして更新
+        # 4. ユーザーをバッチ埋め込みの上限人数ずつに分けて更新
         # rich.progress.trackでループを囲むと、プログレスバーが表示される
-        for profile in track(all_profiles, description="AI情報を生成・更新中..."):
-            user_id = profile['id']
-            
+        batches = [
+            all_profiles[start:start + embedding_generator.EMBEDDING_BATCH_SIZE]
+            for start in range(0, len(all_profiles), embedding_generator.EMBEDDING_BATCH_SIZE)
+        ]
+        failed_ids = []
+        for batch in track(batches, description="AI情報を生成・更新中..."):
             # UserInput型に準拠したデータを作成
-            user_input: UserInput = {
-                key: profile[key] for key in UserInput.__annotations__.keys() if key in profile
+            user_inputs = {
+                profile['id']: {
+                    key: profile[key] for key in UserInput.__annotations__.keys() if key in profile
+                }
+                for profile in batch
             }
             
-            # ProfileManagerの更新メソッドを呼び出す
-            profile_manager.update_user_input(user_id, user_input)
+            # ProfileManagerの一括更新メソッドを呼び出す（ベクトル化とDBへの書き込みはバッチごとにまとめて行う）
+            try:
+                updated_profiles = profile_manager.update_user_inputs(user_inputs)
+            except ValueError as e:
+                print(f"⚠️ {len(batch)}人分の更新に失敗しました: {e}")
+                failed_ids.extend(user_inputs.keys())
+                continue
+            updated_ids = {profile['id'] for profile in updated_profiles}
+            failed_ids.extend(profile_id for profile_id in user_inputs if profile_id not in updated_ids)
 
-        print("\n🎉 全てのユーザー情報の更新が完了しました！")
+        if failed_ids:
+            print(f"\n⚠️ {len(failed_ids)}人の更新に失敗しました: {', '.join(failed_ids)}")
+        print("\n🎉 ユーザー情報の更新が完了しました！")
+        print(f"📊 Gemini API: {gemini_scheduler.text_scheduler.metrics()}")
+        print(f"📊 Embedding API: {gemini_scheduler.embedding_scheduler.metrics()}")
+        print(f"📊 トークン数: {ai_utils.get_usage_stats()}")
 
     except Exception as e:
         print(f"\n❌ エラーが発生しました: {e}")
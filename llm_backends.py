@@ -0,0 +1,230 @@
+import abc
+import hashlib
+import json
+import math
+import time
+from typing import Any, Dict, Generator, List, Optional, TypedDict
+
+import gemini_scheduler
+
+
+class GenerationResult(TypedDict):
+    """
+    テキスト生成1回分の結果．トークン数はバックエンドが返さない場合0になる．
+    """
+    text: str
+    input_tokens: int
+    output_tokens: int
+
+
+class LLMBackend(abc.ABC):
+    """
+    テキスト生成と埋め込みを提供するバックエンドの基底クラス．
+    すべてのメソッドを実装していないサブクラスは，インスタンスを作るときにTypeErrorになる．
+    """
+    @abc.abstractmethod
+    def generate(self, model_name: str, prompt: str,
+                 response_schema: Optional[Dict[str, Any]] = None,
+                 system_instruction: Optional[str] = None) -> GenerationResult:
+        """
+        プロンプトからテキストを生成する．response_schemaを指定した場合は，そのJSONスキーマに沿ったJSONを返す．
+        system_instructionには，呼び出しごとに変わらない役割や命令を渡す．
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def generate_stream(self, model_name: str, prompt: str,
+                        system_instruction: Optional[str] = None) -> Generator[str, None, GenerationResult]:
+        """
+        プロンプトからテキストを生成し，受信したテキストの断片を順に返す．
+        受信完了後，ジェネレータの戻り値として生成結果全体（トークン数を含む）を返す．
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def embed(self, model_name: str, contents: List[str], task_type: str,
+              output_dimensionality: Optional[int] = None) -> List[List[float]]:
+        """
+        各文書の埋め込みベクトルを，contentsと同じ順序で返す．
+        output_dimensionalityを指定した場合は，その次元数に削減したベクトルを返す（正規化はされない）．
+        """
+        raise NotImplementedError
+
+
+def _generation_result(text: str, response: Any) -> GenerationResult:
+    """
+    Geminiのレスポンスのusage_metadataから，トークン数を含む生成結果を作る．
+    """
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "text": text,
+        "input_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+    }
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Gemini APIを使うバックエンド．呼び出しは全てgemini_schedulerを通してレート制限・再試行される．
+    """
+    def generate(self, model_name: str, prompt: str,
+                 response_schema: Optional[Dict[str, Any]] = None,
+                 system_instruction: Optional[str] = None) -> GenerationResult:
+        import ai_clients
+        generation_config = None
+        if response_schema is not None:
+            generation_config = {
+                "response_mime_type": "application/json",
+                "response_schema": response_schema
+            }
+        response = gemini_scheduler.text_scheduler.call(
+            ai_clients.get_generative_model(model_name, system_instruction).generate_content,
+            prompt,
+            generation_config=generation_config
+        )
+        return _generation_result(response.text, response)
+
+    def generate_stream(self, model_name: str, prompt: str,
+                        system_instruction: Optional[str] = None) -> Generator[str, None, GenerationResult]:
+        import ai_clients
+
+        def start_stream():
+            # 接続時のエラー（429等）は最初のチャンクの受信時に送出されるため，そこまでを再試行の対象にする
+            response = ai_clients.get_generative_model(model_name, system_instruction).generate_content(
+                prompt, stream=True
+            )
+            chunks = iter(response)
+            return response, chunks, next(chunks, None)
+
+        response, chunks, first_chunk = gemini_scheduler.text_scheduler.call(start_stream)
+        texts = []
+        if first_chunk is not None:
+            texts.append(first_chunk.text)
+            yield first_chunk.text
+        # 2つ目以降のチャンクの受信中のエラーは，既に表示した内容と重複するため再試行しない
+        for chunk in chunks:
+            texts.append(chunk.text)
+            yield chunk.text
+        # トークン数は，最後のチャンクまで受信した後のレスポンスに含まれる
+        return _generation_result("".join(texts), response)
+
+    def embed(self, model_name: str, contents: List[str], task_type: str,
+              output_dimensionality: Optional[int] = None) -> List[List[float]]:
+        import ai_clients
+        response = gemini_scheduler.embedding_scheduler.call(
+            ai_clients.get_genai().embed_content,
+            model=model_name,
+            content=contents,
+            task_type=task_type,
+            output_dimensionality=output_dimensionality
+        )
+        return response['embedding']
+
+
+# ローカルスタブが返す固定の応答
+_STUB_ANIMALS = [
+    ("ライオン", "リーダーシップ全開タイプ"),
+    ("フクロウ", "頭脳派・ミステリアスタイプ"),
+    ("犬", "ムードメーカー・元気いっぱいタイプ"),
+    ("パンダ", "癒し系・ほんわかタイプ"),
+    ("ネコ", "自由人・マイペースタイプ"),
+]
+_STUB_INTRODUCTION = {
+    "catchphrase": "【スタブが生成したキャッチコピー】",
+    "introduction_text": "はじめまして！これはローカルスタブが生成した自己紹介文です。",
+    "tags": ["#スタブ", "#負荷試験", "#オフライン"],
+}
+_STUB_CONVERSATION = {
+    "common_points": ["同じ地方の出身", "インドアな趣味", "新しいもの好き"],
+    "topics": [
+        "相手の趣味について、「始めたきっかけは何ですか？」と質問してみましょう。",
+        "出身地について、「地元のおすすめの場所はどこですか？」と聞いてみるのはどうでしょう。",
+        "相手の得意なことについて、「コツを教えてほしいです！」とお願いしてみましょう。",
+    ],
+}
+
+
+class LocalStubBackend(LLMBackend):
+    """
+    Gemini APIを呼ばずに，決まった応答を返すローカルのバックエンド．
+    同じ入力には常に同じ応答を返す．latency_secondsを指定すると，各呼び出しでその時間だけ待つ．
+    負荷試験や，Geminiの遅延を除いた自前の処理時間の計測に使う．
+    """
+    def __init__(self, latency_seconds: float = 0.0, embedding_dimensions: int = 768):
+        self.latency_seconds = latency_seconds
+        self.embedding_dimensions = embedding_dimensions
+
+    def _canned_response(self, prompt: str, response_schema: Optional[Dict[str, Any]],
+                         system_instruction: Optional[str]) -> Dict[str, Any]:
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        animal_name, animal_category = _STUB_ANIMALS[digest % len(_STUB_ANIMALS)]
+        animal = {
+            "animal_name": animal_name,
+            "animal_category": animal_category,
+            "animal_reason": f"ローカルスタブが{animal_name}タイプに分類しました。",
+        }
+        if response_schema is not None:
+            properties = response_schema.get("properties", {})
+            canned = {**_STUB_INTRODUCTION, **_STUB_CONVERSATION, **animal}
+            return {key: canned[key] for key in properties if key in canned}
+        instructions = f"{system_instruction or ''}{prompt}"
+        if '"common_points"' in instructions:
+            return dict(_STUB_CONVERSATION)
+        if '"animal_name"' in instructions:
+            return animal
+        return dict(_STUB_INTRODUCTION)
+
+    def generate(self, model_name: str, prompt: str,
+                 response_schema: Optional[Dict[str, Any]] = None,
+                 system_instruction: Optional[str] = None) -> GenerationResult:
+        time.sleep(self.latency_seconds)
+        text = json.dumps(self._canned_response(prompt, response_schema, system_instruction), ensure_ascii=False)
+        return self._stub_result(text, prompt, system_instruction)
+
+    def generate_stream(self, model_name: str, prompt: str,
+                        system_instruction: Optional[str] = None) -> Generator[str, None, GenerationResult]:
+        text = json.dumps(self._canned_response(prompt, None, system_instruction), ensure_ascii=False)
+        chunk_size = 32
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        for chunk in chunks:
+            time.sleep(self.latency_seconds / len(chunks))
+            yield chunk
+        return self._stub_result(text, prompt, system_instruction)
+
+    @staticmethod
+    def _stub_result(text: str, prompt: str, system_instruction: Optional[str]) -> GenerationResult:
+        # トークン数の代わりに文字数を返す
+        return {
+            "text": text,
+            "input_tokens": len(prompt) + len(system_instruction or ""),
+            "output_tokens": len(text),
+        }
+
+    def embed(self, model_name: str, contents: List[str], task_type: str,
+              output_dimensionality: Optional[int] = None) -> List[List[float]]:
+        time.sleep(self.latency_seconds)
+        vectors = [self._hashed_embedding(content) for content in contents]
+        if output_dimensionality is not None:
+            # Geminiと同様に，先頭の次元だけを残す（正規化はしない）
+            vectors = [vector[:output_dimensionality] for vector in vectors]
+        return vectors
+
+    def _hashed_embedding(self, content: str) -> List[float]:
+        """
+        空白区切りの単語と文字bigramをハッシュで次元に割り当てた，正規化済みのベクトルを返す．
+        似たキーワードを持つ文書ほど，似たベクトルになる．
+        """
+        vector = [0.0] * self.embedding_dimensions
+        features = []
+        for word in content.split():
+            features.append(word)
+            features.extend(word[i:i + 2] for i in range(len(word) - 1))
+        for feature in features:
+            digest = hashlib.sha256(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "big") % self.embedding_dimensions
+            sign = 1.0 if digest[4] % 2 == 0 else -1.0
+            vector[index] += sign
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm == 0:
+            return vector
+        return [value / norm for value in vector]
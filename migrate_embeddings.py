@@ -0,0 +1,152 @@
+import os
+import time
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from rich.progress import Progress
+
+# --- モジュールのインポート ---
+import embedding_codec
+import embedding_generator
+import supabase_utils
+import gemini_scheduler
+
+# 埋め込みの次元数・保存形式は，アプリと同じ環境変数で指定する
+#   EMBEDDING_DIMENSIONS=768 EMBEDDING_COMPACT_FORMAT=int8 python migrate_embeddings.py
+#
+# 事前に，profilesテーブルを新しい次元数に合わせて変更しておく（768次元の場合の例）
+#   alter table profiles add column if not exists embedding_hash text;
+#   alter table profiles add column if not exists embedding_version text;
+#   alter table profiles add column if not exists embedding_compact text;
+#   alter table profiles drop column embedding;
+#   alter table profiles add column embedding vector(768);
+# match_profiles関数の引数 query_embedding の型も vector(768) に変更する。
+# 次元数を変えずに保存形式だけを追加する場合や，キーワード文書の作り方（KEYWORD_BUILDER_VERSION）だけを変えた場合は，
+# embeddingカラムの変更は不要。
+
+MIGRATION_COLUMNS = "id, hobbies, tags, expert_topic, happy_topic, hometown, embedding_hash, embedding_compact"
+# 古い版のユーザーを一度に読み込む件数（この件数ずつバッチ埋め込みで再計算して書き戻す）
+PAGE_SIZE = 500
+
+
+def migrate_stale_profiles(supabase_client: Client, progress: Progress) -> tuple:
+    """
+    埋め込みの版（embedding_version）が現在の版と異なるユーザーだけを，IDの順にPAGE_SIZE件ずつ読み込んで移行する。
+    キーワード文書・モデル・次元数が変わったユーザーはバッチ埋め込みで再計算し，
+    ハッシュが変わっていない（ベクトルがそのまま使える）ユーザーは版だけを記録する。
+    書き戻しはページごとに1回の一括更新にまとめ，IDと埋め込みの列だけを送る（行は追加しないため，途中で削除されたユーザーは復活しない）。
+    (成功した人数, 失敗した人数) を返す。
+    """
+    version = embedding_generator.EMBEDDING_VERSION
+    total = supabase_utils.count_stale_embedding_profiles(supabase_client, version)
+    task = progress.add_task("古い版の埋め込みを再計算中...", total=total)
+    succeeded = 0
+    failed = 0
+    after_id = None
+    while True:
+        page = supabase_utils.get_stale_embedding_profiles(supabase_client, version, MIGRATION_COLUMNS, after_id, PAGE_SIZE)
+        if not page:
+            break
+        after_id = page[-1]['id']
+
+        stale_profiles = [p for p in page if p.get('embedding_hash') != embedding_generator.embedding_hash(p)]
+        embeddings = embedding_generator.generate_embeddings_batch(stale_profiles)
+        rows_by_id = {profile['id']: {"id": profile['id'], "embedding_version": version} for profile in page}
+        for profile, embedding in zip(stale_profiles, embeddings):
+            rows_by_id[profile['id']] = {
+                "id": profile['id'],
+                **embedding_generator.embedding_columns(embedding, embedding_generator.embedding_hash(profile)),
+            }
+
+        # 失敗したユーザーは古い版のまま残るため，再実行したときにもう一度処理される
+        result = supabase_utils.bulk_update_profiles(
+            supabase_client, list(rows_by_id.values()), on_progress=lambda count: progress.advance(task, count)
+        )
+        failed += len(result["failed"])
+        succeeded += len(result["data"])
+    return succeeded, failed
+
+
+def add_compact_embeddings(supabase_client: Client, progress: Progress) -> tuple:
+    """
+    現在の版のユーザーのうち，コンパクトな形式が未保存のユーザーについて，保存済みのベクトルから作成する。
+    作成したユーザーの単精度のベクトル（embeddingカラム）は空にする。
+    PAGE_SIZE人ずつ，保存済みのベクトルを1回の問い合わせで読み込み，1回の一括更新で書き戻す。
+    (成功した人数, 失敗した人数) を返す。
+    """
+    compact_format = embedding_generator.EMBEDDING_COMPACT_FORMAT
+    all_profiles = supabase_client.table('profiles').select("id, embedding_version, embedding_compact").execute().data or []
+    compact_only_profiles = [
+        profile for profile in all_profiles
+        if embedding_generator.is_current_version(profile)
+        and not (profile.get('embedding_compact') or "").startswith(f"{compact_format}:")
+    ]
+    task = progress.add_task("コンパクトな形式を追加中...", total=len(compact_only_profiles))
+    succeeded = 0
+    failed = 0
+    for start in range(0, len(compact_only_profiles), PAGE_SIZE):
+        page_ids = [profile['id'] for profile in compact_only_profiles[start:start + PAGE_SIZE]]
+        try:
+            stored_profiles = supabase_utils.get_profiles_by_ids(supabase_client, page_ids, columns="id, embedding")
+        except ValueError as e:
+            failed += len(page_ids)
+            print(f"⚠️ {len(page_ids)}人分のベクトルの読み込みに失敗しました: {e}")
+            progress.advance(task, len(page_ids))
+            continue
+        rows = []
+        for profile_id, stored in zip(page_ids, stored_profiles):
+            embedding = embedding_codec.decode_embedding((stored or {}).get('embedding'))
+            compact = embedding_codec.encode_embedding(embedding, compact_format) if embedding is not None else None
+            # コンパクトな形式に移したら，単精度のベクトルは保存しない
+            rows.append({"id": profile_id, "embedding_compact": compact, "embedding": None})
+        result = supabase_utils.bulk_update_profiles(
+            supabase_client, rows, on_progress=lambda count: progress.advance(task, count)
+        )
+        failed += len(result["failed"])
+        succeeded += len(result["data"])
+    return succeeded, failed
+
+
+def main():
+    """
+    全ユーザーの埋め込みを，現在の設定（モデル・次元数・キーワード文書の作り方・保存形式）に合わせて移行するスクリプト。
+    埋め込みの版が古いユーザーだけを読み込んで処理し，移行済みのユーザーは読み込まないため，
+    途中で止まっても再実行すれば続きから処理される。
+    """
+    print("🚀 埋め込みの移行スクリプトを開始します。")
+    print(f"   版: {embedding_generator.EMBEDDING_VERSION}"
+          f" / 保存形式: {embedding_generator.EMBEDDING_COMPACT_FORMAT or 'なし'}")
+    gemini_scheduler.set_default_priority(gemini_scheduler.BATCH)
+
+    # 1. 環境変数を読み込む
+    load_dotenv()
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+
+    if not supabase_url or not supabase_key:
+        print("❌ エラー: .envファイルにSupabaseのURLとキーを設定してください。")
+        return
+
+    # 2. クライアントを初期化
+    supabase_client: Client = create_client(supabase_url, supabase_key)
+
+    try:
+        start_time = time.monotonic()
+        with Progress() as progress:
+            # 3. 古い版のユーザーを一定件数ずつ再計算して書き戻す
+            succeeded, failed = migrate_stale_profiles(supabase_client, progress)
+
+            # 4. 版が最新で，コンパクトな形式だけが未保存のユーザーに追加する
+            if embedding_generator.EMBEDDING_COMPACT_FORMAT:
+                compact_succeeded, compact_failed = add_compact_embeddings(supabase_client, progress)
+                succeeded += compact_succeeded
+                failed += compact_failed
+        elapsed = time.monotonic() - start_time
+
+        print(f"\n🎉 完了しました！ 成功: {succeeded}人 / 失敗: {failed}人 / 所要時間: {elapsed:.1f}秒")
+        print(f"📊 Embedding API: {gemini_scheduler.embedding_scheduler.metrics()}")
+
+    except Exception as e:
+        print(f"\n❌ エラーが発生しました: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from rich.progress import Progress
+
+# --- モジュールのインポート ---
+import ai_utils
+import embedding_codec
+import embedding_generator
+import profile_neighbors
+import supabase_utils
+import gemini_scheduler
+
+# 事前計算の結果は，以下のテーブルに保存する
+#   create table conversation_starters (
+#     my_id uuid not null,
+#     opponent_id uuid not null,
+#     my_profile_hash text not null,
+#     opponent_profile_hash text not null,
+#     common_points jsonb not null,
+#     topics jsonb not null,
+#     updated_at timestamptz not null default now(),
+#     primary key (my_id, opponent_id)
+#   );
+
+
+def collect_pairs(supabase_client: Client, profiles_by_id: dict, top_k: int) -> list:
+    """
+    各ユーザーについて，類似度上位top_k人との組 (自分のID, 相手のID) を列挙する。
+    """
+    if embedding_generator.EMBEDDING_COMPACT_FORMAT:
+        return collect_pairs_in_process(profiles_by_id, top_k)
+    pairs = []
+    for profile_id, profile in profiles_by_id.items():
+        if not profile.get('embedding') or not embedding_generator.is_current_version(profile):
+            continue
+        neighbors = supabase_utils.find_similar_users(
+            supabase=supabase_client,
+            user_id=profile_id,
+            query_vector=profile['embedding'],
+            match_count=top_k,
+            embedding_version=embedding_generator.EMBEDDING_VERSION
+        )
+        for neighbor in neighbors:
+            if neighbor['id'] in profiles_by_id:
+                pairs.append((profile_id, neighbor['id']))
+    return pairs
+
+
+def collect_pairs_in_process(profiles_by_id: dict, top_k: int) -> list:
+    """
+    埋め込みをコンパクトな形式だけで保存している場合は，DB側のpgvectorで検索できないため，
+    全ユーザーのベクトルから類似度を計算して組を列挙する。
+    """
+    ids = []
+    vectors = []
+    for profile_id, profile in profiles_by_id.items():
+        embedding = embedding_codec.decode_embedding(profile.get(embedding_generator.EMBEDDING_COLUMN))
+        if embedding is not None and embedding_generator.is_current_version(profile):
+            ids.append(profile_id)
+            vectors.append(embedding)
+    if not vectors:
+        return []
+    neighbors = profile_neighbors.compute_all_neighbors(
+        ids, embedding_codec.l2_normalize(vectors), top_k, supabase_utils.SIMILARITY_THRESHOLD
+    )
+    return [(profile_id, neighbor_id) for profile_id, neighbor_list in neighbors.items() for neighbor_id, _ in neighbor_list]
+
+
+def compute_and_store(supabase_client: Client, my_profile: dict, opponent_profile: dict) -> None:
+    """
+    1組分の会話のきっかけを生成し，計算時のプロフィールのハッシュと一緒に保存する。
+    """
+    conversation_data = ai_utils.create_conversation_starters(my_profile, opponent_profile)
+    supabase_utils.upsert_conversation_starter(supabase_client, {
+        "my_id": my_profile['id'],
+        "opponent_id": opponent_profile['id'],
+        "my_profile_hash": ai_utils.conversation_profile_hash(my_profile),
+        "opponent_profile_hash": ai_utils.conversation_profile_hash(opponent_profile),
+        "common_points": conversation_data.get("common_points", []),
+        "topics": conversation_data.get("topics", []),
+    })
+
+
+def main():
+    """
+    類似度上位のユーザーの組について，会話のきっかけを事前に生成して保存するスクリプト。
+    保存済みで，計算時から2人のプロフィールが変わっていない組はスキップするため，
+    途中で止まっても再実行すれば続きから処理される。
+    """
+    parser = argparse.ArgumentParser(description="類似ユーザーとの会話のきっかけを事前計算します。")
+    parser.add_argument("--top-k", type=int, default=5, help="1人あたりに事前計算する類似ユーザーの人数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に実行するAI呼び出しの数")
+    args = parser.parse_args()
+
+    print("🚀 会話のきっかけの事前計算スクリプトを開始します。")
+    # バッチ処理のAI呼び出しは，画面操作による呼び出しより後回しにする
+    gemini_scheduler.set_default_priority(gemini_scheduler.BATCH)
+
+    # 1. 環境変数を読み込む
+    load_dotenv()
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+
+    if not supabase_url or not supabase_key:
+        print("❌ エラー: .envファイルにSupabaseのURLとキーを設定してください。")
+        return
+
+    # 2. クライアントを初期化
+    supabase_client: Client = create_client(supabase_url, supabase_key)
+
+    try:
+        # 3. 全ユーザーのプロフィールと，保存済みのペアを取得
+        print("🔄 全ユーザーのプロフィールを取得中...")
+        all_profiles = supabase_client.table('profiles').select("*").execute().data
+        profiles_by_id = {profile['id']: profile for profile in all_profiles}
+        print(f"✅ {len(profiles_by_id)}人のユーザーが見つかりました。")
+
+        stored_hashes = {
+            (row['my_id'], row['opponent_id']): (row['my_profile_hash'], row['opponent_profile_hash'])
+            for row in supabase_utils.get_conversation_starter_hashes(supabase_client)
+        }
+
+        # 4. 類似ユーザーの組を列挙し，プロフィールが変わっていない組を除外
+        print("🔄 類似ユーザーの組を列挙中...")
+        pairs = collect_pairs(supabase_client, profiles_by_id, args.top_k)
+        pending_pairs = [
+            (my_id, opponent_id) for my_id, opponent_id in pairs
+            if stored_hashes.get((my_id, opponent_id)) != (
+                ai_utils.conversation_profile_hash(profiles_by_id[my_id]),
+                ai_utils.conversation_profile_hash(profiles_by_id[opponent_id])
+            )
+        ]
+        print(f"✅ {len(pairs)}組のうち，{len(pending_pairs)}組を計算します。（{len(pairs) - len(pending_pairs)}組は計算済み）")
+
+        # 5. 並列数を制限しながら生成・保存
+        succeeded = 0
+        failed = 0
+        start_time = time.monotonic()
+        with Progress() as progress, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            task = progress.add_task("会話のきっかけを生成中...", total=len(pending_pairs))
+            futures = {
+                executor.submit(compute_and_store, supabase_client, profiles_by_id[my_id], profiles_by_id[opponent_id]): (my_id, opponent_id)
+                for my_id, opponent_id in pending_pairs
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    succeeded += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"⚠️ {futures[future]} の生成に失敗しました: {e}")
+                progress.advance(task)
+        elapsed = time.monotonic() - start_time
+
+        # 6. スループットを報告
+        throughput = succeeded / elapsed if elapsed > 0 else 0.0
+        print(f"\n🎉 完了しました！ 成功: {succeeded}組 / 失敗: {failed}組 / 所要時間: {elapsed:.1f}秒 / スループット: {throughput:.2f}組/秒")
+        print(f"📊 Gemini API: {gemini_scheduler.text_scheduler.metrics()}")
+        print(f"📊 トークン数: {ai_utils.get_usage_stats()}")
+
+    except Exception as e:
+        print(f"\n❌ エラーが発生しました: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import time
+import argparse
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from rich.progress import Progress
+
+# --- モジュールのインポート ---
+import embedding_codec
+import embedding_generator
+import profile_neighbors
+import supabase_utils
+
+# 結果は profile_neighbors テーブルに保存する（テーブルの定義は supabase_utils.get_similar_profiles_from_neighbors を参照）
+# アプリで使うには，環境変数 PROFILE_NEIGHBORS_ENABLED=1 を設定する
+# アプリはこのテーブルを書き換えないため，プロフィールの変更はこのスクリプトを定期的に実行して反映する
+# （1人分だけ反映する場合は --profile-id を指定する）
+
+# 1回の保存でまとめて置き換えるユーザーの数
+WRITE_BATCH_SIZE = 500
+
+
+def load_embeddings(supabase_client: Client):
+    """
+    全ユーザーの埋め込みを取得し，(IDのリスト, L2正規化した行列) を返す．埋め込みのないユーザーと，版が古いユーザーは除く．
+    """
+    columns = f"id, embedding_version, {embedding_generator.EMBEDDING_COLUMN}"
+    rows = supabase_client.table('profiles').select(columns).execute().data or []
+    ids = []
+    vectors = []
+    for row in rows:
+        if not embedding_generator.is_current_version(row):
+            # 古い版のベクトルは，現在の版のベクトルと比べられないため除く
+            continue
+        embedding = embedding_codec.decode_embedding(row.get(embedding_generator.EMBEDDING_COLUMN))
+        if embedding is not None:
+            ids.append(row['id'])
+            vectors.append(embedding)
+    if not vectors:
+        return ids, None
+    return ids, embedding_codec.l2_normalize(vectors)
+
+
+def refresh_one(supabase_client: Client, profile_id: str, ids: list, matrix, top_k: int) -> int:
+    """
+    1人のプロフィールが変わったときに，そのユーザーの行と列だけを計算し直して保存する．保存したユーザーの数を返す．
+    """
+    rows = {item_id: row for row, item_id in enumerate(ids)}
+
+    def score_all(item_id):
+        if matrix is None or item_id not in rows:
+            return None
+        return ids, matrix @ matrix[rows[item_id]]
+
+    listing_ids = supabase_utils.get_profiles_listing_neighbor(supabase_client, profile_id)
+    affected = profile_neighbors.affected_profile_ids(
+        profile_id, score_all, listing_ids, supabase_utils.SIMILARITY_THRESHOLD
+    )
+    current_lists = supabase_utils.get_neighbor_lists(supabase_client, affected)
+    updated = profile_neighbors.refresh_profile(
+        profile_id, score_all, current_lists, top_k, supabase_utils.SIMILARITY_THRESHOLD
+    )
+    supabase_utils.replace_neighbor_lists(supabase_client, updated)
+    return len(updated)
+
+
+def main():
+    """
+    全ユーザーの組の類似度を計算し，各ユーザーの類似上位k人を profile_neighbors テーブルに保存するスクリプト。
+    類似度はブロックごとの行列積で計算するため，ユーザー数が多くてもメモリ使用量は抑えられる。
+    --profile-id を指定した場合は，そのユーザーの行と列だけを計算し直す。
+    """
+    parser = argparse.ArgumentParser(description="類似ユーザーの上位k人を事前計算します。")
+    parser.add_argument("--top-k", type=int, default=supabase_utils.SIMILAR_USERS_MATCH_COUNT, help="1人あたりに保存する類似ユーザーの人数")
+    parser.add_argument("--block-size", type=int, default=256, help="1回の行列積で計算するユーザーの数")
+    parser.add_argument("--profile-id", help="このユーザーの行と列だけを計算し直す")
+    args = parser.parse_args()
+
+    print("🚀 類似ユーザーの事前計算スクリプトを開始します。")
+
+    # 1. 環境変数を読み込む
+    load_dotenv()
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+
+    if not supabase_url or not supabase_key:
+        print("❌ エラー: .envファイルにSupabaseのURLとキーを設定してください。")
+        return
+
+    # 2. クライアントを初期化
+    supabase_client: Client = create_client(supabase_url, supabase_key)
+
+    try:
+        # 3. 全ユーザーの埋め込みを取得
+        print("🔄 全ユーザーの埋め込みを取得中...")
+        ids, matrix = load_embeddings(supabase_client)
+        print(f"✅ {len(ids)}人のユーザーの埋め込みが見つかりました。")
+
+        start_time = time.monotonic()
+        if args.profile_id:
+            # 4a. 1人分だけを計算し直す
+            updated = refresh_one(supabase_client, args.profile_id, ids, matrix, args.top_k)
+            print(f"\n🎉 完了しました！ 更新: {updated}人 / 所要時間: {time.monotonic() - start_time:.1f}秒")
+            return
+
+        # 4b. 全ユーザーの上位k人をブロックごとに計算
+        print("🔄 類似度を計算中...")
+        neighbor_lists = {} if matrix is None else profile_neighbors.compute_all_neighbors(
+            ids, matrix, args.top_k, supabase_utils.SIMILARITY_THRESHOLD, block_size=args.block_size
+        )
+        print(f"✅ 計算しました（{time.monotonic() - start_time:.1f}秒）。")
+
+        # 5. 一定人数ずつ保存
+        succeeded = 0
+        failed = 0
+        items = list(neighbor_lists.items())
+        with Progress() as progress:
+            task = progress.add_task("類似ユーザーを保存中...", total=len(items))
+            for start in range(0, len(items), WRITE_BATCH_SIZE):
+                batch = dict(items[start:start + WRITE_BATCH_SIZE])
+                try:
+                    supabase_utils.replace_neighbor_lists(supabase_client, batch)
+                    succeeded += len(batch)
+                except ValueError as e:
+                    failed += len(batch)
+                    print(f"⚠️ {len(batch)}人分の保存に失敗しました: {e}")
+                progress.advance(task, len(batch))
+        elapsed = time.monotonic() - start_time
+
+        print(f"\n🎉 完了しました！ 成功: {succeeded}人 / 失敗: {failed}人 / 所要時間: {elapsed:.1f}秒")
+
+    except Exception as e:
+        print(f"\n❌ エラーが発生しました: {e}")
+
+if __name__ == "__main__":
+    main()
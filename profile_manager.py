@@ -1,16 +1,166 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Generator, Iterator, Tuple, Callable
 from supabase import Client
 import supabase_utils
 import ai_utils
 import embedding_generator
-from typing import List,Dict,Any
+import cache_utils
 from dict_types import UserInput,EditableGeneratedProfile
 import uuid
 import os
 import base64
 from pathlib import Path
-from typing import Optional
+import time
+import copy
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
+# AI生成を並列に実行するためのスレッドプール（全セッションで共有する）
+_ai_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="ai-generation")
+# AI呼び出し1回あたりのタイムアウト（秒）
+AI_CALL_TIMEOUT_SECONDS = 60
+
+# 会話のきっかけのキャッシュ（全セッションで共有する）
+# キーは (自分のID, 相手のID, 自分のプロフィールの版数, 相手のプロフィールの版数)
+CONVERSATION_CACHE_MAX_ENTRIES = 4096
+CONVERSATION_CACHE_TTL_SECONDS = 24 * 60 * 60
+_conversation_cache = cache_utils.TTLCache(
+    maxsize=CONVERSATION_CACHE_MAX_ENTRIES, ttl=CONVERSATION_CACHE_TTL_SECONDS
+)
+# プロフィールの版数．プロフィールが更新されるたびに増やし，古いキャッシュを参照しないようにする
+_profile_versions: Dict[str, int] = defaultdict(int)
+_profile_versions_lock = threading.Lock()
+# プロフィールのキャッシュ（全セッションで共有する）．キーはプロフィールのID
+# 書き込みのたびに保存後のプロフィールで置き換えるため，TTLは他のプロセスやスクリプトによる更新を反映するまでの上限になる
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "2048"))
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+_profile_cache = cache_utils.TTLCache(maxsize=PROFILE_CACHE_MAX_ENTRIES, ttl=PROFILE_CACHE_TTL_SECONDS)
+# 同時に届いた同じ要求（同じプロフィールの取得，同じ組の会話のきっかけ等）を1回の実行にまとめる（全セッションで共有する）
+_single_flight = cache_utils.SingleFlight()
+
+# 類似検索をメモリ上の索引で行うかどうか（環境変数VECTOR_INDEX_ENABLEDが"1"の場合）
+VECTOR_INDEX_ENABLED = os.getenv("VECTOR_INDEX_ENABLED", "0") == "1"
+# 索引をDBと同期する間隔（秒）．同期では，前回の同期以降に更新された（updated_atが新しい）プロフィールだけを取得する
+VECTOR_INDEX_TTL_SECONDS = float(os.getenv("VECTOR_INDEX_TTL_SECONDS", "300"))
+# 差分の同期で，前回の同期で見た最新のupdated_atより少し前から取得し直す秒数
+# （updated_atはトランザクションの開始時刻のため，遅れてコミットされた更新を取りこぼさないようにする）
+VECTOR_INDEX_SYNC_OVERLAP_SECONDS = float(os.getenv("VECTOR_INDEX_SYNC_OVERLAP_SECONDS", "60"))
+# 索引の種類．"exact"は全件との厳密な比較，"ivf"はクラスタで候補を絞る近似最近傍探索（利用者が多い場合向け）
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "exact")
+# IVFで検索時に調べるクラスタの数（多いほど正確で遅い）
+VECTOR_INDEX_IVF_PROBES = int(os.getenv("VECTOR_INDEX_IVF_PROBES", "8"))
+# 索引の保存先（.npz）．指定した場合は起動時にここから読み込み，保存した時点以降の差分だけをDBから取得する
+# （全プロフィールの埋め込みの取得とIVFの学習を省ける）．同期で変更があるたびに保存し直す
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH")
+
+# 類似ユーザーを，事前計算したテーブル（profile_neighbors）から読むかどうか（環境変数PROFILE_NEIGHBORS_ENABLEDが"1"の場合）
+# テーブルはprecompute_profile_neighbors.pyで作成する
+PROFILE_NEIGHBORS_ENABLED = os.getenv("PROFILE_NEIGHBORS_ENABLED", "0") == "1"
+# 索引（vector_index）・埋め込みの変換（embedding_codec）・類似ユーザーの再計算（profile_neighbors）はNumPyを使うため，
+# 起動を速くするよう，使うときに初めて読み込む
+
+
+def get_profile_cache_stats() -> Dict[str, int]:
+    """
+    プロフィールのキャッシュのヒット・ミス・追い出しの回数と，現在の件数を返す．
+    """
+    return _profile_cache.stats()
+
+
+# 埋め込みのコンパクトな保存形式に対応する，索引の行列の型
+_VECTOR_INDEX_DTYPES = {"float16": "float16", "int8": "int8"}
+
+
+def _vector_index_columns() -> str:
+    # 索引に読み込む列（検索結果として返すプロフィールと，埋め込みとその版．updated_atは差分の同期に使う）
+    return f"{supabase_utils.PROFILE_DETAIL_COLUMNS}, embedding_version, updated_at, {embedding_generator.EMBEDDING_COLUMN}"
+
+
+def _vector_index_dtype() -> str:
+    # コンパクトな形式で保存している場合は，索引も同じ形式で持つ（単精度に戻して持たない）
+    return _VECTOR_INDEX_DTYPES.get(embedding_generator.EMBEDDING_COMPACT_FORMAT, "float32")
+
+
+def _new_vector_index():
+    import vector_index
+    if VECTOR_INDEX_TYPE == "ivf":
+        return vector_index.IVFIndex(dtype=_vector_index_dtype(), n_probe=VECTOR_INDEX_IVF_PROBES)
+    return vector_index.VectorIndex(dtype=_vector_index_dtype())
+
+
+# 初めて類似検索の索引を使うときに作る
+_vector_index = None
+# DBとの同期を1つのスレッドだけで行うためのロック（検索はこのロックを待たない）
+_vector_index_sync_lock = threading.Lock()
+_vector_index_loaded_at: Optional[float] = None
+
+
+def _vector_index_is_fresh() -> bool:
+    return (_vector_index_loaded_at is not None
+            and time.monotonic() - _vector_index_loaded_at < VECTOR_INDEX_TTL_SECONDS)
+
+
+def _load_saved_vector_index():
+    """
+    VECTOR_INDEX_PATHに保存した索引を読み込む．ない場合や読み込めない場合，埋め込みの版や行列の型が
+    現在の設定と異なる場合は，新しい空の索引を返す（全プロフィールから作り直す）．
+    IVFの調べるクラスタの数は，保存時の値ではなく現在の設定（VECTOR_INDEX_IVF_PROBES）を使う．
+    """
+    import vector_index
+    if VECTOR_INDEX_PATH and os.path.exists(VECTOR_INDEX_PATH):
+        try:
+            index_class = vector_index.IVFIndex if VECTOR_INDEX_TYPE == "ivf" else vector_index.VectorIndex
+            index = index_class.load(VECTOR_INDEX_PATH)
+            if index.metadata.get("embedding_version") != embedding_generator.EMBEDDING_VERSION:
+                print("保存済みの索引は埋め込みの版が異なるため，作り直します")
+            elif index.dtype != _vector_index_dtype():
+                print(f"保存済みの索引は行列の型（{index.dtype}）が設定と異なるため，作り直します")
+            else:
+                if VECTOR_INDEX_TYPE == "ivf":
+                    index.n_probe = VECTOR_INDEX_IVF_PROBES
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            print(f"保存済みの索引を読み込めませんでした（作り直します）: {e}")
+    index = _new_vector_index()
+    index.metadata["embedding_version"] = embedding_generator.EMBEDDING_VERSION
+    return index
+
+
+def _sync_since(synced_until: Optional[str]) -> Optional[str]:
+    # 前回の同期で見た最新のupdated_atから，VECTOR_INDEX_SYNC_OVERLAP_SECONDSだけ戻した時刻
+    if synced_until is None:
+        return None
+    return (datetime.fromisoformat(synced_until) - timedelta(seconds=VECTOR_INDEX_SYNC_OVERLAP_SECONDS)).isoformat()
+
+
+def _index_profile(profile: Dict[str, Any]) -> None:
+    """
+    プロフィールを類似検索の索引に追加・更新する．ベクトルがない場合は索引から削除する．
+    索引にはベクトルのほか，検索結果として返すためのプロフィール（ベクトルを除く）を持たせる．
+    """
+    import embedding_codec
+    if "embedding_version" in profile and not embedding_generator.is_current_version(profile):
+        # 古い版で作られたベクトルは，現在の版のベクトルと比べられないため索引に載せない
+        _vector_index.delete(profile["id"])
+        return
+    payload = _index_payload(profile)
+    if embedding_generator.EMBEDDING_COLUMN not in profile:
+        # ベクトルを含まない保存結果の場合は，索引のベクトルはそのままでプロフィールだけを更新する
+        existing = _vector_index.get_vector(profile["id"])
+        if existing is not None:
+            _vector_index.upsert(profile["id"], existing, payload)
+        return
+    embedding = embedding_codec.decode_embedding(profile.get(embedding_generator.EMBEDDING_COLUMN))
+    if embedding is None:
+        _vector_index.delete(profile["id"])
+        return
+    _vector_index.upsert(profile["id"], embedding, payload)
+
+
+def _index_payload(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """索引に持たせる，検索結果として返すプロフィール（ベクトルを除く）を返す．"""
+    return {key: value for key, value in profile.items() if key not in ("embedding", "embedding_compact")}
 
 
 class ProfileManager:
@@ -18,9 +168,36 @@ class ProfileManager:
     アプリケーションのビジネスロジックを担当するクラス．
     フロントエンドからの要求を受け，supabase_utilsの各関数を呼び出す．
     """
-    def __init__(self, supabase_client: Client):
+    def __init__(self, supabase_client: Client, combined_generation: bool = False,
+                 session_client_factory: Optional[Callable[[], Client]] = None):
         #各種supabase_utilsの引数となるsupabaseクライアントを保持
         self.db_client = supabase_client
+        # Trueの場合，自己紹介文と動物分類を1回のAI呼び出しでまとめて生成する
+        self.combined_generation = combined_generation
+        # db_clientを全セッションで共有する場合に，ログインとユーザーの権限での書き込みに使うクライアントを作る関数
+        # 指定しない場合は，db_clientでログインする
+        self._session_client_factory = session_client_factory
+        self._session_client: Optional[Client] = None
+
+    @property
+    def user_client(self) -> Client:
+        """
+        ログイン中のユーザーの権限で読み書きするためのクライアント．ログイン前はdb_clientを返す．
+        書き込みのほか，RLSでログイン中のユーザー（auth.uid()）に絞られる表やRPCの読み取りにも使う．
+        全員が読めるプロフィールの読み取りは，共有のdb_clientで行う．
+        """
+        return self._session_client if self._session_client is not None else self.db_client
+
+    def _get_session_client(self) -> Client:
+        """
+        ログイン・新規登録に使うクライアントを返す．共有のクライアントにログイン状態を持たせないよう，
+        session_client_factoryがあれば，このセッション専用のクライアントを初回に作る．
+        """
+        if self._session_client_factory is None:
+            return self.db_client
+        if self._session_client is None:
+            self._session_client = self._session_client_factory()
+        return self._session_client
 
     def create_profile(self, profile_data: UserInput) -> Dict[str, Any]:
         """
@@ -28,24 +205,18 @@ class ProfileManager:
         POST /profiles 相当．
         """
         try:
-            # AI生成のプロフィールを取得
-            ai_text=ai_utils.generate_introduction_text(profile_data)
-            animal_type=ai_utils.classify_animal_type(profile_data)
+            # AI生成のプロフィールを取得（自己紹介文と動物分類は並列に実行）
+            ai_profile=self._generate_ai_profile(profile_data)
             # AI生成のプロフィールを統合
             intermediate_profile_data={
                 **profile_data,
-                **ai_text,
-                **animal_type
+                **ai_profile
             }  
-            # キーワード文書を作成し，ベクトル化
-            embedding=embedding_generator.generate_embedding_text(intermediate_profile_data)
-            # 最終的なプロフデータを作成
-            final_profile_data = {
-                **intermediate_profile_data,
-                "embedding": embedding
-            }
+            # キーワード文書を作成し，ベクトル化（キーワード文書のハッシュも一緒に保存する）
+            final_profile_data = self._with_embedding(intermediate_profile_data, stored_hash=None)
             # 全てのデータをDBに保存
-            created_profile_list = supabase_utils.add_new_profile(self.db_client, final_profile_data)
+            created_profile_list = supabase_utils.add_new_profile(self.user_client, final_profile_data)
+            self._after_profile_write(created_profile_list[0]["id"], created_profile_list[0])
             return created_profile_list[0]
         except Exception as e:
             print(f"プロフィールの作成中にエラーが発生しました: {e}")
@@ -56,44 +227,166 @@ class ProfileManager:
             ユーザ入力部分を更新する関数．再度AIによる生成も行う．
         """
         try:
-            regenerated_text=ai_utils.generate_introduction_text(user_input)
-            new_animal_type=ai_utils.classify_animal_type(user_input)
+            regenerated_profile=self._generate_ai_profile(user_input)
             profile_for_embedding={
                 **user_input,
-                **regenerated_text,
-                **new_animal_type
-            }
-            new_embedding=embedding_generator.generate_embedding_text(profile_for_embedding)
-            full_profile_data={
-                **profile_for_embedding,
-                "embedding": new_embedding,
+                **regenerated_profile
             }
+            # キーワード文書が変わっていなければ，保存済みのベクトルを使い回す
+            stored_hash=self._get_stored_embedding_hashes([profile_id]).get(profile_id)
+            full_profile_data=self._with_embedding(profile_for_embedding, stored_hash)
             full_profile_data["id"]=profile_id
             
-            updated_profile_list = supabase_utils.replace_profile(self.db_client, full_profile_data)
+            updated_profile_list = supabase_utils.replace_profile(self.user_client, full_profile_data)
+            self._after_profile_write(profile_id, updated_profile_list[0])
             return updated_profile_list
         except Exception as e:
             print(f"プロフィールの更新中にエラーが発生しました: {e}")
             raise ValueError("プロフィールの更新に失敗しました。") from e
 
+    def update_user_inputs(self, user_inputs: Dict[str, UserInput]) -> List[Dict[str, Any]]:
+        """
+            複数ユーザーのユーザ入力部分をまとめて更新する関数（一括更新のスクリプト用）．
+            AIによる生成はユーザーごとに行い，ベクトル化はバッチ埋め込みで1回にまとめる．
+            DBへの書き込みもまとめて行い，更新できたプロフィールのリストを返す（書き込みに失敗したユーザーは含まれない）．
+            引数はプロフィールIDをキー，ユーザ入力を値とする辞書．
+        """
+        try:
+            profiles_for_embedding = []
+            for profile_id, user_input in user_inputs.items():
+                regenerated_profile = self._generate_ai_profile(user_input)
+                profiles_for_embedding.append({
+                    **user_input,
+                    **regenerated_profile,
+                    "id": profile_id
+                })
+            # キーワード文書が変わったユーザーだけをまとめてベクトル化する
+            stored_hashes = self._get_stored_embedding_hashes(list(user_inputs.keys()))
+            new_hashes = [embedding_generator.embedding_hash(profile) for profile in profiles_for_embedding]
+            changed_indexes = [
+                index for index, profile in enumerate(profiles_for_embedding)
+                if stored_hashes.get(profile["id"]) != new_hashes[index]
+            ]
+            new_embeddings = embedding_generator.generate_embeddings_batch(
+                [profiles_for_embedding[index] for index in changed_indexes]
+            )
+            # ハッシュが同じユーザーは保存済みのベクトルを使うため，現在の版であることだけを記録する
+            for profile in profiles_for_embedding:
+                profile["embedding_version"] = embedding_generator.EMBEDDING_VERSION
+            for index, new_embedding in zip(changed_indexes, new_embeddings):
+                profiles_for_embedding[index] = {
+                    **profiles_for_embedding[index],
+                    **embedding_generator.embedding_columns(new_embedding, new_hashes[index]),
+                }
+
+            # まとめて書き込む（失敗した行はsupabase_utils.bulk_upsertが報告し，結果には含まれない）
+            result = supabase_utils.bulk_upsert(self.db_client, 'profiles', profiles_for_embedding)
+            for updated_profile in result["data"]:
+                self._after_profile_write(updated_profile["id"], updated_profile)
+            return result["data"]
+        except Exception as e:
+            print(f"プロフィールの一括更新中にエラーが発生しました: {e}")
+            raise ValueError("プロフィールの一括更新に失敗しました。") from e
+
+    def _generate_ai_profile(self, profile_data: UserInput) -> Dict[str, Any]:
+        """
+        自己紹介文の生成と動物分類を並列に実行し，両方の結果を統合した辞書を返す．
+        combined_generationが有効な場合は，1回のAI呼び出しで両方をまとめて生成する．
+        各呼び出しにはAI_CALL_TIMEOUT_SECONDSのタイムアウトを設け，
+        失敗・タイムアウトした呼び出しがあれば，その内容をまとめてValueErrorを送出する．
+        """
+        if self.combined_generation:
+            futures = {
+                "プロフィールの一括生成": _ai_executor.submit(ai_utils.generate_full_profile, profile_data),
+            }
+        else:
+            futures = {
+                "自己紹介文の生成": _ai_executor.submit(ai_utils.generate_introduction_text, profile_data),
+                "動物分類": _ai_executor.submit(ai_utils.classify_animal_type, profile_data),
+            }
+        # 複数の呼び出しは同時に開始しているため，共通の締め切りで待つ
+        deadline = time.monotonic() + AI_CALL_TIMEOUT_SECONDS
+        results = {}
+        errors = []
+        for label, future in futures.items():
+            try:
+                results[label] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                # 実行中のスレッドは止められないため，結果を待たずに諦める
+                future.cancel()
+                errors.append(f"{label}: {AI_CALL_TIMEOUT_SECONDS}秒以内に応答がありませんでした")
+            except Exception as e:
+                errors.append(f"{label}: {e}")
+
+        if errors:
+            print(f"AIによるプロフィール生成でエラーが発生しました: {' / '.join(errors)}")
+            raise ValueError("AIによるプロフィール生成に失敗しました。（" + " / ".join(errors) + "）")
+
+        merged_profile = {}
+        for result in results.values():
+            merged_profile.update(result)
+        return merged_profile
+
+    def _with_embedding(self, profile_data: Dict[str, Any], stored_hash: Optional[str]) -> Dict[str, Any]:
+        """
+        保存用のプロフィールデータを返す．キーワード文書と埋め込みモデルのハッシュが保存済みのものと同じ場合は，
+        保存済みのベクトルをそのまま使うため，embeddingを含めない（upsertで既存の値が残る）．
+        ハッシュにはモデルと次元数も含まれるため，このベクトルは現在の版のものとして版だけを記録する．
+        異なる場合はベクトルを計算し，ハッシュと一緒に含める．
+        """
+        new_hash = embedding_generator.embedding_hash(profile_data)
+        profile_without_embedding = {
+            key: value for key, value in profile_data.items() if key not in ("embedding", "embedding_compact")
+        }
+        if stored_hash is not None and stored_hash == new_hash:
+            return {**profile_without_embedding, "embedding_version": embedding_generator.EMBEDDING_VERSION}
+        return {
+            **profile_without_embedding,
+            **embedding_generator.embedding_columns(embedding_generator.generate_embedding_text(profile_data), new_hash),
+        }
+
+    def _get_stored_embedding_hashes(self, profile_ids: List[str]) -> Dict[str, Optional[str]]:
+        """
+        保存済みの埋め込みのハッシュを取得する．取得できない場合は空の辞書を返す（ベクトルは再計算される）．
+        """
+        try:
+            return supabase_utils.get_embedding_hashes(
+                self.db_client, profile_ids, embedding_column=embedding_generator.EMBEDDING_COLUMN
+            )
+        except ValueError:
+            return {}
+
+    def _after_profile_write(self, profile_id: str, saved_profile: Dict[str, Any]) -> None:
+        """
+        プロフィールの版数を上げ，そのプロフィールを含む会話のきっかけのキャッシュを無効にする．
+        プロフィールのキャッシュは，保存後のプロフィール（DBが返した行全体）で置き換える．
+        類似検索の索引を読み込み済みの場合は，保存後のプロフィールで索引も更新する．
+        事前計算した類似ユーザーのリスト（他のユーザーの行も含む）は，ユーザーの権限では書き換えられないため，
+        ここでは更新しない（precompute_profile_neighbors.pyの実行で反映する）．
+        """
+        with _profile_versions_lock:
+            _profile_versions[profile_id] += 1
+        _profile_cache.set(profile_id, copy.deepcopy(saved_profile))
+        _conversation_cache.delete_matching(lambda key: profile_id in key[:2])
+        if _vector_index_loaded_at is not None:
+            _index_profile(saved_profile)
+
     def update_generated_profile(self, profile_id: str, profile_data: EditableGeneratedProfile) -> Dict[str, Any]:
         """
             AI生成部分のみを更新する関数．ユーザの変更の上書きを防ぐため，再度AIによる生成は行わない．
+            キャッチコピーのみの編集等でキーワード文書が変わらない場合は，ベクトルの再計算と送信を省く．
         """
         try:
             # DBから既存のプロフィールを取得
-            existing_profile=supabase_utils.get_profile_by_id(self.db_client, profile_id)
+            existing_profile=supabase_utils.get_profile_by_id(self.user_client, profile_id)
+            stored_hash=existing_profile.get("embedding_hash") if embedding_generator.has_stored_embedding(existing_profile) else None
             # ユーザの編集をマージ
             existing_profile.update(profile_data)
-            # 更新されたプロフィールのベクトルを再計算
-            new_embedding=embedding_generator.generate_embedding_text(existing_profile)
-            # 完全なプロフデータを作成
-            full_profile_data = {
-                **existing_profile,
-                "embedding": new_embedding
-            }
+            # 完全なプロフデータを作成（キーワード文書が変わった場合のみベクトルを再計算する）
+            full_profile_data = self._with_embedding(existing_profile, stored_hash)
             # DBに保存
-            updated_profile_list = supabase_utils.replace_profile(self.db_client, full_profile_data)
+            updated_profile_list = supabase_utils.replace_profile(self.user_client, full_profile_data)
+            self._after_profile_write(profile_id, updated_profile_list[0])
             return updated_profile_list[0]
         except Exception as e:
             print(f"プロフィールの更新中にエラーが発生しました: {e}")
@@ -103,60 +396,214 @@ class ProfileManager:
         """
         自身を除く全ユーザーの一覧を取得する．
         GET /profiles相当．
+        一覧のカードに表示する列（supabase_utils.PROFILE_CARD_COLUMNS）だけを返す．詳細はget_profile_detailで取得する．
         """
         try:
-            profiles = supabase_utils.get_all_profiles(self.db_client,current_user_id)
+            profiles = supabase_utils.get_all_profiles(
+                self.db_client, current_user_id, columns=supabase_utils.PROFILE_CARD_COLUMNS
+            )
             return profiles
         except ValueError as e:
             print(f"全ユーザーの取得中にエラーが発生しました: {e}")
             raise
 
+    def get_profiles_page(self, current_user_id: Optional[str] = None, cursor: Optional[Tuple[str, str]] = None,
+                          limit: int = 20) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, str]]]:
+        """
+        自身を除くユーザーの一覧を，新しい順に1ページ分取得する．
+        GET /profiles?cursor=...&limit=... 相当．
+        (カードに表示する列のプロフィールのリスト, 次のページのcursor) を返す．次のページがない場合，cursorはNone．
+        """
+        try:
+            return supabase_utils.get_profiles_page(self.db_client, current_user_id, cursor, limit)
+        except ValueError as e:
+            print(f"全ユーザーの取得中にエラーが発生しました: {e}")
+            raise
+
+    def get_profile_detail(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        """
+        特定のユーザーの，表示用のプロフィール（埋め込みを含まない）を取得する．
+        GET /profiles/{id}/detail 相当．
+        get_profile_by_idと同じキャッシュから読み，埋め込みに関する列を除いて返す．
+        """
+        profile = self._get_cached_profile(profile_id)
+        if profile is None:
+            return None
+        return {
+            key: copy.deepcopy(value) for key, value in profile.items()
+            if key not in ("embedding", "embedding_compact", "embedding_hash", "embedding_version")
+        }
+
     def get_profile_by_id(self, profile_id: str) -> Dict[str, Any]:
         """
         特定のユーザー情報を取得する．
         GET /profiles/{id}相当．
         """
+        profile = self._get_cached_profile(profile_id)
+        # キャッシュ内のプロフィールを呼び出し元が変更しても，他の呼び出しに波及しないようにする
+        return copy.deepcopy(profile)
+
+    def _get_cached_profile(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        """
+        プロフィールをキャッシュから返す．キャッシュにない場合はDBから取得してキャッシュに保存する．
+        返す値はキャッシュ内のオブジェクトそのものなので，変更してはいけない．
+        存在しないプロフィール（None）はキャッシュしない（作成直後に見つからないままになるのを防ぐ）．
+        """
+        cached = _profile_cache.get(profile_id)
+        if cached is not None:
+            return cached
+        with _profile_versions_lock:
+            version = _profile_versions[profile_id]
         try:
-            profile = supabase_utils.get_profile_by_id(self.db_client, profile_id)
-            return profile
+            # QRコードの読み取り等で同じプロフィールへのアクセスが集中しても，DBへの問い合わせは1回にまとめる
+            profile = _single_flight.do(
+                ("profile", profile_id),
+                lambda: supabase_utils.get_profile_by_id(self.db_client, profile_id)
+            )
         except ValueError as e:
             print(f"プロフィールの取得中にエラーが発生しました: {e}")
             raise
+        with _profile_versions_lock:
+            # 取得中に書き込みがあった場合は，取得した古いプロフィールで書き込み後のキャッシュを上書きしない
+            if profile is not None and _profile_versions[profile_id] == version:
+                _profile_cache.set(profile_id, profile)
+        return profile
 
     def find_similar_profiles(self, profile_id: str) -> List[Dict[str, Any]]:
         """
         類似ユーザーを検索する．
         GET /profiles/{id}/similar 相当．
+        同じユーザーの検索が同時に要求された場合は，1回の検索結果を共有する．
         """
+        return _single_flight.do(
+            ("similar", profile_id), lambda: self._find_similar_profiles(profile_id)
+        )
+
+    def _find_similar_profiles(self, profile_id: str) -> List[Dict[str, Any]]:
+        if PROFILE_NEIGHBORS_ENABLED:
+            # 事前計算済みであれば，1回の問い合わせで済む
+            try:
+                precomputed = supabase_utils.get_similar_profiles_from_neighbors(self.user_client, profile_id)
+                if precomputed is not None:
+                    # 事前計算の後に古い版のまま残っているユーザーは除く
+                    return [profile for profile in precomputed if embedding_generator.is_current_version(profile)]
+            except ValueError:
+                pass
+        if VECTOR_INDEX_ENABLED or embedding_generator.EMBEDDING_COMPACT_FORMAT:
+            # コンパクトな形式ではDB側のpgvectorで検索できないため，常にメモリ上の索引を使う
+            self._ensure_vector_index()
+            query_vector = _vector_index.get_vector(profile_id)
+            if query_vector is not None:
+                # 索引に載っていれば，DBに問い合わせずにメモリ上で検索する（match_profilesと同じ条件）
+                return [
+                    {**payload, "similarity": score}
+                    for _, score, payload in _vector_index.search(
+                        query_vector,
+                        k=supabase_utils.SIMILAR_USERS_MATCH_COUNT,
+                        min_score=supabase_utils.SIMILARITY_THRESHOLD,
+                        exclude_ids=[profile_id]
+                    )
+                ]
+        if embedding_generator.EMBEDDING_COMPACT_FORMAT:
+            # 索引に載っていない（埋め込みのない，または古い版の）ユーザー
+            return []
         query_profile=supabase_utils.get_profile_by_id(self.db_client, profile_id)
         if not query_profile or not query_profile.get('embedding'):
             print(f"プロフィールの取得中にエラーが発生しました: embeddingが存在しません")
             raise ValueError("プロフィールの取得に失敗しました。")
         query_vector=query_profile['embedding']
+        if not embedding_generator.is_current_version(query_profile):
+            # 保存済みのベクトルが古い版の場合は，現在の版で作り直したベクトルで検索する
+            query_vector = embedding_generator.generate_embedding_text(query_profile)
         similar_profiles=supabase_utils.find_similar_users(
-            supabase=self.db_client,
+            supabase=self.user_client,
             user_id=profile_id,
-            query_vector=query_vector
+            query_vector=query_vector,
+            embedding_version=embedding_generator.EMBEDDING_VERSION
         )
         return similar_profiles
+    def _ensure_vector_index(self) -> None:
+        """
+        類似検索の索引が未読み込み，またはVECTOR_INDEX_TTL_SECONDSより古い場合に，DBと同期する．
+        （他のプロセスでの書き込みは，同期するまで索引に反映されない）
+        同期は1つのスレッドだけが行う．読み込み済みの索引がある場合，他のスレッドは同期を待たずに今の索引で検索する．
+        """
+        if _vector_index_is_fresh():
+            return
+        if _vector_index_loaded_at is not None:
+            if not _vector_index_sync_lock.acquire(blocking=False):
+                return
+        else:
+            # 索引がまだない場合は，最初の同期が終わるまで待つ
+            _vector_index_sync_lock.acquire()
+        try:
+            if not _vector_index_is_fresh():
+                self._sync_vector_index()
+        finally:
+            _vector_index_sync_lock.release()
+
+    def _sync_vector_index(self) -> None:
+        """
+        前回の同期以降に更新されたプロフィールだけをDBから取得して索引に反映し，削除されたユーザーを索引から除く．
+        初回は保存済みの索引（VECTOR_INDEX_PATH）があれば読み込み，保存した時点以降の差分だけを取得する．
+        索引は作り直さずに差分を反映するため，IVFのクラスタはそのまま使われる．
+        """
+        global _vector_index, _vector_index_loaded_at
+        import embedding_codec
+        index = _vector_index if _vector_index is not None else _load_saved_vector_index()
+        synced_until = index.metadata.get("synced_until")
+        profiles = supabase_utils.get_profiles_updated_since(
+            self.db_client, _vector_index_columns(), _sync_since(synced_until)
+        )
+        # 削除されたユーザー（差分には現れない）を除く．全件を取得した場合は，取得した結果にないユーザー
+        if synced_until is None:
+            current_ids = {profile["id"] for profile in profiles}
+        else:
+            current_ids = set(supabase_utils.get_profile_ids(self.db_client))
+        removed_ids = [item_id for item_id in index.ids() if item_id not in current_ids]
+        for item_id in removed_ids:
+            index.delete(item_id)
+
+        ids, vectors, payloads = [], [], []
+        for profile in profiles:
+            embedding = embedding_codec.decode_embedding(profile.get(embedding_generator.EMBEDDING_COLUMN))
+            if embedding is not None and embedding_generator.is_current_version(profile):
+                ids.append(profile["id"])
+                vectors.append(embedding)
+                payloads.append(_index_payload(profile))
+            else:
+                index.delete(profile["id"])
+        # コンパクトな型の索引では，まとめてembedding_codec.to_compact_matrixで変換する
+        index.upsert_many(ids, vectors, payloads)
+        updated_ats = [profile["updated_at"] for profile in profiles if profile.get("updated_at")]
+        if updated_ats:
+            index.metadata["synced_until"] = max(updated_ats)
+        if VECTOR_INDEX_PATH and (profiles or removed_ids or _vector_index is None):
+            try:
+                index.save(VECTOR_INDEX_PATH)
+            except OSError as e:
+                print(f"索引を保存できませんでした: {e}")
+        _vector_index = index
+        _vector_index_loaded_at = time.monotonic()
+
     def sign_up(self,email:str,password:str)->Dict[str,Any]:
         """
         新しいユーザをSupabase Authに登録する．
         また，自動的にログインも行う．
         """
-        return supabase_utils.sign_up(self.db_client,email,password)
+        return supabase_utils.sign_up(self._get_session_client(),email,password)
     def sign_in(self,email:str,password:str)->Dict[str,Any]: 
         """
         ユーザをSupabase Authにログインさせる．
         """
-        return supabase_utils.sign_in(self.db_client,email,password)
+        return supabase_utils.sign_in(self._get_session_client(),email,password)
     def check_profile_exists(self, user_id: str) -> bool:
         """
         プロフィールが存在するか確認する．
         """
         try:
-            profile=self.get_profile_by_id(user_id)
-            return profile is not None
+            # 存在の確認だけなので，キャッシュ内のプロフィールを複製せずに使う
+            return self._get_cached_profile(user_id) is not None
         except ValueError:
             return False
 
@@ -164,12 +611,34 @@ class ProfileManager:
     def generate_conversation_starters(self, my_id: str, opponent_id: str) -> Dict[str, List[str]]:
         """
         自分と相手のIDを元に、会話のきっかけを生成する。
+        同じ組み合わせの結果はキャッシュから返し，どちらかのプロフィールが更新されると再生成する。
+        同じ組み合わせの生成が実行中の場合は，その結果を待って共有する。
+        """
+        with _profile_versions_lock:
+            cache_key = (my_id, opponent_id, _profile_versions[my_id], _profile_versions[opponent_id])
+        cached = _conversation_cache.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        return _single_flight.do(
+            ("conversation",) + cache_key,
+            lambda: self._generate_conversation_starters(my_id, opponent_id, cache_key)
+        )
+
+    def _get_conversation_profiles(self, my_id: str, opponent_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        会話のきっかけ生成に使う2人のプロフィール（埋め込みを除く）を，1回の問い合わせで取得する．
         """
+        my_profile, opponent_profile = supabase_utils.get_profiles_by_ids(
+            self.db_client, [my_id, opponent_id], columns=supabase_utils.PROFILE_DETAIL_COLUMNS
+        )
+        return my_profile, opponent_profile
+
+    def _generate_conversation_starters(self, my_id: str, opponent_id: str, cache_key: tuple) -> Dict[str, List[str]]:
         try:
             # 1. データベースから、自分と相手のプロフィール情報を取得する
             #    (self を使って、同じクラス内のメソッドを呼び出します)
-            my_profile = self.get_profile_by_id(my_id)
-            opponent_profile = self.get_profile_by_id(opponent_id)
+            my_profile, opponent_profile = self._get_conversation_profiles(my_id, opponent_id)
 
             if not my_profile or not opponent_profile:
                 return {
@@ -177,20 +646,109 @@ class ProfileManager:
                     "topics": []
                 }
             
-            # 2. 取得した2つのプロフィール情報を、ai_utilsの関数に渡して、AIに会話のきっかけを生成させる
-            conversation_data = ai_utils.create_conversation_starters(my_profile, opponent_profile)
+            # 2. 事前計算済みのデータがあればそれを使い、なければai_utilsの関数でAIに会話のきっかけを生成させる
+            conversation_data = self._get_precomputed_conversation_starters(my_profile, opponent_profile)
+            if conversation_data is None:
+                conversation_data = ai_utils.create_conversation_starters(my_profile, opponent_profile)
 
-            # 3. AIが生成した結果を、そのまま返す
+            # 3. AIが生成した結果をキャッシュに保存してから返す
+            _conversation_cache.set(cache_key, copy.deepcopy(conversation_data))
             return conversation_data
         except Exception as e:
             print(f"会話のきっかけ生成中にエラーが発生しました: {e}")
             raise ValueError("会話のきっかけ生成に失敗しました。") from e
 
+    def _get_precomputed_conversation_starters(self, my_profile: Dict[str, Any], opponent_profile: Dict[str, Any]) -> Optional[Dict[str, List[str]]]:
+        """
+        バッチ処理で事前計算された会話のきっかけを取得する。
+        計算時から2人のどちらかのプロフィールが変わっている場合や，取得に失敗した場合はNoneを返す。
+        """
+        try:
+            stored = supabase_utils.get_conversation_starter(self.user_client, my_profile["id"], opponent_profile["id"])
+        except ValueError:
+            return None
+        if not stored:
+            return None
+        if (stored.get("my_profile_hash") != ai_utils.conversation_profile_hash(my_profile)
+                or stored.get("opponent_profile_hash") != ai_utils.conversation_profile_hash(opponent_profile)):
+            return None
+        return {
+            "common_points": stored.get("common_points") or [],
+            "topics": stored.get("topics") or []
+        }
+
+    def stream_conversation_starters(self, my_id: str, opponent_id: str) -> Iterator[Tuple[str, str]]:
+        """
+        generate_conversation_startersのストリーミング版。
+        共通点・話題の各要素を (キー, 要素) の組で，生成され次第yieldする。
+        キャッシュにヒットした場合はキャッシュの内容を，全て受信した場合は結果をキャッシュに保存する。
+        同じ組み合わせの生成が実行中の場合は，新たに生成せずにその結果を待ってから返す。
+        """
+        with _profile_versions_lock:
+            cache_key = (my_id, opponent_id, _profile_versions[my_id], _profile_versions[opponent_id])
+        cached = _conversation_cache.get(cache_key)
+        if cached is None:
+            future, is_leader = _single_flight.join(("conversation",) + cache_key)
+            if is_leader:
+                yield from self._stream_and_share_conversation_starters(my_id, opponent_id, cache_key, future)
+                return
+            try:
+                cached = future.result()
+            except Exception as e:
+                print(f"会話のきっかけ生成中にエラーが発生しました: {e}")
+                raise ValueError("会話のきっかけ生成に失敗しました。") from e
+
+        for key in ai_utils.CONVERSATION_STARTER_KEYS:
+            for item in cached.get(key, []):
+                yield key, item
+
+    def _stream_and_share_conversation_starters(self, my_id: str, opponent_id: str, cache_key: tuple,
+                                                future) -> Iterator[Tuple[str, str]]:
+        """
+        会話のきっかけをストリーミングで生成し，完了したら同じ組み合わせを待っている呼び出しに結果を渡す。
+        途中で失敗した場合や，画面の移動等でストリームが閉じられた場合も，待っている呼び出しに知らせる。
+        """
+        flight_key = ("conversation",) + cache_key
+        try:
+            conversation_data = yield from self._stream_conversation_starters(my_id, opponent_id, cache_key)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # GeneratorExit等は待っている呼び出しに送出させず，失敗として扱う
+                e = ValueError("会話のきっかけ生成が中断されました。")
+            _single_flight.finish(flight_key, future, error=e)
+            raise
+        _single_flight.finish(flight_key, future, conversation_data)
+
+    def _stream_conversation_starters(self, my_id: str, opponent_id: str,
+                                      cache_key: tuple) -> Generator[Tuple[str, str], None, Dict[str, List[str]]]:
+        try:
+            my_profile, opponent_profile = self._get_conversation_profiles(my_id, opponent_id)
+            if not my_profile or not opponent_profile:
+                yield "common_points", "エラー：プロフィールの取得に失敗しました。"
+                return {"common_points": ["エラー：プロフィールの取得に失敗しました。"], "topics": []}
+
+            conversation_data = self._get_precomputed_conversation_starters(my_profile, opponent_profile)
+            if conversation_data is not None:
+                for key in ai_utils.CONVERSATION_STARTER_KEYS:
+                    for item in conversation_data.get(key, []):
+                        yield key, item
+            else:
+                conversation_data = {key: [] for key in ai_utils.CONVERSATION_STARTER_KEYS}
+                for key, item in ai_utils.stream_conversation_starters(my_profile, opponent_profile):
+                    conversation_data[key].append(item)
+                    yield key, item
+        except Exception as e:
+            print(f"会話のきっかけ生成中にエラーが発生しました: {e}")
+            raise ValueError("会話のきっかけ生成に失敗しました。") from e
+
+        _conversation_cache.set(cache_key, conversation_data)
+        return copy.deepcopy(conversation_data)
+
     def get_memo_for_target(self, current_user_id: str, target_user_id: str) -> Dict[str, Any] | None:
         """
         現在ログインしているユーザーが、対象ユーザーについて書いたメモを取得する。
         """
-        return supabase_utils.get_memo(self.db_client, current_user_id, target_user_id)
+        return supabase_utils.get_memo(self.user_client, current_user_id, target_user_id)
     def save_memo(self,current_user_id:str,target_user_id:str,content:str)->Dict[str,Any]:
             """
             現在ログインしているユーザーが,対象ユーザーについてメモを保存する.
@@ -202,10 +760,10 @@ class ProfileManager:
                 
                 if existing_memo:
                     # あれば更新
-                    return supabase_utils.update_memo(self.db_client, current_user_id, target_user_id, content)
+                    return supabase_utils.update_memo(self.user_client, current_user_id, target_user_id, content)
                 else:
                     # なければ新規作成
-                    return supabase_utils.insert_memo(self.db_client, current_user_id, target_user_id, content)
+                    return supabase_utils.insert_memo(self.user_client, current_user_id, target_user_id, content)
             except Exception as e:
                 # 予期せぬエラーをキャッチ
                 print(f"メモの保存処理全体でエラーが発生しました: {e}")
@@ -214,7 +772,7 @@ class ProfileManager:
         """
         現在ログインしているユーザーが，対象ユーザーについて書いたメモを削除する．
         """
-        return supabase_utils.delete_memo(self.db_client,current_user_id,target_user_id)
+        return supabase_utils.delete_memo(self.user_client,current_user_id,target_user_id)
     def upload_profile_image(self,user_id:str,file_body,file_name:str)->str:
         """
         プロフィール画像をSupabase Storageにアップロードし，その公開URLを取得する．
@@ -232,7 +790,7 @@ class ProfileManager:
 
         # supabase_utilsの関数を呼び出し，アップロード&URL取得
         public_url=supabase_utils.upload_file_and_get_url(
-            supabase=self.db_client,
+            supabase=self.user_client,
             bucket_name="profile_images",
             file_path=file_path,
             file_body=file_body
@@ -259,7 +817,8 @@ class ProfileManager:
         """
         指定されたユーザーのプロフィール画像URLをデータベースで更新する．
         """
-        updated_profile_list = supabase_utils.update_profile_url(self.db_client, user_id, public_url)
+        updated_profile_list = supabase_utils.update_profile_url(self.user_client, user_id, public_url)
+        self._after_profile_write(user_id, updated_profile_list[0])
         return updated_profile_list[0]
     def search_profiles(self, query: str, current_user_id: Optional[str]) -> List[Dict[str, Any]]:
         """
@@ -268,4 +827,4 @@ class ProfileManager:
         if not query:
             return []
         
-        return supabase_utils.search_profiles(self.db_client, query, current_user_id)
\ No newline at end of file
+        return supabase_utils.search_profiles(self.user_client, query, current_user_id)
\ No newline at end of file
@@ -0,0 +1,118 @@
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 各プロフィールの類似上位k人のリスト．(相手のID, 類似度) を類似度の高い順に並べる
+NeighborList = List[Tuple[str, float]]
+# プロフィールIDを受け取り，そのベクトルと全プロフィールとの類似度を (IDのリスト, 類似度の配列) で返す関数．
+# ベクトルがない（削除された）場合はNoneを返す
+ScoreAllFunction = Callable[[str], Optional[Tuple[Sequence[str], np.ndarray]]]
+
+
+def top_k_from_scores(ids: Sequence[str], scores: np.ndarray, self_id: Optional[str], k: int,
+                      min_score: float) -> NeighborList:
+    """
+    1人分の類似度の配列から，自分自身を除いて類似度がmin_score以上の上位k人を返す．
+    """
+    scores = np.asarray(scores, dtype=np.float32).copy()
+    if self_id is not None:
+        scores[[i for i, item_id in enumerate(ids) if item_id == self_id]] = -np.inf
+    return _top_k_row(ids, scores, k, min_score)
+
+
+def _top_k_row(ids: Sequence[str], scores: np.ndarray, k: int, min_score: float) -> NeighborList:
+    if k <= 0 or len(scores) == 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(ids[i], float(scores[i])) for i in top if scores[i] >= min_score]
+
+
+def compute_all_neighbors(ids: Sequence[str], vectors: np.ndarray, k: int, min_score: float,
+                          block_size: int = 256) -> Dict[str, NeighborList]:
+    """
+    全プロフィールの組の類似度を計算し，各プロフィールの類似上位k人を返す．
+    vectorsはL2正規化済みの行列（プロフィール数×次元）．
+    類似度の行列はblock_size行ずつ計算するため，メモリ使用量は block_size×プロフィール数 に収まる．
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    neighbors: Dict[str, NeighborList] = {}
+    for start in range(0, len(ids), block_size):
+        block = vectors[start:start + block_size] @ vectors.T
+        for offset, scores in enumerate(block):
+            # 自分自身は除外する
+            scores[start + offset] = -np.inf
+            neighbors[ids[start + offset]] = _top_k_row(ids, scores, k, min_score)
+    return neighbors
+
+
+def affected_profile_ids(profile_id: str, score_all: ScoreAllFunction, listing_ids: Iterable[str],
+                         min_score: float) -> List[str]:
+    """
+    プロフィールが変わったときにリストを見直す必要があるプロフィール（列にあたる）を返す．
+    変更前にこのプロフィールをリストに含んでいたプロフィール（listing_ids）と，変更後の類似度がmin_score以上のプロフィール．
+    """
+    affected = set(listing_ids)
+    scored = score_all(profile_id)
+    if scored is not None:
+        ids, scores = scored
+        affected.update(item_id for item_id, score in zip(ids, scores) if score >= min_score)
+    affected.discard(profile_id)
+    return sorted(affected)
+
+
+def refresh_profile(profile_id: str, score_all: ScoreAllFunction, current_lists: Dict[str, NeighborList],
+                    k: int, min_score: float) -> Dict[str, NeighborList]:
+    """
+    1人のプロフィール（ベクトル）が変わったときに，そのプロフィールの行と列だけを計算し直す．
+    current_listsには，affected_profile_idsが返したプロフィールの現在のリストを渡す（未計算のプロフィールは含めなくてよい）．
+    変更があったプロフィールの新しいリストを返す（変更されたプロフィール自身のリストは必ず含む）．
+
+    他のプロフィールのリストは，このプロフィールの出入りだけを反映する．
+    ただし，リストが埋まっていて，このプロフィールの類似度が下がって圏外になった場合は，
+    圏外にいた次の人がわからないため，そのプロフィールの行も計算し直す．
+    """
+    scored = score_all(profile_id)
+    updated: Dict[str, NeighborList] = {
+        profile_id: [] if scored is None else top_k_from_scores(*scored, profile_id, k, min_score)
+    }
+    new_scores = {} if scored is None else dict(zip(scored[0], (float(score) for score in scored[1])))
+
+    affected = set(current_lists) | {item_id for item_id, score in new_scores.items() if score >= min_score}
+    affected.discard(profile_id)
+    for other_id in sorted(affected):
+        if other_id not in current_lists:
+            # 未計算のプロフィールは，行を丸ごと計算する
+            other_scored = score_all(other_id)
+            updated[other_id] = [] if other_scored is None else top_k_from_scores(*other_scored, other_id, k, min_score)
+            continue
+
+        current = current_lists[other_id]
+        # 類似度は対称なので，相手から見たこのプロフィールの類似度は new_scores[other_id] と等しい
+        updated_list = _update_list(profile_id, current, new_scores.get(other_id), k, min_score)
+        if updated_list is None:
+            other_scored = score_all(other_id)
+            updated_list = [] if other_scored is None else top_k_from_scores(*other_scored, other_id, k, min_score)
+        if updated_list != current:
+            updated[other_id] = updated_list
+    return updated
+
+
+def _update_list(profile_id: str, current: NeighborList, score: Optional[float], k: int,
+                 min_score: float) -> Optional[NeighborList]:
+    """
+    1つのリストに，profile_idの新しい類似度を反映する．正しく求められない（行の再計算が必要な）場合はNoneを返す．
+    """
+    others = [(item_id, value) for item_id, value in current if item_id != profile_id]
+    was_listed = len(others) != len(current)
+    qualifies = score is not None and score >= min_score
+    if was_listed and len(current) >= k:
+        # リストが埋まっていた場合，圏外の人の類似度は元のk位以下だとしかわからない
+        kth_score = current[-1][1]
+        if not qualifies or score < kth_score:
+            return None
+    if not qualifies:
+        return others
+    candidates = others + [(profile_id, float(score))]
+    candidates.sort(key=lambda item: -item[1])
+    return candidates[:k]
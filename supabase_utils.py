@@ -1,8 +1,67 @@
-from supabase import Client
-from typing import Dict, Any, List
+import os
+import httpx
+from supabase import Client, ClientOptions, create_client
+from typing import Callable, Dict, Any, List, Tuple
 from typing import Optional
 
-def get_profile_by_id(supabase: Client, profile_id: str):
+# 全セッションで共有するクライアントの接続プールの設定
+# 同時に開く接続の上限と，使い回すために開いたままにしておく接続の数・時間
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SUPABASE_MAX_KEEPALIVE_CONNECTIONS", "10"))
+SUPABASE_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY_SECONDS", "60"))
+# 1回の問い合わせのタイムアウト（秒）．supabase-pyの既定値と同じ
+SUPABASE_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "120"))
+# 共有のクライアントでHTTP/2を使うかどうか（環境変数SUPABASE_HTTP2が"1"の場合．既定はHTTP/1.1）
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "0") == "1"
+
+# 一覧のカードに表示する列（埋め込み等の大きな列は含めない）
+# created_atは一覧をページ単位で読み進めるための位置として使う
+PROFILE_CARD_COLUMNS = "id, created_at, nickname, last_name, first_name, profile_image_url, animal_name"
+# プロフィールの詳細の表示に使う列（埋め込みに関する列は含めない）
+PROFILE_DETAIL_COLUMNS = (
+    "id, nickname, last_name, first_name, profile_image_url, catchphrase, tags, introduction_text, "
+    "animal_name, animal_category, animal_reason, birth_date, university, hometown, hobbies, happy_topic, expert_topic"
+)
+
+def create_shared_client(supabase_url: str, supabase_key: str) -> Client:
+    """
+    全セッションで共有するSupabaseクライアントを作成する．
+    テーブルとRPC（PostgREST）には，接続数に上限のある専用の接続プールを持たせ，接続をKeep-Aliveで使い回すため，
+    セッションごとのTLSハンドシェイクを省ける．
+
+    このクライアントではログインしない（ログインすると，全セッションの問い合わせがそのユーザーの権限で行われてしまう）．
+    supabase-pyはClientOptionsで渡した接続プールの接続先をサービスごとに書き換えるため，接続プールはPostgRESTにだけ渡し，
+    ストレージや認証は，それぞれ既定の専用のクライアントを使う（PostgRESTの問い合わせ先が変わらないようにする）．
+    """
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=SUPABASE_TIMEOUT_SECONDS,
+        follow_redirects=True,
+        http2=SUPABASE_HTTP2,
+    )
+    options = ClientOptions(persist_session=False, auto_refresh_token=False)
+    client = create_client(supabase_url, supabase_key, options=options)
+    # supabase-pyには，PostgRESTにだけ接続プールを渡す公開の方法がないため，最初に作られるPostgRESTのクライアントを置き換える
+    client._postgrest = client._init_postgrest_client(
+        rest_url=client.rest_url,
+        headers=client.options.headers,
+        schema=client.options.schema,
+        http_client=http_client,
+    )
+    return client
+
+def create_session_client(supabase_url: str, supabase_key: str) -> Client:
+    """
+    1人のユーザー（セッション）専用のSupabaseクライアントを作成する．
+    ログイン・新規登録と，ログイン中のユーザーの権限で行う書き込みやストレージへのアップロードに使う．
+    """
+    return create_client(supabase_url, supabase_key)
+
+def get_profile_by_id(supabase: Client, profile_id: str, columns: str = "*"):
     """
     ユーザーIDを元に，特定のプロフィールをデータベースから取得する．
     一覧ページからプロフィール詳細ページに遷移する際等に使用
@@ -10,12 +69,13 @@ def get_profile_by_id(supabase: Client, profile_id: str):
     Args:
         supabase: Supabaseクライアントのインスタンス．
         profile_id: 取得したいユーザのID．
+        columns: 取得する列（既定では埋め込みを含む全ての列）．表示だけに使う場合はPROFILE_DETAIL_COLUMNSを指定する．
 
     Returns:
         指定されたユーザーのプロフィールデータ．
     """
     try:
-        response = supabase.table('profiles').select("*").eq('id', profile_id).execute()
+        response = supabase.table('profiles').select(columns).eq('id', profile_id).execute()
         # 結果のリストにデータが含まれていれば、最初の要素（辞書）を返す
         if response.data:
             return response.data[0]
@@ -26,6 +86,29 @@ def get_profile_by_id(supabase: Client, profile_id: str):
         print(f"データベースへのアクセス中にエラーが発生しました。: {e}")
         raise ValueError("データベースへのアクセス中にエラーが発生しました。") from e
 
+def get_profiles_by_ids(supabase: Client, profile_ids: List[str], columns: str = "*") -> List[Optional[Dict[str, Any]]]:
+    """
+    複数のユーザーのプロフィールを1回の問い合わせでまとめて取得する．
+    結果はprofile_idsと同じ順序で返し，存在しないユーザーの位置にはNoneを入れる．
+
+    Args:
+        supabase: Supabaseクライアントのインスタンス．
+        profile_ids: 取得したいユーザのIDのリスト．
+        columns: 取得する列（既定では埋め込みを含む全ての列）．
+
+    Returns:
+        プロフィールデータ（またはNone）のリスト．
+    """
+    if not profile_ids:
+        return []
+    try:
+        response = supabase.table('profiles').select(columns).in_('id', list(dict.fromkeys(profile_ids))).execute()
+        profiles_by_id = {row['id']: row for row in response.data or []}
+        return [profiles_by_id.get(profile_id) for profile_id in profile_ids]
+    except Exception as e:
+        print(f"データベースへのアクセス中にエラーが発生しました。: {e}")
+        raise ValueError("データベースへのアクセス中にエラーが発生しました。") from e
+
 def add_new_profile(supabase: Client, profile_data: Dict[str, Any]):
     """
     新しいユーザープロフィールをデータベースに挿入する．
@@ -67,7 +150,134 @@ def replace_profile(supabase: Client, profile_data: Dict[str, Any]):
         print(f"プロフィールの更新中にエラーが発生しました: {e}")
         raise ValueError("プロフィールの更新中にエラーが発生しました。") from e
 
-def find_similar_users(supabase: Client, user_id: str, query_vector: list):
+# bulk_upsertで1回のリクエストにまとめる行数
+BULK_WRITE_CHUNK_SIZE = 500
+
+def bulk_upsert(supabase: Client, table: str, rows: List[Dict[str, Any]], on_conflict: str = 'id',
+                chunk_size: int = BULK_WRITE_CHUNK_SIZE,
+                on_progress: Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+    """
+    複数の行をchunk_size行ずつまとめてupsertする（一括更新のスクリプト用）．
+    まとめた書き込みが失敗した場合は，そのチャンクだけ1行ずつ書き込み直し，失敗した行を報告する．
+    含めなかった列は既存の行では変更されない．まとめて書き込むと他の行にない列がNULLで埋められるため，
+    持っている列が同じ行ごとに分けてまとめる．
+
+    Args:
+        supabase: Supabaseクライアントのインスタンス
+        table: 書き込むテーブル名
+        rows: 書き込む行のリスト
+        on_conflict: 既存の行を特定する列（カンマ区切り）
+        chunk_size: 1回のリクエストにまとめる行数
+        on_progress: チャンク（または1行）を書き込むたびに，処理した行数を渡して呼ばれる関数（進捗表示用）
+
+    Returns:
+        {"data": 書き込まれた行のリスト, "failed": [{"key": on_conflictの列の値, "error": エラー内容}, ...]}
+    """
+    key_columns = [column.strip() for column in on_conflict.split(',')]
+    rows_by_columns: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in rows:
+        rows_by_columns.setdefault(tuple(sorted(row)), []).append(row)
+    chunks = [
+        same_columns[start:start + chunk_size]
+        for same_columns in rows_by_columns.values()
+        for start in range(0, len(same_columns), chunk_size)
+    ]
+
+    written: List[Dict[str, Any]] = []
+    failed: List[Dict[str, Any]] = []
+    for chunk in chunks:
+        try:
+            response = supabase.table(table).upsert(chunk, on_conflict=on_conflict).execute()
+            written.extend(response.data or [])
+            if on_progress:
+                on_progress(len(chunk))
+            continue
+        except Exception as e:
+            print(f"{len(chunk)}行の一括書き込みに失敗したため，1行ずつ書き込み直します: {e}")
+
+        for row in chunk:
+            try:
+                response = supabase.table(table).upsert([row], on_conflict=on_conflict).execute()
+                written.extend(response.data or [])
+            except Exception as e:
+                key = {column: row.get(column) for column in key_columns}
+                print(f"行 {key} の書き込みに失敗しました: {e}")
+                failed.append({"key": key, "error": str(e)})
+            if on_progress:
+                on_progress(1)
+    return {"data": written, "failed": failed}
+
+# bulk_update_profilesで書き込める列（bulk_update_profiles関数のSQLで更新する列と合わせる）
+BULK_UPDATE_PROFILE_COLUMNS = ("searchable_text", "embedding", "embedding_compact", "embedding_hash", "embedding_version")
+
+def bulk_update_profiles(supabase: Client, rows: List[Dict[str, Any]], chunk_size: int = BULK_WRITE_CHUNK_SIZE,
+                         on_progress: Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+    """
+    既存のプロフィールの一部の列を，chunk_size行ずつまとめて更新する（一括更新のスクリプト用）．
+    upsertと違って行を追加しないため，処理中に削除されたユーザーが一部の列だけの行として復活することはなく，
+    NOT NULLの列を含める必要もない．行に含めなかった列は変更されない．
+    まとめた更新が失敗した場合は，そのチャンクだけ1行ずつ更新し直し，失敗した行を報告する．
+    Supabaseに以下のSQL関数を作成しておく．
+
+        create or replace function bulk_update_profiles(profile_rows jsonb)
+        returns setof profiles language sql as $$
+          update profiles p
+             set (searchable_text, embedding, embedding_compact, embedding_hash, embedding_version) = (
+                   select r.searchable_text, r.embedding, r.embedding_compact, r.embedding_hash, r.embedding_version
+                     from jsonb_populate_record(p, e.row) r)
+            from jsonb_array_elements(profile_rows) as e(row)
+           where p.id = (e.row->>'id')::uuid
+          returning p.*;
+        $$;
+
+    Args:
+        supabase: Supabaseクライアントのインスタンス
+        rows: 更新する行のリスト．"id"と，BULK_UPDATE_PROFILE_COLUMNSの列だけを含める
+        chunk_size: 1回のリクエストにまとめる行数
+        on_progress: チャンク（または1行）を更新するたびに，処理した行数を渡して呼ばれる関数（進捗表示用）
+
+    Returns:
+        {"data": 更新された行のリスト, "failed": [{"key": {"id": ユーザーID}, "error": エラー内容}, ...]}
+        （削除済みのユーザーは更新されず，どちらにも含まれない）
+    """
+    for row in rows:
+        unknown_columns = set(row) - {"id", *BULK_UPDATE_PROFILE_COLUMNS}
+        if "id" not in row or unknown_columns:
+            raise ValueError(f"bulk_update_profilesで更新できない列が含まれています: {sorted(unknown_columns) or ['id']}")
+
+    written: List[Dict[str, Any]] = []
+    failed: List[Dict[str, Any]] = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            response = supabase.rpc('bulk_update_profiles', {'profile_rows': chunk}).execute()
+            written.extend(response.data or [])
+            if on_progress:
+                on_progress(len(chunk))
+            continue
+        except Exception as e:
+            print(f"{len(chunk)}行の一括更新に失敗したため，1行ずつ更新し直します: {e}")
+
+        for row in chunk:
+            try:
+                response = supabase.rpc('bulk_update_profiles', {'profile_rows': [row]}).execute()
+                written.extend(response.data or [])
+            except Exception as e:
+                print(f"ユーザー {row['id']} の更新に失敗しました: {e}")
+                failed.append({"key": {"id": row["id"]}, "error": str(e)})
+            if on_progress:
+                on_progress(1)
+    return {"data": written, "failed": failed}
+
+# 類似ユーザー検索（match_profiles）で，類似度がこの値以上のユーザーだけを返す
+SIMILARITY_THRESHOLD = 0.6
+# 類似ユーザー検索で返す最大件数
+SIMILAR_USERS_MATCH_COUNT = 10
+# profile_neighborsテーブルで，計算済みであることを示す目印の行（相手が自分自身）のrank
+NEIGHBOR_MARKER_RANK = -1
+
+def find_similar_users(supabase: Client, user_id: str, query_vector: list, match_count: int = SIMILAR_USERS_MATCH_COUNT,
+                       embedding_version: Optional[str] = None):
     """
     指定されたベクトルに類似するユーザーを検索する（自分自身は除外）
 
@@ -75,17 +285,25 @@ def find_similar_users(supabase: Client, user_id: str, query_vector: list):
         supabase: Supabaseクライアントのインスタンス
         user_id: 検索の基となる（そして結果から除外される）ユーザーID
         query_vector: 検索の基準となるベクトルデータ
+        match_count: 取得する類似ユーザーの最大件数
+        embedding_version: 指定した場合は，この版で作られたベクトルを持つユーザーだけを検索する．
+            match_profiles関数に，以下の引数と条件を追加しておく．
+              query_embedding_version text default null
+              ... where query_embedding_version is null or profiles.embedding_version = query_embedding_version
 
     Returns:
         類似ユーザーのデータのリスト
     """
+    params = {
+        'query_embedding': query_vector,
+        'match_threshold': SIMILARITY_THRESHOLD,
+        'match_count': match_count,
+        'profile_id_to_exclude': user_id
+    }
+    if embedding_version is not None:
+        params['query_embedding_version'] = embedding_version
     try:
-        response = supabase.rpc('match_profiles', {
-            'query_embedding': query_vector,
-            'match_threshold': 0.6,
-            'match_count': 10,
-            'profile_id_to_exclude': user_id
-        }).execute()
+        response = supabase.rpc('match_profiles', params).execute()
         if not response.data:
             print("類似ユーザーが見つかりませんでした。")
             return []
@@ -94,28 +312,106 @@ def find_similar_users(supabase: Client, user_id: str, query_vector: list):
         print(f"類似ユーザーの検索中にエラーが発生しました: {e}")
         raise ValueError("類似ユーザーの検索中にエラーが発生しました。") from e
 
-def get_all_profiles(supabase: Client,user_id:Optional[str]=None) -> List[Dict[str, Any]]:
+def get_all_profiles(supabase: Client,user_id:Optional[str]=None,columns:str="*") -> List[Dict[str, Any]]:
     """
     全ユーザーのプロフィールを取得する．
 
     Args:
         supabase: Supabaseクライアントのインスタンス．
         user_id: （なくても実行可能な変数）自身のユーザーID（結果から除外するために使用）．
+        columns: 取得する列（既定では埋め込みを含む全ての列）．一覧の表示にはPROFILE_CARD_COLUMNSを指定する．
 
     Returns:
         ユーザーのプロフィールデータのリスト
     """
     try:
         if user_id:
-            response = supabase.table('profiles').select("*").neq('id', user_id).execute()
+            response = supabase.table('profiles').select(columns).neq('id', user_id).execute()
         else:
-            response = supabase.table('profiles').select("*").execute()
+            response = supabase.table('profiles').select(columns).execute()
         if not response.data:
             return [] #自分以外のユーザが存在しない場合は空リストを返す 
         return response.data
     except Exception as e:
         print(f"全ユーザーの取得中にエラーが発生しました: {e}")
         raise ValueError("全ユーザーの取得中にエラーが発生しました。") from e
+def get_profiles_updated_since(supabase: Client, columns: str, since: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    updated_atがsince以降のプロフィールを，updated_atの順に取得する（sinceがNoneの場合は全てのプロフィール）．
+    メモリ上の索引と差分だけを同期するために使う．profilesテーブルには，更新のたびに変わるupdated_atを用意しておく．
+      alter table profiles add column if not exists updated_at timestamptz not null default now();
+      create or replace function set_updated_at() returns trigger language plpgsql as $$
+        begin new.updated_at = now(); return new; end $$;
+      create trigger profiles_set_updated_at before update on profiles
+        for each row execute function set_updated_at();
+      create index profiles_updated_at_idx on profiles (updated_at);
+
+    Args:
+        supabase: Supabaseクライアントのインスタンス．
+        columns: 取得する列．updated_atを含めること．
+        since: この時刻（ISO 8601形式）以降に更新されたプロフィールだけを取得する．
+
+    Returns:
+        プロフィールデータのリスト
+    """
+    try:
+        query = supabase.table('profiles').select(columns)
+        if since is not None:
+            query = query.gte('updated_at', since)
+        response = query.order('updated_at').execute()
+        return response.data or []
+    except Exception as e:
+        print(f"更新されたプロフィールの取得中にエラーが発生しました: {e}")
+        raise ValueError("更新されたプロフィールの取得中にエラーが発生しました。") from e
+
+def get_profile_ids(supabase: Client) -> List[str]:
+    """
+    全ユーザーのIDだけを取得する（削除されたユーザーを見つけるために使う）．
+    """
+    try:
+        response = supabase.table('profiles').select("id").execute()
+        return [row['id'] for row in response.data or []]
+    except Exception as e:
+        print(f"ユーザーIDの取得中にエラーが発生しました: {e}")
+        raise ValueError("ユーザーIDの取得中にエラーが発生しました。") from e
+
+def get_profiles_page(supabase: Client, user_id: Optional[str] = None, cursor: Optional[Tuple[str, str]] = None,
+                      limit: int = 20, columns: str = PROFILE_CARD_COLUMNS) -> Tuple[List[Dict[str, Any]], Optional[Tuple[str, str]]]:
+    """
+    ユーザーのプロフィールを，新しい順（created_at, id の降順）にlimit件ずつ取得する（キーセット方式のページ分割）．
+    読み飛ばす件数（offset）ではなく前のページの最後の位置から読むため，ページが進んでも1回の取得の負荷は変わらない．
+    (created_at, id) の降順のインデックスを作成しておく．
+      create index profiles_created_at_id_idx on profiles (created_at desc, id desc);
+
+    Args:
+        supabase: Supabaseクライアントのインスタンス．
+        user_id: 自身のユーザーID（結果から除外するために使用）．
+        cursor: 前のページの最後のプロフィールの (created_at, id)．最初のページではNone．
+        limit: 1ページの件数．
+        columns: 取得する列．created_atとidを含めること．
+
+    Returns:
+        (プロフィールのリスト, 次のページのcursor)．次のページがない場合，cursorはNone．
+    """
+    try:
+        query = supabase.table('profiles').select(columns)
+        if user_id:
+            query = query.neq('id', user_id)
+        if cursor is not None:
+            created_at, last_id = cursor
+            query = query.or_(
+                f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{last_id})'
+            )
+        # 次のページがあるかを確かめるため，1件多く取得する
+        response = query.order('created_at', desc=True).order('id', desc=True).limit(limit + 1).execute()
+        rows = response.data or []
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, (rows[-1]['created_at'], rows[-1]['id'])
+    except Exception as e:
+        print(f"ユーザー一覧の取得中にエラーが発生しました: {e}")
+        raise ValueError("ユーザー一覧の取得中にエラーが発生しました。") from e
 def update_profile_embedding(supabase: Client, profile_id: str, embedding: list):
     """
     指定されたユーザーのプロフィールにベクトルデータを更新する．
@@ -136,6 +432,19 @@ def update_profile_embedding(supabase: Client, profile_id: str, embedding: list)
     except Exception as e:
         print(f"プロフィールのベクトル更新中にエラーが発生しました: {e}")
         raise ValueError("プロフィールのベクトル更新中にエラーが発生しました。") from e
+def update_profile_embedding_columns(supabase: Client, profile_id: str, columns: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    指定されたユーザーの埋め込みに関するカラム（embedding, embedding_hash, embedding_compact等）を更新する．
+    埋め込みの次元数や保存形式を変更したときの移行処理で使う．
+    """
+    try:
+        response = supabase.table('profiles').update(columns).eq('id', profile_id).execute()
+        if not response.data:
+            raise ValueError("プロフィールのベクトル更新に失敗しました。")
+        return response.data
+    except Exception as e:
+        print(f"プロフィールのベクトル更新中にエラーが発生しました: {e}")
+        raise ValueError("プロフィールのベクトル更新中にエラーが発生しました。") from e
 def sign_up(supabase:Client,email:str,password:str)->Dict[str,Any]:
     """
     新しいユーザをSupabase Authに登録する．
@@ -298,3 +607,203 @@ def search_profiles(supabase: Client, query: str, current_user_id: Optional[str]
     except Exception as e:
         print(f"プロフィール検索中にエラー: {e}")
         raise ValueError("プロフィールの検索に失敗しました。") from e
+
+def get_conversation_starter(supabase: Client, my_id: str, opponent_id: str) -> Dict[str, Any] | None:
+    """
+    事前計算された会話のきっかけを取得する．存在しない場合はNoneを返す．
+    """
+    try:
+        response = supabase.table('conversation_starters').select("*") \
+            .eq('my_id', my_id) \
+            .eq('opponent_id', opponent_id) \
+            .execute()
+        if response.data:
+            return response.data[0]
+        else:
+            return None
+    except Exception as e:
+        print(f"会話のきっかけの取得中にエラーが発生しました: {e}")
+        raise ValueError("会話のきっかけの取得に失敗しました。") from e
+
+def get_conversation_starter_hashes(supabase: Client) -> List[Dict[str, Any]]:
+    """
+    事前計算済みの全ペアについて，計算時のプロフィールのハッシュを取得する．
+    """
+    try:
+        response = supabase.table('conversation_starters') \
+            .select("my_id, opponent_id, my_profile_hash, opponent_profile_hash") \
+            .execute()
+        return response.data or []
+    except Exception as e:
+        print(f"会話のきっかけの一覧取得中にエラーが発生しました: {e}")
+        raise ValueError("会話のきっかけの一覧取得に失敗しました。") from e
+
+def upsert_conversation_starter(supabase: Client, starter_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    事前計算した会話のきっかけを保存する．同じペアのデータがあれば置き換える．
+    """
+    try:
+        response = supabase.table('conversation_starters') \
+            .upsert([starter_data], on_conflict='my_id,opponent_id') \
+            .execute()
+        if not response.data:
+            raise ValueError("会話のきっかけの保存に失敗しました。")
+        return response.data[0]
+    except Exception as e:
+        print(f"会話のきっかけの保存中にエラーが発生しました: {e}")
+        raise ValueError("会話のきっかけの保存に失敗しました。") from e
+
+def get_embedding_hashes(supabase: Client, profile_ids: List[str],
+                         embedding_column: str = "embedding") -> Dict[str, Optional[str]]:
+    """
+    指定したユーザーについて，保存済みの埋め込みを計算したときのキーワード文書のハッシュを取得する．
+    ハッシュがあっても埋め込み（embedding_columnのカラム）が空のユーザーは，ベクトルを使い回せないため含めない．
+    profilesテーブルには，以下のカラムを追加しておく．
+      alter table profiles add column embedding_hash text;
+
+    Returns:
+        プロフィールIDをキー，ハッシュを値とする辞書（埋め込みが未保存のユーザーは含まない）．
+    """
+    if not profile_ids:
+        return {}
+    try:
+        response = supabase.table('profiles') \
+            .select("id, embedding_hash") \
+            .in_('id', profile_ids) \
+            .not_.is_(embedding_column, 'null') \
+            .execute()
+        return {row['id']: row.get('embedding_hash') for row in response.data or []}
+    except Exception as e:
+        print(f"埋め込みのハッシュの取得中にエラーが発生しました: {e}")
+        raise ValueError("埋め込みのハッシュの取得に失敗しました。") from e
+
+def get_similar_profiles_from_neighbors(supabase: Client, profile_id: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    事前計算した類似ユーザーのテーブル（profile_neighbors）から，類似ユーザーのプロフィールを類似度の高い順に取得する．
+    類似ユーザーのプロフィール（表示用の列と埋め込みの版）も外部キーで結合して取得するため，問い合わせは1回で済む．
+    事前計算されていない場合はNoneを返す．
+    テーブルは，以下のように作成しておく．
+      create table profile_neighbors (
+        profile_id uuid not null references profiles(id) on delete cascade,
+        neighbor_id uuid not null references profiles(id) on delete cascade,
+        rank integer not null,
+        similarity double precision not null,
+        updated_at timestamptz not null default now(),
+        primary key (profile_id, neighbor_id)
+      );
+      create index profile_neighbors_neighbor_id_idx on profile_neighbors (neighbor_id);
+    計算済みのユーザーには，自分自身を相手とする目印の行（rank = NEIGHBOR_MARKER_RANK）を必ず1行保存する．
+    類似ユーザーが1人もいないユーザーも，目印の行があれば空のリストを返す（未計算として毎回検索し直さない）．
+    """
+    try:
+        response = supabase.table('profile_neighbors') \
+            .select(f"neighbor_id, similarity, neighbor:profiles!neighbor_id({PROFILE_DETAIL_COLUMNS}, embedding_version)") \
+            .eq('profile_id', profile_id) \
+            .order('rank') \
+            .execute()
+        if not response.data:
+            return None
+        return [
+            {**row['neighbor'], "similarity": row['similarity']}
+            for row in response.data if row.get('neighbor') and row['neighbor_id'] != profile_id
+        ]
+    except Exception as e:
+        print(f"事前計算した類似ユーザーの取得中にエラーが発生しました: {e}")
+        raise ValueError("事前計算した類似ユーザーの取得に失敗しました。") from e
+
+def get_neighbor_lists(supabase: Client, profile_ids: List[str]) -> Dict[str, List[Tuple[str, float]]]:
+    """
+    指定したユーザーについて，事前計算した類似ユーザーのリスト [(相手のID, 類似度), ...] を取得する．
+    事前計算されていないユーザーは結果に含まれない（類似ユーザーがいないユーザーは空のリストになる）．
+    """
+    if not profile_ids:
+        return {}
+    try:
+        response = supabase.table('profile_neighbors') \
+            .select("profile_id, neighbor_id, similarity") \
+            .in_('profile_id', profile_ids) \
+            .order('rank') \
+            .execute()
+        neighbor_lists: Dict[str, List[Tuple[str, float]]] = {}
+        for row in response.data or []:
+            neighbor_list = neighbor_lists.setdefault(row['profile_id'], [])
+            if row['neighbor_id'] != row['profile_id']:
+                neighbor_list.append((row['neighbor_id'], row['similarity']))
+        return neighbor_lists
+    except Exception as e:
+        print(f"類似ユーザーのリストの取得中にエラーが発生しました: {e}")
+        raise ValueError("類似ユーザーのリストの取得に失敗しました。") from e
+
+def get_profiles_listing_neighbor(supabase: Client, neighbor_id: str) -> List[str]:
+    """
+    指定したユーザーを，事前計算した類似ユーザーのリストに含んでいるユーザーのIDを取得する．
+    """
+    try:
+        response = supabase.table('profile_neighbors') \
+            .select("profile_id") \
+            .eq('neighbor_id', neighbor_id) \
+            .neq('profile_id', neighbor_id) \
+            .execute()
+        return [row['profile_id'] for row in response.data or []]
+    except Exception as e:
+        print(f"類似ユーザーのリストの取得中にエラーが発生しました: {e}")
+        raise ValueError("類似ユーザーのリストの取得に失敗しました。") from e
+
+def replace_neighbor_lists(supabase: Client, neighbor_lists: Dict[str, List[Tuple[str, float]]]) -> None:
+    """
+    指定したユーザーの類似ユーザーのリストを置き換える（古い行を削除してから新しい行を挿入する）．
+    各ユーザーには，計算済みであることを示す目印の行も保存する（get_similar_profiles_from_neighborsを参照）．
+    """
+    if not neighbor_lists:
+        return
+    rows = []
+    for profile_id, neighbors in neighbor_lists.items():
+        rows.append({"profile_id": profile_id, "neighbor_id": profile_id, "rank": NEIGHBOR_MARKER_RANK, "similarity": 0.0})
+        rows.extend(
+            {"profile_id": profile_id, "neighbor_id": neighbor_id, "rank": rank, "similarity": similarity}
+            for rank, (neighbor_id, similarity) in enumerate(neighbors)
+        )
+    try:
+        supabase.table('profile_neighbors').delete().in_('profile_id', list(neighbor_lists)).execute()
+        supabase.table('profile_neighbors').insert(rows).execute()
+    except Exception as e:
+        print(f"類似ユーザーのリストの保存中にエラーが発生しました: {e}")
+        raise ValueError("類似ユーザーのリストの保存に失敗しました。") from e
+
+def _stale_embedding_filter(embedding_version: str) -> str:
+    return f'embedding_version.is.null,embedding_version.neq."{embedding_version}"'
+
+def count_stale_embedding_profiles(supabase: Client, embedding_version: str) -> int:
+    """
+    埋め込みの版（embedding_version）が指定した版と異なる（未記録を含む）ユーザーの数を返す．
+    profilesテーブルには，以下のカラムを追加しておく．
+      alter table profiles add column embedding_version text;
+    """
+    try:
+        response = supabase.table('profiles') \
+            .select("id", count="exact") \
+            .or_(_stale_embedding_filter(embedding_version)) \
+            .limit(1) \
+            .execute()
+        return response.count or 0
+    except Exception as e:
+        print(f"再計算が必要なユーザー数の取得中にエラーが発生しました: {e}")
+        raise ValueError("再計算が必要なユーザー数の取得に失敗しました。") from e
+
+def get_stale_embedding_profiles(supabase: Client, embedding_version: str, columns: str,
+                                 after_id: Optional[str] = None, limit: int = 500) -> List[Dict[str, Any]]:
+    """
+    埋め込みの版が指定した版と異なる（未記録を含む）ユーザーを，IDの順にafter_idの次からlimit件取得する．
+    最後に取得したIDをafter_idに渡して呼び出しを繰り返すと，全件を一定の件数ずつ読み進められる．
+    """
+    try:
+        query = supabase.table('profiles') \
+            .select(columns) \
+            .or_(_stale_embedding_filter(embedding_version))
+        if after_id is not None:
+            query = query.gt('id', after_id)
+        response = query.order('id').limit(limit).execute()
+        return response.data or []
+    except Exception as e:
+        print(f"再計算が必要なユーザーの取得中にエラーが発生しました: {e}")
+        raise ValueError("再計算が必要なユーザーの取得に失敗しました。") from e
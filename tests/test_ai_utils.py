@@ -0,0 +1,84 @@
+# tests/test_ai_utils.py
+import ai_utils
+
+def test_classify_animal_type_uses_cache_for_same_input(mocker):
+    """
+    同じユーザー入力で2回分類した場合，Gemini APIは1回しか呼ばれないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    ai_utils.ai_result_cache.clear()
+    mocker.patch('ai_utils.LOCAL_ANIMAL_CLASSIFIER_ENABLED', False)
+    mock_backend = mocker.patch('ai_utils.ai_clients.get_backend').return_value
+    mock_backend.generate.return_value = {
+        "text": '{"animal_name": "ネコ", "animal_category": "自由人・マイペースタイプ", "animal_reason": "マイペース"}',
+        "input_tokens": 0,
+        "output_tokens": 0,
+    }
+    user_input = {"nickname": "さき", "hobbies": ["カフェ巡り"], "hometown": "福岡県"}
+
+    # 2. 実行 (Act)
+    first = ai_utils.classify_animal_type(user_input)
+    # プロンプトで使わない項目が変わってもキャッシュにヒットする
+    second = ai_utils.classify_animal_type({**user_input, "id": "user-123"})
+
+    # 3. 検証 (Assert)
+    assert first == second
+    mock_backend.generate.assert_called_once()
+    ai_utils.ai_result_cache.clear()
+
+def test_stream_conversation_starters_yields_items_as_they_complete(mocker):
+    """
+    ストリーミング受信で，各要素が閉じ引用符まで届いた時点で順に返されるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    chunks = [
+        '```json\n{"common_points": ["福岡',
+        '県出身", "映画鑑賞"], "topics": ["カフェについて',
+        '聞いてみましょう。"]}\n```',
+    ]
+    mock_backend = mocker.patch('ai_utils.ai_clients.get_backend').return_value
+    mock_backend.generate_stream.return_value = iter(chunks)
+
+    # 2. 実行 (Act)
+    stream = ai_utils.stream_conversation_starters({"nickname": "さき"}, {"nickname": "りも"})
+    first = next(stream)
+    rest = list(stream)
+
+    # 3. 検証 (Assert)
+    # 1つ目のチャンクを受信した時点では，まだ要素が完成していない
+    assert first == ("common_points", "福岡県出身")
+    assert rest == [
+        ("common_points", "映画鑑賞"),
+        ("topics", "カフェについて聞いてみましょう。"),
+    ]
+
+def test_prompt_contains_only_used_fields_and_records_token_usage(mocker):
+    """
+    プロンプトには使う項目だけが入り，呼び出しごとのトークン数が関数別に記録されるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    ai_utils.ai_result_cache.clear()
+    ai_utils.reset_usage_stats()
+    mocker.patch('ai_utils.LOCAL_ANIMAL_CLASSIFIER_ENABLED', False)
+    mock_backend = mocker.patch('ai_utils.ai_clients.get_backend').return_value
+    mock_backend.generate.return_value = {
+        "text": '{"animal_name": "ネコ", "animal_category": "自由人・マイペースタイプ", "animal_reason": "マイペース"}',
+        "input_tokens": 42,
+        "output_tokens": 17,
+    }
+
+    # 2. 実行 (Act)
+    ai_utils.classify_animal_type({
+        "id": "user-123", "last_name": "山田", "nickname": "さき",
+        "hobbies": ["カフェ巡り", "映画鑑賞"], "hometown": "福岡県", "happy_topic": ""
+    })
+    stats = ai_utils.get_usage_stats()
+    ai_utils.ai_result_cache.clear()
+
+    # 3. 検証 (Assert)
+    prompt = mock_backend.generate.call_args.args[1]
+    assert prompt == "ユーザー情報:\n出身地:福岡県\n趣味:カフェ巡り、映画鑑賞"
+    assert mock_backend.generate.call_args.kwargs["system_instruction"] == ai_utils.ANIMAL_SYSTEM_INSTRUCTION
+    assert stats["classify_animal_type"]["calls"] == 1
+    assert stats["classify_animal_type"]["input_tokens"] == 42
+    assert stats["classify_animal_type"]["output_tokens"] == 17
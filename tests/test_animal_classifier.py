@@ -0,0 +1,74 @@
+# tests/test_animal_classifier.py
+import pytest
+import ai_utils
+import animal_classifier
+from llm_backends import LocalStubBackend
+
+@pytest.fixture
+def local_backend(mocker, tmp_path):
+    """埋め込みをローカルスタブで計算し，テストごとに重心をファイルに保存し直す（デプロイの手順と同じ）"""
+    mocker.patch('embedding_generator.ai_clients.get_backend', return_value=LocalStubBackend())
+    mocker.patch('animal_classifier._centroids', None)
+    mocker.patch('animal_classifier._centroids_checked', False)
+    centroids_path = tmp_path / "animal_centroids.json"
+    animal_classifier.save_centroids(centroids_path)
+    mocker.patch('animal_classifier.CENTROIDS_PATH', centroids_path)
+
+def test_animal_prototypes_match_ai_utils_candidates():
+    """
+    ローカル分類器の動物とカテゴリが，AIによる分類の候補と一致しているかのテスト
+    """
+    assert set(animal_classifier.ANIMAL_PROTOTYPES) == set(ai_utils.ANIMAL_CANDIDATES)
+    assert {p["category"] for p in animal_classifier.ANIMAL_PROTOTYPES.values()} == set(ai_utils.ANIMAL_CATEGORIES)
+
+def test_classify_picks_closest_animal_without_llm(local_backend):
+    """
+    キーワードが特定の動物に近い場合，ローカルで分類され理由も組み立てられるかのテスト
+    """
+    result = animal_classifier.classify({
+        "hobbies": ["プログラミング", "謎解き"], "expert_topic": "パズル", "happy_topic": "ミステリー"
+    })
+
+    assert result["animal_name"] == "カラス"
+    assert result["animal_category"] == "頭脳派・ミステリアスタイプ"
+    assert "プログラミング" in result["animal_reason"]
+
+def test_classify_animal_type_falls_back_to_llm_when_not_confident(local_backend, mocker):
+    """
+    ローカル分類器に自信がない場合は，AIによる分類に切り替わるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    ai_utils.ai_result_cache.clear()
+    mocker.patch('ai_utils.LOCAL_ANIMAL_CLASSIFIER_ENABLED', True)
+    mocker.patch('animal_classifier.MIN_CONFIDENCE_MARGIN', 1.0)
+    mock_generate = mocker.patch.object(LocalStubBackend, 'generate', return_value={
+        "text": '{"animal_name": "ネコ", "animal_category": "自由人・マイペースタイプ", "animal_reason": "AIの理由"}',
+        "input_tokens": 0, "output_tokens": 0,
+    })
+
+    # 2. 実行 (Act)
+    result = ai_utils.classify_animal_type({"hobbies": ["プログラミング"], "nickname": "りも"})
+    ai_utils.ai_result_cache.clear()
+
+    # 3. 検証 (Assert)
+    mock_generate.assert_called_once()
+    assert result["animal_reason"] == "AIの理由"
+
+def test_classify_returns_none_without_embedding_when_centroids_missing(mocker):
+    """
+    保存済みの重心がない場合，その場で重心を計算せずにNoneを返す（AIによる分類に切り替わる）かのテスト
+    """
+    # 1. 準備 (Arrange)
+    mocker.patch('animal_classifier._centroids', None)
+    mocker.patch('animal_classifier._centroids_checked', False)
+    mocker.patch('animal_classifier.CENTROIDS_PATH', "does-not-exist.json")
+    mock_embed = mocker.patch.object(LocalStubBackend, 'embed')
+    mocker.patch('embedding_generator.ai_clients.get_backend', return_value=LocalStubBackend())
+
+    # 2. 実行 (Act)
+    first = animal_classifier.classify({"hobbies": ["プログラミング"]})
+    second = animal_classifier.classify({"hobbies": ["謎解き"]})
+
+    # 3. 検証 (Assert)
+    assert first is None and second is None
+    mock_embed.assert_not_called()
@@ -0,0 +1,64 @@
+# tests/test_cache_utils.py
+from cache_utils import TTLCache, SQLiteCache, TieredCache, SingleFlight, make_cache_key
+
+def test_make_cache_key_ignores_dict_order():
+    """
+    辞書のキー順が異なっても，同じ内容なら同じキーになるかのテスト
+    """
+    assert make_cache_key("task", {"a": 1, "b": [1, 2]}) == make_cache_key("task", {"b": [1, 2], "a": 1})
+    assert make_cache_key("task", {"a": 1}) != make_cache_key("task", {"a": 2})
+
+def test_ttl_cache_evicts_least_recently_used_and_expired(mocker):
+    """
+    上限を超えたら最も古く使われた値が追い出され，期限切れの値は返されないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_time = mocker.patch('cache_utils.time')
+    mock_time.monotonic.return_value = 100.0
+    cache = TTLCache(maxsize=2, ttl=10)
+
+    # 2. 実行 (Act)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")      # aを最近使ったことにする
+    cache.set("c", 3)   # bが追い出される
+
+    # 3. 検証 (Assert)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    mock_time.monotonic.return_value = 111.0
+    assert cache.get("c") is None
+    assert cache.stats()["evictions"] == 1
+
+def test_tiered_cache_survives_restart_with_sqlite(tmp_path):
+    """
+    SQLiteの2段目に保存した値が，メモリ上のキャッシュを作り直した後も読めるかのテスト
+    """
+    db_path = str(tmp_path / "cache.sqlite3")
+    first = TieredCache(TTLCache(), SQLiteCache(db_path))
+    first.set("key", {"animal_name": "ネコ"})
+
+    # 再起動を想定して，新しいインスタンスから読み込む
+    second = TieredCache(TTLCache(), SQLiteCache(db_path))
+    assert second.get("key") == {"animal_name": "ネコ"}
+    assert second.memory.get("key") == {"animal_name": "ネコ"}
+
+def test_single_flight_shares_result_and_error_of_in_flight_call():
+    """
+    実行中の処理に合流した呼び出しが結果（または例外）を共有し，処理が終われば再び実行されるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    single_flight = SingleFlight()
+    future, is_leader = single_flight.join("key")
+
+    # 2. 実行 (Act)
+    follower, follower_is_leader = single_flight.join("key")
+    single_flight.finish("key", future, {"value": 1})
+    _, next_is_leader = single_flight.join("key")
+
+    # 3. 検証 (Assert)
+    assert is_leader and not follower_is_leader
+    assert follower is future
+    assert follower.result() == {"value": 1}
+    assert next_is_leader
+    assert single_flight.stats() == {"executed": 2, "shared": 1, "in_flight": 1}
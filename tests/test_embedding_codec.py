@@ -0,0 +1,48 @@
+# tests/test_embedding_codec.py
+import numpy as np
+import embedding_codec
+import embedding_generator
+from llm_backends import LocalStubBackend
+
+def test_encode_decode_embedding_round_trip():
+    """
+    float16・int8で保存した埋め込みを戻したとき，元のベクトルとほぼ同じ向きになるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    vector = embedding_codec.l2_normalize(np.random.default_rng(0).normal(size=768))
+
+    # 2. 実行 (Act)
+    restored = {
+        compact_format: embedding_codec.decode_embedding(embedding_codec.encode_embedding(vector.tolist(), compact_format))
+        for compact_format in embedding_codec.COMPACT_FORMATS
+    }
+
+    # 3. 検証 (Assert)
+    assert float(restored["float16"] @ vector) > 0.9999
+    assert float(embedding_codec.l2_normalize(restored["int8"]) @ vector) > 0.999
+    # pgvectorが返す文字列形式も読み込める
+    assert np.allclose(embedding_codec.decode_embedding("[0.5,-0.25]"), [0.5, -0.25])
+    assert embedding_codec.decode_embedding(None) is None
+
+def test_reduced_dimension_embedding_is_renormalized(mocker):
+    """
+    次元数を指定した場合，その次元数のL2ノルムが1のベクトルが返され，保存形式も一緒に作られるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mocker.patch('embedding_generator.ai_clients.get_backend', return_value=LocalStubBackend())
+    mocker.patch('embedding_generator.EMBEDDING_DIMENSIONS', 256)
+    mocker.patch('embedding_generator.EMBEDDING_COMPACT_FORMAT', "int8")
+    embedding_generator._document_embedding_cache.clear()
+    profile = {"hobbies": ["カフェ巡り", "映画鑑賞"], "hometown": "福岡県"}
+
+    # 2. 実行 (Act)
+    embedding = embedding_generator.generate_embedding_text(profile)
+    columns = embedding_generator.embedding_columns(embedding, embedding_generator.embedding_hash(profile))
+    embedding_generator._document_embedding_cache.clear()
+
+    # 3. 検証 (Assert)
+    assert len(embedding) == 256
+    assert abs(float(np.linalg.norm(embedding)) - 1.0) < 1e-6
+    assert columns["embedding_compact"].startswith("int8:")
+    # コンパクトな形式を使う場合は，単精度のベクトルは保存しない
+    assert columns["embedding"] is None
@@ -0,0 +1,95 @@
+# tests/test_gemini_scheduler.py
+import threading
+import time
+import pytest
+from google.api_core import exceptions as google_exceptions
+from gemini_scheduler import GeminiScheduler, INTERACTIVE, BATCH
+
+def _wait_for_queue_depth(scheduler, depth):
+    for _ in range(200):
+        if scheduler.metrics()["queue_depth"] == depth:
+            return
+        time.sleep(0.005)
+    raise AssertionError("待ち行列が想定の長さになりませんでした")
+
+def test_interactive_calls_overtake_queued_batch_calls():
+    """
+    トークンが足りないとき，後から並んだ対話的な呼び出しがバッチの呼び出しより先に通るかのテスト
+    """
+    # 1. 準備 (Arrange)
+    # 0.3秒に1回だけ呼び出せるスケジューラで，最初のトークンを使い切っておく
+    scheduler = GeminiScheduler("test", requests_per_minute=200, burst=1)
+    scheduler.call(lambda: None)
+    order = []
+
+    # 2. 実行 (Act)
+    batch_thread = threading.Thread(target=scheduler.call, args=(order.append, "batch"), kwargs={"priority": BATCH})
+    batch_thread.start()
+    _wait_for_queue_depth(scheduler, 1)
+    interactive_thread = threading.Thread(target=scheduler.call, args=(order.append, "interactive"), kwargs={"priority": INTERACTIVE})
+    interactive_thread.start()
+    batch_thread.join(timeout=5)
+    interactive_thread.join(timeout=5)
+
+    # 3. 検証 (Assert)
+    assert order == ["interactive", "batch"]
+    assert scheduler.metrics()["priorities"]["batch"]["calls"] == 1
+
+def test_call_retries_rate_limit_errors_with_backoff(mocker):
+    """
+    429エラーは指数バックオフで再試行され，それ以外のエラーは即座に送出されるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_sleep = mocker.patch('gemini_scheduler.time.sleep')
+    scheduler = GeminiScheduler("test", requests_per_minute=6000, burst=10, base_delay=1.0)
+    responses = [google_exceptions.ResourceExhausted("quota"), google_exceptions.ResourceExhausted("quota"), "ok"]
+
+    def flaky():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    # 2. 実行 (Act)
+    result = scheduler.call(flaky)
+
+    # 3. 検証 (Assert)
+    assert result == "ok"
+    assert mock_sleep.call_count == 2
+    # 2回目の待ち時間は1回目より長い範囲から選ばれる
+    first_delay, second_delay = (call.args[0] for call in mock_sleep.call_args_list)
+    assert 0.5 <= first_delay <= 1.0 and 1.0 <= second_delay <= 2.0
+    assert scheduler.metrics()["retries"] == 2
+
+    def bad_request():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.call(bad_request)
+    assert mock_sleep.call_count == 2
+
+def test_interrupted_waiter_leaves_queue():
+    """
+    待っている間に中断された呼び出しが待ち行列から外れ，後の呼び出しを塞がないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    scheduler = GeminiScheduler("test", requests_per_minute=6000, burst=1)
+    scheduler.call(lambda: None)
+    original_wait = scheduler._condition.wait
+
+    def interrupted_wait(timeout=None):
+        raise KeyboardInterrupt
+
+    # 2. 実行 (Act)
+    scheduler._condition.wait = interrupted_wait
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.call(lambda: None)
+    scheduler._condition.wait = original_wait
+    result = scheduler.call(lambda: "ok")
+
+    # 3. 検証 (Assert)
+    assert result == "ok"
+    assert scheduler.metrics()["queue_depth"] == 0
+    # 呼び出し頻度が0の場合は，待ち時間を計算できないため作成時にエラーにする
+    with pytest.raises(ValueError):
+        GeminiScheduler("test", requests_per_minute=0, burst=1)
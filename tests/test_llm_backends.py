@@ -0,0 +1,90 @@
+# tests/test_llm_backends.py
+import json
+import pytest
+from unittest.mock import MagicMock
+import ai_clients
+import ai_utils
+from llm_backends import LLMBackend, LocalStubBackend
+from profile_manager import ProfileManager
+
+def test_local_stub_backend_is_deterministic():
+    """
+    ローカルスタブが，同じ入力に同じ応答・同じ埋め込みを返すかのテスト
+    """
+    backend = LocalStubBackend(embedding_dimensions=64)
+
+    first = backend.generate("gemini-2.5-flash", '出力形式は必ずJSONで: {"animal_name": "..."}')
+    second = backend.generate("gemini-2.5-flash", '出力形式は必ずJSONで: {"animal_name": "..."}')
+    vectors = backend.embed("gemini-embedding-001", ["カフェ巡り 映画鑑賞", "カフェ巡り 映画鑑賞", "登山"], "RETRIEVAL_DOCUMENT")
+
+    assert first == second
+    assert "animal_name" in json.loads(first["text"])
+    assert vectors[0] == vectors[1]
+    assert len(vectors[2]) == 64
+    assert abs(sum(value * value for value in vectors[0]) - 1.0) < 1e-9
+
+def test_incomplete_backend_fails_when_created():
+    """
+    一部のメソッドしか実装していないバックエンドは，呼び出したときではなく作成したときにTypeErrorになるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    class GenerateOnlyBackend(LLMBackend):
+        def generate(self, model_name, prompt, response_schema=None, system_instruction=None):
+            return {"text": "", "input_tokens": 0, "output_tokens": 0}
+
+    # 2. 実行 (Act) & 3. 検証 (Assert)
+    with pytest.raises(TypeError):
+        GenerateOnlyBackend()
+
+def test_profile_manager_runs_offline_with_local_stub(mocker):
+    """
+    ローカルスタブに差し替えると，Gemini APIを呼ばずにプロフィールを作成できるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    ai_utils.ai_result_cache.clear()
+    original_backend = ai_clients._backend
+    ai_clients.set_backend(LocalStubBackend())
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+    mock_supabase_utils.add_new_profile.side_effect = lambda client, data: [data]
+    manager = ProfileManager(MagicMock())
+
+    try:
+        # 2. 実行 (Act)
+        result = manager.create_profile({
+            "id": "user-123", "last_name": "山田", "first_name": "さき", "nickname": "さき",
+            "birth_date": "2002-08-10", "university": "福岡大学", "hometown": "福岡県",
+            "hobbies": ["カフェ巡り"], "happy_topic": "映画", "expert_topic": "コーヒー"
+        })
+    finally:
+        ai_clients.set_backend(original_backend)
+        ai_utils.ai_result_cache.clear()
+
+    # 3. 検証 (Assert)
+    assert result["catchphrase"].startswith("【")
+    assert result["animal_name"]
+    assert len(result["embedding"]) == 768
+
+def test_generate_embeddings_batch_chunks_and_preserves_order(mocker):
+    """
+    バッチ埋め込みが上限件数ずつに分けて送られ，結果が入力と同じ順序で返されるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import embedding_generator
+    backend = LocalStubBackend(embedding_dimensions=16)
+    mocker.patch('embedding_generator.ai_clients.get_backend', return_value=backend)
+    mocker.patch('embedding_generator.EMBEDDING_BATCH_SIZE', 2)
+    embed_spy = mocker.spy(backend, 'embed')
+    embedding_generator._document_embedding_cache.clear()
+    profiles = [{"hobbies": [f"趣味{index}"]} for index in range(5)]
+    profiles.insert(2, {"hobbies": []})
+
+    # 2. 実行 (Act)
+    embeddings = embedding_generator.generate_embeddings_batch(profiles)
+
+    # 3. 検証 (Assert)
+    # キーワードのある5件が，2件ずつ3回に分けて送られる
+    assert embed_spy.call_count == 3
+    assert embeddings[2] == []
+    assert [embedding for embedding in embeddings if embedding] == [
+        embedding_generator.generate_embedding_text(profile) for profile in profiles if profile["hobbies"]
+    ]
@@ -1,8 +1,18 @@
 # tests/test_profile_manager.py
 import pytest
 from unittest.mock import MagicMock
+import profile_manager
 from profile_manager import ProfileManager
 
+@pytest.fixture(autouse=True)
+def clear_profile_cache():
+    """
+    プロフィールのキャッシュは全プロセスで共有されるため，テストごとに空にする
+    """
+    profile_manager._profile_cache.clear()
+    yield
+    profile_manager._profile_cache.clear()
+
 def test_get_profile_by_id_success(mocker):
     """
     正常にプロフィールが取得できる場合のテスト
@@ -44,4 +54,524 @@ def test_get_profile_by_id_not_found(mocker):
     # 2. 実行 & 3. 検証 (Act & Assert)
     # manager.get_profile_by_idを呼び出すとValueErrorが発生することを期待
     with pytest.raises(ValueError, match="見つかりませんでした"):
-        manager.get_profile_by_id("user-unknown")
\ No newline at end of file
+        manager.get_profile_by_id("user-unknown")
+
+def test_create_profile_runs_ai_calls_concurrently(mocker):
+    """
+    自己紹介文の生成と動物分類が並列に実行され，結果が統合されて保存されるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import threading
+    # 両方の呼び出しが同時に実行中でなければ通過できないバリア
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fake_intro(profile_data):
+        barrier.wait()
+        return {"catchphrase": "【テスト】", "introduction_text": "こんにちは", "tags": ["#テスト"]}
+
+    def fake_animal(profile_data):
+        barrier.wait()
+        return {"animal_name": "ネコ", "animal_category": "自由人・マイペースタイプ", "animal_reason": "マイペースだから"}
+
+    mock_ai_utils = mocker.patch('profile_manager.ai_utils')
+    mock_ai_utils.generate_introduction_text.side_effect = fake_intro
+    mock_ai_utils.classify_animal_type.side_effect = fake_animal
+    mocker.patch('profile_manager.embedding_generator.generate_embedding_text', return_value=[0.1, 0.2])
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+    mock_supabase_utils.add_new_profile.side_effect = lambda client, data: [data]
+
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 (Act)
+    result = manager.create_profile({"id": "user-123", "nickname": "さき", "hobbies": ["カフェ巡り"]})
+
+    # 3. 検証 (Assert)
+    assert result["catchphrase"] == "【テスト】"
+    assert result["animal_name"] == "ネコ"
+    assert result["embedding"] == [0.1, 0.2]
+
+
+def test_update_user_input_reports_all_ai_errors(mocker):
+    """
+    AI呼び出しが失敗した場合に，エラー内容がまとめて報告されるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_ai_utils = mocker.patch('profile_manager.ai_utils')
+    mock_ai_utils.generate_introduction_text.side_effect = RuntimeError("intro down")
+    mock_ai_utils.classify_animal_type.side_effect = RuntimeError("animal down")
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 & 3. 検証 (Act & Assert)
+    with pytest.raises(ValueError) as exc_info:
+        manager.update_user_input("user-123", {"nickname": "さき"})
+    cause_message = str(exc_info.value.__cause__)
+    assert "intro down" in cause_message
+    assert "animal down" in cause_message
+    mock_supabase_utils.replace_profile.assert_not_called()
+
+
+def test_create_profile_with_combined_generation(mocker):
+    """
+    一括生成モードでは，AI呼び出しが1回にまとめられるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_ai_utils = mocker.patch('profile_manager.ai_utils')
+    mock_ai_utils.generate_full_profile.return_value = {
+        "catchphrase": "【テスト】", "introduction_text": "こんにちは", "tags": ["#テスト"],
+        "animal_name": "ネコ", "animal_category": "自由人・マイペースタイプ", "animal_reason": "マイペースだから"
+    }
+    mocker.patch('profile_manager.embedding_generator.generate_embedding_text', return_value=[0.1, 0.2])
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+    mock_supabase_utils.add_new_profile.side_effect = lambda client, data: [data]
+
+    manager = ProfileManager(MagicMock(), combined_generation=True)
+
+    # 2. 実行 (Act)
+    result = manager.create_profile({"id": "user-123", "nickname": "さき"})
+
+    # 3. 検証 (Assert)
+    mock_ai_utils.generate_full_profile.assert_called_once()
+    mock_ai_utils.generate_introduction_text.assert_not_called()
+    mock_ai_utils.classify_animal_type.assert_not_called()
+    assert result["animal_name"] == "ネコ"
+    assert result["catchphrase"] == "【テスト】"
+
+
+def test_conversation_starters_cached_until_profile_updated(mocker):
+    """
+    会話のきっかけが同じ組み合わせではキャッシュから返され，
+    プロフィールの更新後には再生成されるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import profile_manager
+    profile_manager._conversation_cache.clear()
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+    mock_supabase_utils.get_profile_by_id.side_effect = lambda client, profile_id: {"id": profile_id, "nickname": profile_id}
+    mock_supabase_utils.get_profiles_by_ids.side_effect = lambda client, ids, columns: [{"id": i, "nickname": i} for i in ids]
+    mock_supabase_utils.replace_profile.side_effect = lambda client, data: [data]
+    mock_ai_utils = mocker.patch('profile_manager.ai_utils')
+    mock_ai_utils.create_conversation_starters.return_value = {"common_points": ["福岡県出身"], "topics": []}
+    mocker.patch('profile_manager.embedding_generator')
+
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 (Act)
+    first = manager.generate_conversation_starters("user-a", "user-b")
+    second = manager.generate_conversation_starters("user-a", "user-b")
+    manager.update_generated_profile("user-b", {"catchphrase": "【更新】"})
+    manager.generate_conversation_starters("user-a", "user-b")
+
+    # 3. 検証 (Assert)
+    assert first == second
+    assert mock_ai_utils.create_conversation_starters.call_count == 2
+
+
+def test_conversation_starters_prefers_precomputed_result(mocker):
+    """
+    事前計算済みの会話のきっかけがあり，プロフィールが変わっていなければAIを呼ばないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import profile_manager
+    import ai_utils
+    profile_manager._conversation_cache.clear()
+    profiles = {
+        "user-a": {"id": "user-a", "nickname": "さき", "hobbies": ["映画鑑賞"]},
+        "user-b": {"id": "user-b", "nickname": "りも", "hobbies": ["音楽フェス"]},
+    }
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+    mock_supabase_utils.get_profiles_by_ids.side_effect = lambda client, ids, columns: [profiles[i] for i in ids]
+    mock_supabase_utils.get_conversation_starter.return_value = {
+        "my_profile_hash": ai_utils.conversation_profile_hash(profiles["user-a"]),
+        "opponent_profile_hash": ai_utils.conversation_profile_hash(profiles["user-b"]),
+        "common_points": ["エンタメ好き"],
+        "topics": ["最近観た映画について聞いてみましょう。"],
+    }
+    mock_create = mocker.patch('profile_manager.ai_utils.create_conversation_starters')
+
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 (Act)
+    result = manager.generate_conversation_starters("user-a", "user-b")
+
+    # 3. 検証 (Assert)
+    assert result["common_points"] == ["エンタメ好き"]
+    mock_create.assert_not_called()
+
+def test_concurrent_get_profile_by_id_shares_one_db_request(mocker):
+    """
+    同じプロフィールの取得が同時に要求された場合，DBへの問い合わせが1回にまとめられるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    release = threading.Event()
+
+    def slow_get_profile_by_id(client, profile_id):
+        release.wait(timeout=5)
+        return {"id": profile_id, "nickname": "さき"}
+
+    import time
+    import profile_manager
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+    mock_supabase_utils.get_profile_by_id.side_effect = slow_get_profile_by_id
+    manager = ProfileManager(MagicMock())
+    shared_before = profile_manager._single_flight.stats()["shared"]
+
+    # 2. 実行 (Act)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(manager.get_profile_by_id, "user-qr") for _ in range(8)]
+        # 残り7件の要求が実行中の問い合わせに合流するまで待ってから，応答を返す
+        deadline = time.monotonic() + 5
+        while profile_manager._single_flight.stats()["shared"] - shared_before < 7 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result(timeout=5) for future in futures]
+
+    # 3. 検証 (Assert)
+    assert mock_supabase_utils.get_profile_by_id.call_count == 1
+    assert all(result == {"id": "user-qr", "nickname": "さき"} for result in results)
+    # 結果は呼び出しごとに別のオブジェクトなので，変更しても他の呼び出しに波及しない
+    assert len({id(result) for result in results}) == 8
+
+def test_update_generated_profile_reuses_embedding_when_keywords_unchanged(mocker):
+    """
+    キャッチコピーのみの編集ではベクトルを再計算せず，保存するデータにもベクトルを含めないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import embedding_generator
+    stored_profile = {
+        "id": "user-123", "hobbies": ["カフェ巡り"], "tags": ["#カフェ部"], "catchphrase": "【旧】",
+        "embedding": [0.1, 0.2],
+    }
+    stored_profile["embedding_hash"] = embedding_generator.embedding_hash(stored_profile)
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+    mock_supabase_utils.get_profile_by_id.return_value = dict(stored_profile)
+    mock_supabase_utils.replace_profile.side_effect = lambda client, data: [data]
+    mock_embed = mocker.patch('profile_manager.embedding_generator.generate_embedding_text')
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 (Act)
+    catchphrase_only = manager.update_generated_profile("user-123", {"catchphrase": "【新】"})
+    tags_changed = manager.update_generated_profile("user-123", {"tags": ["#映画好き"]})
+
+    # 3. 検証 (Assert)
+    assert catchphrase_only["catchphrase"] == "【新】"
+    assert "embedding" not in catchphrase_only
+    # タグが変わった場合だけ，ベクトルとハッシュを計算し直して保存する
+    mock_embed.assert_called_once()
+    assert tags_changed["embedding"] == mock_embed.return_value
+    assert tags_changed["embedding_hash"] != stored_profile["embedding_hash"]
+
+def test_find_similar_profiles_uses_in_process_index(mocker):
+    """
+    索引が有効な場合，DBに問い合わせずに類似ユーザーを返し，書き込みが索引に反映されるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import profile_manager
+    import vector_index
+    mocker.patch('profile_manager.VECTOR_INDEX_ENABLED', True)
+    mocker.patch('profile_manager._vector_index_loaded_at', None)
+    mocker.patch('profile_manager._vector_index', vector_index.VectorIndex())
+    version = profile_manager.embedding_generator.EMBEDDING_VERSION
+    mock_get_all = mocker.patch('profile_manager.supabase_utils.get_profiles_updated_since', return_value=[
+        {"id": "me", "nickname": "自分", "embedding": "[1.0,0.0]", "embedding_version": version},
+        {"id": "near", "nickname": "近い人", "embedding": "[0.9,0.1]", "embedding_version": version},
+        {"id": "far", "nickname": "遠い人", "embedding": "[0.0,1.0]", "embedding_version": version},
+        {"id": "stale", "nickname": "古い版の人", "embedding": "[1.0,0.0]", "embedding_version": None},
+    ])
+    mock_rpc = mocker.patch('profile_manager.supabase_utils.find_similar_users')
+    mocker.patch('profile_manager.supabase_utils.replace_profile', side_effect=lambda client, data: [data])
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 (Act)
+    before = manager.find_similar_profiles("me")
+    # 遠い人のタグが更新され，自分に近いベクトルになる
+    mocker.patch('profile_manager.supabase_utils.get_profile_by_id',
+                 return_value={"id": "far", "nickname": "遠い人", "embedding": "[0.0,1.0]"})
+    mocker.patch('profile_manager.embedding_generator.generate_embedding_text', return_value=[1.0, 0.05])
+    manager.update_generated_profile("far", {"tags": ["#カフェ部"]})
+    after = manager.find_similar_profiles("me")
+
+    # 3. 検証 (Assert)
+    mock_get_all.assert_called_once()
+    mock_rpc.assert_not_called()
+    assert [profile["id"] for profile in before] == ["near"]
+    assert "embedding" not in before[0]
+    assert [profile["id"] for profile in after] == ["far", "near"]
+
+def test_find_similar_profiles_never_mixes_embedding_versions(mocker):
+    """
+    自分のベクトルが古い版の場合，現在の版で作り直したベクトルで，現在の版のユーザーだけを検索するかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import profile_manager
+    mocker.patch('profile_manager.VECTOR_INDEX_ENABLED', False)
+    mocker.patch('profile_manager.PROFILE_NEIGHBORS_ENABLED', False)
+    mocker.patch('profile_manager.supabase_utils.get_profile_by_id', return_value={
+        "id": "me", "hobbies": ["登山"], "embedding": [0.5, 0.5], "embedding_version": "old-model/default/keywords-v0"
+    })
+    mock_embed = mocker.patch('profile_manager.embedding_generator.generate_embedding_text', return_value=[1.0, 0.0])
+    mock_rpc = mocker.patch('profile_manager.supabase_utils.find_similar_users', return_value=[{"id": "near"}])
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 (Act)
+    result = manager.find_similar_profiles("me")
+
+    # 3. 検証 (Assert)
+    mock_embed.assert_called_once()
+    assert mock_rpc.call_args.kwargs["query_vector"] == [1.0, 0.0]
+    assert mock_rpc.call_args.kwargs["embedding_version"] == profile_manager.embedding_generator.EMBEDDING_VERSION
+    assert result == [{"id": "near"}]
+
+def test_profile_list_never_selects_embeddings_and_detail_strips_them():
+    """
+    一覧はカードの列だけを取得し，詳細はプロフィールのキャッシュから埋め込みの列を除いて返すかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_db_client = MagicMock()
+    query = mock_db_client.table.return_value.select.return_value
+    query.neq.return_value.execute.return_value.data = [{"id": "other", "nickname": "相手"}]
+    query.eq.return_value.execute.return_value.data = [{
+        "id": "other", "nickname": "相手", "introduction_text": "こんにちは",
+        "embedding": [0.1, 0.2], "embedding_hash": "hash", "embedding_version": "version",
+    }]
+    manager = ProfileManager(mock_db_client)
+
+    # 2. 実行 (Act)
+    profiles = manager.get_all_profiles("me")
+    list_columns = mock_db_client.table.return_value.select.call_args.args[0]
+    detail = manager.get_profile_detail("other")
+    full_profile = manager.get_profile_by_id("other")
+
+    # 3. 検証 (Assert)
+    assert profiles == [{"id": "other", "nickname": "相手"}]
+    assert "nickname" in list_columns and "introduction_text" not in list_columns
+    assert "embedding" not in list_columns
+    assert detail == {"id": "other", "nickname": "相手", "introduction_text": "こんにちは"}
+    # 詳細とget_profile_by_idは同じキャッシュを使うため，DBへの問い合わせは1回だけ
+    assert query.eq.return_value.execute.call_count == 1
+    assert full_profile["embedding"] == [0.1, 0.2]
+
+def test_get_profiles_page_reads_on_from_the_previous_cursor():
+    """
+    一覧のページ分割で，前のページの最後の (created_at, id) より後ろだけを取得し，次のページの位置を返すかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_db_client = MagicMock()
+    query = MagicMock()
+    mock_db_client.table.return_value.select.return_value = query
+    for method in ("neq", "or_", "order", "limit"):
+        getattr(query, method).return_value = query
+    rows = [{"id": f"user-{i}", "created_at": f"2025-01-0{9 - i}T00:00:00+00:00"} for i in range(3)]
+    query.execute.return_value.data = rows
+    manager = ProfileManager(mock_db_client)
+
+    # 2. 実行 (Act)
+    first_page, cursor = manager.get_profiles_page("me", limit=2)
+    query.execute.return_value.data = rows[2:]
+    last_page, last_cursor = manager.get_profiles_page("me", cursor=cursor, limit=2)
+
+    # 3. 検証 (Assert)
+    assert [profile["id"] for profile in first_page] == ["user-0", "user-1"]
+    assert cursor == ("2025-01-08T00:00:00+00:00", "user-1")
+    query.or_.assert_called_once_with(
+        'created_at.lt."2025-01-08T00:00:00+00:00",and(created_at.eq."2025-01-08T00:00:00+00:00",id.lt.user-1)'
+    )
+    query.limit.assert_called_with(3)
+    assert [profile["id"] for profile in last_page] == ["user-2"]
+    assert last_cursor is None
+
+def test_get_profiles_by_ids_returns_request_order_in_one_query():
+    """
+    複数のプロフィールを1回の問い合わせで取得し，要求した順序（存在しないIDはNone）で返すかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import supabase_utils
+    mock_db_client = MagicMock()
+    query = mock_db_client.table.return_value.select.return_value.in_.return_value
+    query.execute.return_value.data = [{"id": "user-b"}, {"id": "user-a"}]
+
+    # 2. 実行 (Act)
+    profiles = supabase_utils.get_profiles_by_ids(mock_db_client, ["user-a", "missing", "user-b"], columns="id")
+
+    # 3. 検証 (Assert)
+    assert profiles == [{"id": "user-a"}, None, {"id": "user-b"}]
+    mock_db_client.table.return_value.select.assert_called_once_with("id")
+    mock_db_client.table.return_value.select.return_value.in_.assert_called_once_with("id", ["user-a", "missing", "user-b"])
+
+def test_get_profile_by_id_reads_through_cache_and_refreshes_on_write(mocker):
+    """
+    2回目以降の取得はキャッシュから返し，プロフィール画像の更新後は保存後のプロフィールを返すかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+    mock_supabase_utils.get_profile_by_id.return_value = {"id": "user-cache", "profile_image_url": "old.png"}
+    mock_supabase_utils.update_profile_url.return_value = [{"id": "user-cache", "profile_image_url": "new.png"}]
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 (Act)
+    first = manager.get_profile_by_id("user-cache")
+    first["profile_image_url"] = "changed-by-caller.png"
+    second = manager.get_profile_by_id("user-cache")
+    exists = manager.check_profile_exists("user-cache")
+    manager.update_profile_image_url("user-cache", "new.png")
+    after_write = manager.get_profile_by_id("user-cache")
+
+    # 3. 検証 (Assert)
+    # DBへの問い合わせは最初の1回だけ
+    assert mock_supabase_utils.get_profile_by_id.call_count == 1
+    # 呼び出し元が結果を変更しても，キャッシュには波及しない
+    assert second["profile_image_url"] == "old.png"
+    assert exists is True
+    assert after_write["profile_image_url"] == "new.png"
+    stats = profile_manager.get_profile_cache_stats()
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+def test_sign_in_uses_session_client_and_keeps_shared_client_anonymous(mocker):
+    """
+    共有のクライアントを使う場合，ログインとその後の書き込み・RLSに依存する読み取りはセッション専用のクライアントで行い，
+    プロフィールの読み取りは共有のクライアントのままかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_supabase_utils = mocker.patch('profile_manager.supabase_utils')
+    mock_supabase_utils.update_profile_url.return_value = [{"id": "user-1", "profile_image_url": "new.png"}]
+    shared_client = MagicMock()
+    session_client = MagicMock()
+    factory = MagicMock(return_value=session_client)
+    manager = ProfileManager(shared_client, session_client_factory=factory)
+
+    # 2. 実行 (Act)
+    # ログイン前の閲覧ではセッション専用のクライアントを作らない
+    manager.get_profile_by_id("user-2")
+    factory_calls_before_sign_in = factory.call_count
+    manager.sign_in("a@example.com", "password")
+    manager.update_profile_image_url("user-1", "new.png")
+    manager.get_profile_by_id("user-3")
+    manager.search_profiles("登山", "user-1")
+
+    # 3. 検証 (Assert)
+    assert factory_calls_before_sign_in == 0
+    factory.assert_called_once()
+    mock_supabase_utils.sign_in.assert_called_once_with(session_client, "a@example.com", "password")
+    mock_supabase_utils.update_profile_url.assert_called_once_with(session_client, "user-1", "new.png")
+    mock_supabase_utils.get_profile_by_id.assert_called_with(shared_client, "user-3")
+    mock_supabase_utils.search_profiles.assert_called_once_with(session_client, "登山", "user-1")
+
+def test_vector_index_loads_from_compact_rows_alone(mocker):
+    """
+    コンパクトな形式で保存している場合，単精度のembeddingを取得せずにembedding_compactだけから索引を作って検索するかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import profile_manager
+    from embedding_codec import encode_embedding
+    mocker.patch('profile_manager.VECTOR_INDEX_ENABLED', False)
+    mocker.patch('profile_manager.PROFILE_NEIGHBORS_ENABLED', False)
+    mocker.patch('profile_manager.embedding_generator.EMBEDDING_COMPACT_FORMAT', "int8")
+    mocker.patch('profile_manager.embedding_generator.EMBEDDING_COLUMN', "embedding_compact")
+    mocker.patch('profile_manager._vector_index_loaded_at', None)
+    mocker.patch('profile_manager._vector_index', profile_manager._new_vector_index())
+    version = profile_manager.embedding_generator.EMBEDDING_VERSION
+    mock_get_all = mocker.patch('profile_manager.supabase_utils.get_profiles_updated_since', return_value=[
+        {"id": "me", "nickname": "自分", "embedding_compact": encode_embedding([1.0, 0.0], "int8"), "embedding_version": version},
+        {"id": "near", "nickname": "近い人", "embedding_compact": encode_embedding([0.9, 0.1], "int8"), "embedding_version": version},
+        {"id": "far", "nickname": "遠い人", "embedding_compact": encode_embedding([0.0, 1.0], "int8"), "embedding_version": version},
+    ])
+    mock_rpc = mocker.patch('profile_manager.supabase_utils.find_similar_users')
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 (Act)
+    result = manager.find_similar_profiles("me")
+
+    # 3. 検証 (Assert)
+    selected_columns = [column.strip() for column in mock_get_all.call_args.args[1].split(",")]
+    assert "embedding_compact" in selected_columns
+    assert "embedding" not in selected_columns
+    mock_rpc.assert_not_called()
+    # 索引の行列もコンパクトな型のまま持つ
+    assert profile_manager._vector_index.dtype == "int8"
+    assert [profile["id"] for profile in result] == ["near"]
+    assert "embedding_compact" not in result[0]
+
+def test_vector_index_warm_starts_from_file_and_syncs_only_changes(mocker, tmp_path):
+    """
+    保存済みの索引から起動した場合，保存した時点以降に更新されたプロフィールだけを取得し，削除されたユーザーを除くかのテスト．
+    また，同期中の他のスレッドは同期を待たずに今の索引で検索するかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import profile_manager
+    import vector_index
+    version = profile_manager.embedding_generator.EMBEDDING_VERSION
+    saved = vector_index.VectorIndex()
+    saved.upsert("me", [1.0, 0.0], {"id": "me"})
+    saved.upsert("near", [0.9, 0.1], {"id": "near"})
+    saved.upsert("deleted", [1.0, 0.01], {"id": "deleted"})
+    saved.metadata["synced_until"] = "2025-01-01T00:10:00+00:00"
+    saved.metadata["embedding_version"] = version
+    path = tmp_path / "index.npz"
+    saved.save(str(path))
+    mocker.patch('profile_manager.VECTOR_INDEX_ENABLED', True)
+    mocker.patch('profile_manager.PROFILE_NEIGHBORS_ENABLED', False)
+    mocker.patch('profile_manager.VECTOR_INDEX_PATH', str(path))
+    mocker.patch('profile_manager.VECTOR_INDEX_SYNC_OVERLAP_SECONDS', 60)
+    mocker.patch('profile_manager._vector_index_loaded_at', None)
+    mocker.patch('profile_manager._vector_index', None)
+    mock_changed = mocker.patch('profile_manager.supabase_utils.get_profiles_updated_since', return_value=[
+        {"id": "new", "nickname": "新しい人", "embedding": "[0.95,0.05]", "embedding_version": version,
+         "updated_at": "2025-01-01T00:20:00+00:00"},
+    ])
+    mocker.patch('profile_manager.supabase_utils.get_profile_ids', return_value=["me", "near", "new"])
+    manager = ProfileManager(MagicMock())
+
+    # 2. 実行 (Act)
+    result = manager.find_similar_profiles("me")
+    # 索引が古くなっても，他のスレッドが同期中なら待たずに今の索引で検索する
+    profile_manager._vector_index_loaded_at = -profile_manager.VECTOR_INDEX_TTL_SECONDS
+    profile_manager._vector_index_sync_lock.acquire()
+    try:
+        during_sync = manager.find_similar_profiles("me")
+    finally:
+        profile_manager._vector_index_sync_lock.release()
+
+    # 3. 検証 (Assert)
+    mock_changed.assert_called_once()
+    assert mock_changed.call_args.args[2] == "2025-01-01T00:09:00+00:00"
+    assert [profile["id"] for profile in result] == ["new", "near"]
+    assert during_sync == result
+    assert profile_manager._vector_index.metadata["synced_until"] == "2025-01-01T00:20:00+00:00"
+    # 同期の結果も保存され，次の起動ではここから続きを取得する
+    assert vector_index.VectorIndex.load(str(path)).metadata["synced_until"] == "2025-01-01T00:20:00+00:00"
+
+def test_saved_vector_index_follows_current_settings(mocker, tmp_path):
+    """
+    保存済みの索引を読み込むとき，IVFの調べるクラスタの数は現在の設定を使い，行列の型が設定と異なる場合は作り直すかのテスト
+    """
+    # 1. 準備 (Arrange)
+    import profile_manager
+    import vector_index
+    version = profile_manager.embedding_generator.EMBEDDING_VERSION
+    ivf_path = tmp_path / "ivf.npz"
+    saved_ivf = vector_index.IVFIndex(n_probe=8)
+    saved_ivf.metadata["embedding_version"] = version
+    saved_ivf.save(str(ivf_path))
+    int8_path = tmp_path / "int8.npz"
+    saved_int8 = vector_index.VectorIndex(dtype="int8")
+    saved_int8.metadata["embedding_version"] = version
+    saved_int8.save(str(int8_path))
+    mocker.patch('profile_manager.embedding_generator.EMBEDDING_COMPACT_FORMAT', None)
+
+    # 2. 実行 (Act)
+    mocker.patch('profile_manager.VECTOR_INDEX_TYPE', "ivf")
+    mocker.patch('profile_manager.VECTOR_INDEX_IVF_PROBES', 2)
+    mocker.patch('profile_manager.VECTOR_INDEX_PATH', str(ivf_path))
+    loaded_ivf = profile_manager._load_saved_vector_index()
+    mocker.patch('profile_manager.VECTOR_INDEX_TYPE', "exact")
+    mocker.patch('profile_manager.VECTOR_INDEX_PATH', str(int8_path))
+    rebuilt = profile_manager._load_saved_vector_index()
+
+    # 3. 検証 (Assert)
+    assert loaded_ivf.n_probe == 2
+    assert rebuilt.dtype == "float32"
+    assert "synced_until" not in rebuilt.metadata
@@ -0,0 +1,60 @@
+# tests/test_profile_neighbors.py
+import numpy as np
+import profile_neighbors
+
+def _brute_force(ids, vectors, k, min_score):
+    lists = {}
+    for i, item_id in enumerate(ids):
+        scores = vectors @ vectors[i]
+        order = [j for j in np.argsort(-scores, kind="stable") if j != i and scores[j] >= min_score][:k]
+        lists[item_id] = [ids[j] for j in order]
+    return lists
+
+def _normalized(rng, count):
+    vectors = rng.normal(size=(count, 6)) + 1.0
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def test_compute_all_neighbors_matches_brute_force_across_blocks():
+    """
+    ブロックごとに計算した上位k人が，全件を素直に並べた結果と一致するかのテスト
+    """
+    # 1. 準備 (Arrange)
+    rng = np.random.default_rng(0)
+    ids = [f"user-{i}" for i in range(50)]
+    vectors = _normalized(rng, 50)
+
+    # 2. 実行 (Act)
+    neighbors = profile_neighbors.compute_all_neighbors(ids, vectors, k=5, min_score=0.5, block_size=7)
+
+    # 3. 検証 (Assert)
+    expected = _brute_force(ids, vectors, 5, 0.5)
+    assert {item_id: [n for n, _ in items] for item_id, items in neighbors.items()} == expected
+
+def test_refresh_profile_recomputes_only_its_row_and_column():
+    """
+    1人のベクトルを変えたときの行と列の再計算が，全件を計算し直した結果と一致し，行全体の計算は一部のユーザーだけで済むかのテスト
+    """
+    # 1. 準備 (Arrange)
+    rng = np.random.default_rng(1)
+    ids = [f"user-{i}" for i in range(60)]
+    vectors = _normalized(rng, 60)
+    stored = profile_neighbors.compute_all_neighbors(ids, vectors, k=4, min_score=0.3)
+    vectors[0] = _normalized(rng, 1)[0]
+    score_calls = []
+
+    def score_all(item_id):
+        score_calls.append(item_id)
+        return ids, vectors @ vectors[ids.index(item_id)]
+
+    # 2. 実行 (Act)
+    listing_ids = [item_id for item_id, items in stored.items() if "user-0" in dict(items)]
+    affected = profile_neighbors.affected_profile_ids("user-0", score_all, listing_ids, 0.3)
+    updated = profile_neighbors.refresh_profile(
+        "user-0", score_all, {item_id: stored[item_id] for item_id in affected}, k=4, min_score=0.3
+    )
+    stored.update(updated)
+
+    # 3. 検証 (Assert)
+    expected = _brute_force(ids, vectors, 4, 0.3)
+    assert {item_id: [n for n, _ in items] for item_id, items in stored.items()} == expected
+    assert len(set(score_calls)) < len(ids)
@@ -0,0 +1,146 @@
+# tests/test_supabase_utils.py
+import pytest
+from unittest.mock import MagicMock
+import supabase_utils
+
+def test_bulk_upsert_writes_in_chunks_and_falls_back_to_single_rows():
+    """
+    一括書き込みがチャンクごとにまとめられ，失敗したチャンクだけ1行ずつ書き込み直して失敗した行を報告するかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_db_client = MagicMock()
+    requests = []
+
+    def upsert(rows, on_conflict):
+        requests.append([row["id"] for row in rows])
+        if any(row["id"] == "bad" for row in rows):
+            raise RuntimeError("null value in column")
+        response = MagicMock()
+        response.data = rows
+        return MagicMock(execute=MagicMock(return_value=response))
+
+    mock_db_client.table.return_value.upsert.side_effect = upsert
+    rows = [{"id": f"user-{i}", "searchable_text": "テキスト"} for i in range(5)]
+    rows.insert(3, {"id": "bad", "searchable_text": "テキスト"})
+    rows.append({"id": "user-with-embedding", "searchable_text": "テキスト", "embedding": [0.1]})
+    progress = []
+
+    # 2. 実行 (Act)
+    result = supabase_utils.bulk_upsert(mock_db_client, "profiles", rows, chunk_size=3, on_progress=progress.append)
+
+    # 3. 検証 (Assert)
+    # 同じ列を持つ行だけを3行ずつまとめ，失敗したチャンクは1行ずつ書き込み直す
+    assert requests == [
+        ["user-0", "user-1", "user-2"],
+        ["bad", "user-3", "user-4"], ["bad"], ["user-3"], ["user-4"],
+        ["user-with-embedding"],
+    ]
+    assert [row["id"] for row in result["data"]] == ["user-0", "user-1", "user-2", "user-3", "user-4", "user-with-embedding"]
+    assert [failure["key"] for failure in result["failed"]] == [{"id": "bad"}]
+    assert sum(progress) == len(rows)
+
+def test_bulk_update_profiles_updates_existing_rows_only():
+    """
+    一括更新がRPCでチャンクごとに行われ，失敗したチャンクだけ1行ずつ更新し直し，
+    削除済みのユーザー（更新されなかった行）は結果に含めないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_db_client = MagicMock()
+    existing_ids = {"user-0", "user-1", "bad", "user-3"}
+    requests = []
+
+    def rpc(name, params):
+        rows = params["profile_rows"]
+        requests.append((name, [row["id"] for row in rows]))
+        if any(row["id"] == "bad" for row in rows):
+            raise RuntimeError("invalid input syntax")
+        response = MagicMock()
+        response.data = [row for row in rows if row["id"] in existing_ids]
+        return MagicMock(execute=MagicMock(return_value=response))
+
+    mock_db_client.rpc.side_effect = rpc
+    rows = [{"id": user_id, "searchable_text": "テキスト"} for user_id in ["user-0", "user-1", "bad", "user-3", "deleted"]]
+    progress = []
+
+    # 2. 実行 (Act)
+    result = supabase_utils.bulk_update_profiles(mock_db_client, rows, chunk_size=2, on_progress=progress.append)
+
+    # 3. 検証 (Assert)
+    # upsertは使わない（行を追加しない）
+    mock_db_client.table.assert_not_called()
+    assert requests == [
+        ("bulk_update_profiles", ["user-0", "user-1"]),
+        ("bulk_update_profiles", ["bad", "user-3"]), ("bulk_update_profiles", ["bad"]), ("bulk_update_profiles", ["user-3"]),
+        ("bulk_update_profiles", ["deleted"]),
+    ]
+    assert [row["id"] for row in result["data"]] == ["user-0", "user-1", "user-3"]
+    assert [failure["key"] for failure in result["failed"]] == [{"id": "bad"}]
+    assert sum(progress) == len(rows)
+
+def test_bulk_update_profiles_rejects_columns_outside_the_rpc():
+    """
+    SQL関数で更新しない列を含む行は，送る前にValueErrorになるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_db_client = MagicMock()
+
+    # 2. 実行 (Act) & 3. 検証 (Assert)
+    with pytest.raises(ValueError):
+        supabase_utils.bulk_update_profiles(mock_db_client, [{"id": "user-0", "nickname": "りも"}])
+    mock_db_client.rpc.assert_not_called()
+
+def test_get_embedding_hashes_skips_rows_without_embedding():
+    """
+    ハッシュだけが残っていて埋め込みが空のユーザーは，ベクトルを使い回さないよう結果に含めないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_db_client = MagicMock()
+    query = mock_db_client.table.return_value.select.return_value.in_.return_value
+    query.not_.is_.return_value.execute.return_value.data = [{"id": "user-a", "embedding_hash": "hash-a"}]
+
+    # 2. 実行 (Act)
+    hashes = supabase_utils.get_embedding_hashes(mock_db_client, ["user-a", "user-without-embedding"])
+
+    # 3. 検証 (Assert)
+    query.not_.is_.assert_called_once_with("embedding", "null")
+    assert hashes == {"user-a": "hash-a"}
+    assert hashes.get("user-without-embedding") is None
+
+def test_neighbor_lists_keep_a_marker_for_profiles_without_neighbors():
+    """
+    類似ユーザーがいないユーザーにも目印の行を保存し，読み出すと未計算（None）ではなく空のリストになるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    mock_db_client = MagicMock()
+    table = mock_db_client.table.return_value
+    read_query = table.select.return_value.eq.return_value.order.return_value
+    read_query.execute.return_value.data = [
+        {"neighbor_id": "lonely", "similarity": 0.0, "neighbor": {"id": "lonely", "nickname": "自分"}},
+    ]
+
+    # 2. 実行 (Act)
+    supabase_utils.replace_neighbor_lists(mock_db_client, {"lonely": [], "popular": [("lonely", 0.7)]})
+    similar_profiles = supabase_utils.get_similar_profiles_from_neighbors(mock_db_client, "lonely")
+
+    # 3. 検証 (Assert)
+    inserted_rows = table.insert.call_args.args[0]
+    assert {"profile_id": "lonely", "neighbor_id": "lonely", "rank": supabase_utils.NEIGHBOR_MARKER_RANK, "similarity": 0.0} in inserted_rows
+    assert [row["neighbor_id"] for row in inserted_rows if row["profile_id"] == "popular"] == ["popular", "lonely"]
+    assert similar_profiles == []
+
+def test_shared_client_keeps_its_pool_for_postgrest_only():
+    """
+    共有のクライアントでストレージを使っても，PostgRESTの接続プールの接続先が書き換えられないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    client = supabase_utils.create_shared_client("https://example.supabase.co", "anon-key")
+
+    # 2. 実行 (Act)
+    storage_session = client.storage._client
+    postgrest_session = client.postgrest.session
+
+    # 3. 検証 (Assert)
+    assert storage_session is not postgrest_session
+    assert str(storage_session.base_url) == "https://example.supabase.co/storage/v1/"
+    assert str(postgrest_session.base_url) == "https://example.supabase.co/rest/v1/"
+    assert postgrest_session.headers["apikey"] == "anon-key"
@@ -0,0 +1,115 @@
+# tests/test_vector_index.py
+import numpy as np
+from vector_index import IVFIndex, VectorIndex
+
+def test_search_returns_top_k_by_cosine_similarity():
+    """
+    類似度の高い順に上位k件が返され，除外したIDと閾値未満のものは含まれないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    index = VectorIndex()
+    index.upsert("me", [1.0, 0.0, 0.0], {"nickname": "自分"})
+    index.upsert("near", [0.9, 0.1, 0.0], {"nickname": "近い人"})
+    index.upsert("middle", [0.5, 0.5, 0.0], {"nickname": "中くらいの人"})
+    index.upsert("far", [0.0, 0.0, 1.0], {"nickname": "遠い人"})
+
+    # 2. 実行 (Act)
+    results = index.search([2.0, 0.0, 0.0], k=2, exclude_ids=["me"])
+    thresholded = index.search([1.0, 0.0, 0.0], k=10, min_score=0.6, exclude_ids=["me"])
+
+    # 3. 検証 (Assert)
+    assert [item_id for item_id, _, _ in results] == ["near", "middle"]
+    assert results[0][2] == {"nickname": "近い人"}
+    assert abs(results[1][1] - np.sqrt(0.5)) < 1e-6
+    assert [item_id for item_id, _, _ in thresholded] == ["near", "middle"]
+
+def test_upsert_and_delete_keep_id_to_row_mapping():
+    """
+    追加・更新・削除を繰り返しても，IDとベクトルの対応が崩れないかのテスト
+    """
+    # 1. 準備 (Arrange)
+    index = VectorIndex()
+    rng = np.random.default_rng(0)
+    vectors = {f"user-{i}": rng.normal(size=8) for i in range(40)}
+    for item_id, vector in vectors.items():
+        index.upsert(item_id, vector)
+
+    # 2. 実行 (Act)
+    for i in range(0, 40, 3):
+        index.delete(f"user-{i}")
+        del vectors[f"user-{i}"]
+    vectors["user-1"] = rng.normal(size=8)
+    index.upsert("user-1", vectors["user-1"])
+
+    # 3. 検証 (Assert)
+    assert len(index) == len(vectors)
+    assert "user-0" not in index
+    for item_id, vector in vectors.items():
+        assert np.allclose(index.get_vector(item_id), vector / np.linalg.norm(vector), atol=1e-6)
+        assert index.search(vector, k=1)[0][0] == item_id
+
+def test_ivf_index_matches_exact_search_and_survives_save_load(tmp_path):
+    """
+    IVFの近似検索が厳密な検索の上位とほぼ一致し，保存・読み込み後や追加・削除の後も同じように検索できるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 16))
+    vectors = centers[rng.integers(0, 20, size=2000)] + rng.normal(scale=0.3, size=(2000, 16))
+    exact = VectorIndex()
+    ivf = IVFIndex(n_lists=20, n_probe=4, min_train_size=500)
+    for i, vector in enumerate(vectors):
+        exact.upsert(f"user-{i}", vector)
+        ivf.upsert(f"user-{i}", vector)
+    queries = vectors[:50] + rng.normal(scale=0.1, size=(50, 16))
+
+    # 2. 実行 (Act)
+    path = tmp_path / "index.npz"
+    ivf.save(str(path))
+    loaded = IVFIndex.load(str(path))
+    loaded_results = loaded.search(queries[0], k=5)
+    loaded.delete("user-1")
+    loaded.upsert("new-user", queries[2])
+    hits = 0
+    for query in queries:
+        expected = {item_id for item_id, _, _ in exact.search(query, k=10)}
+        hits += len(expected & {item_id for item_id, _, _ in ivf.search(query, k=10)})
+
+    # 3. 検証 (Assert)
+    assert hits / (len(queries) * 10) >= 0.9
+    assert loaded_results == ivf.search(queries[0], k=5)
+    assert len(loaded) == len(ivf)
+    assert "user-1" not in loaded
+    assert loaded.search(queries[2], k=1)[0][0] == "new-user"
+
+def test_compact_index_matches_float32_search_and_survives_save_load(tmp_path):
+    """
+    float16・int8の索引が単精度の索引とほぼ同じ上位を返し，保存・読み込み後も同じ型と結果になるかのテスト
+    """
+    # 1. 準備 (Arrange)
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(300, 32))
+    ids = [f"user-{i}" for i in range(300)]
+    exact = VectorIndex()
+    exact.upsert_many(ids, vectors)
+    compact_indexes = {dtype: VectorIndex(dtype=dtype) for dtype in ("float16", "int8")}
+    for index in compact_indexes.values():
+        index.upsert_many(ids, vectors)
+        index.delete("user-0")
+    exact.delete("user-0")
+    query = vectors[5]
+
+    # 2. 実行 (Act)
+    expected = [item_id for item_id, _, _ in exact.search(query, k=10)]
+    results = {dtype: [item_id for item_id, _, _ in index.search(query, k=10)] for dtype, index in compact_indexes.items()}
+    path = tmp_path / "int8_index.npz"
+    compact_indexes["int8"].save(str(path))
+    loaded = VectorIndex.load(str(path))
+
+    # 3. 検証 (Assert)
+    for found in results.values():
+        assert found[0] == "user-5"
+        assert len(set(found) & set(expected)) >= 9
+    assert loaded.dtype == np.int8
+    assert [item_id for item_id, _, _ in loaded.search(query, k=10)] == results["int8"]
+    assert np.allclose(loaded.get_vector("user-5"), exact.get_vector("user-5"), atol=0.02)
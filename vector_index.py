@@ -0,0 +1,388 @@
+import json
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import embedding_codec
+
+# 行列の型と，embedding_codecのコンパクトな形式の対応
+_COMPACT_FORMATS_BY_DTYPE = {np.dtype(np.float16): "float16", np.dtype(np.int8): "int8"}
+# float16・int8の行列の類似度を計算するときに，一度に単精度に戻す行数（一時的なメモリ使用量を抑える）
+SCORE_BLOCK_ROWS = 4096
+
+
+class VectorIndex:
+    """
+    全プロフィールの埋め込みを，L2正規化した1つのNumPy行列としてメモリ上に保持する索引．
+    IDと行番号の対応を持ち，プロフィールの書き込みに合わせて1件ずつ追加・更新・削除できる．
+    類似検索は行列とベクトルの積とargpartitionで行うため，DBへの問い合わせは不要．
+    各IDには，検索結果と一緒に返すデータ（payload）を1つ持たせられる．スレッドセーフ．
+    dtypeにnp.float16・np.int8を指定すると，行列をembedding_codecのコンパクトな形式で持つ（メモリは1/2・1/4）．
+    類似度は少しずつ単精度に戻して計算する．NumPyの半精度からの変換は遅いため，float16の全件の検索は単精度の数倍かかる
+    （int8はほぼ同じ速さ）．
+    """
+    def __init__(self, dtype: Any = np.float32):
+        self.dtype = np.dtype(dtype)
+        if self.dtype != np.float32 and self.dtype not in _COMPACT_FORMATS_BY_DTYPE:
+            raise ValueError(f"未対応の型です: {self.dtype}")
+        self._lock = threading.RLock()
+        self._matrix: Optional[np.ndarray] = None
+        # int8の場合の行ごとの倍率（元の値は 整数 × 倍率）
+        self._scales: Optional[np.ndarray] = None
+        self._size = 0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._payloads: List[Any] = []
+        # 索引と一緒に保存する，JSONに変換できる付加情報（同期した時点等）
+        self.metadata: Dict[str, Any] = {}
+
+    def upsert(self, item_id: str, vector: Sequence[float], payload: Any = None) -> None:
+        """
+        IDのベクトルとpayloadを追加する．既に存在する場合は置き換える．
+        """
+        self.upsert_many([item_id], [vector], [payload])
+
+    def upsert_many(self, item_ids: Sequence[str], vectors: Any, payloads: Optional[Sequence[Any]] = None) -> None:
+        """
+        複数のIDのベクトルとpayloadをまとめて追加・置き換えする．
+        索引がコンパクトな型の場合は，全てのベクトルをembedding_codec.to_compact_matrixでまとめて変換する．
+        """
+        if len(item_ids) == 0:
+            return
+        normalized = np.atleast_2d(embedding_codec.l2_normalize(vectors))
+        encoded, scales = self._encode_rows(normalized)
+        payloads = [None] * len(item_ids) if payloads is None else payloads
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((16, normalized.shape[1]), dtype=self.dtype)
+                self._scales = np.ones(16, dtype=np.float32) if scales is not None else None
+            elif normalized.shape[1] != self._matrix.shape[1]:
+                raise ValueError(
+                    f"ベクトルの次元数が索引と異なります（索引: {self._matrix.shape[1]}，追加: {normalized.shape[1]}）"
+                )
+
+            for position, item_id in enumerate(item_ids):
+                row = self._rows.get(item_id)
+                if row is None:
+                    if self._size == self._matrix.shape[0]:
+                        self._grow()
+                    row = self._size
+                    self._size += 1
+                    self._rows[item_id] = row
+                    self._ids.append(item_id)
+                    self._payloads.append(payloads[position])
+                else:
+                    self._payloads[row] = payloads[position]
+                self._matrix[row] = encoded[position]
+                if scales is not None:
+                    self._scales[row] = scales[position]
+                self._on_row_set(row, normalized[position])
+
+    def _grow(self) -> None:
+        # 容量を倍に増やし，追加のたびに行列を作り直さないようにする
+        grown = np.zeros((self._matrix.shape[0] * 2, self._matrix.shape[1]), dtype=self.dtype)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+        if self._scales is not None:
+            grown_scales = np.ones(grown.shape[0], dtype=np.float32)
+            grown_scales[:self._size] = self._scales[:self._size]
+            self._scales = grown_scales
+
+    def _encode_rows(self, normalized: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """正規化済みの行列を，索引の型の (行列, int8の場合の行ごとの倍率) に変換する．"""
+        compact_format = _COMPACT_FORMATS_BY_DTYPE.get(self.dtype)
+        if compact_format is None:
+            return normalized.astype(self.dtype), None
+        return embedding_codec.to_compact_matrix(normalized, compact_format)
+
+    def _dense_rows(self, start: int, stop: int) -> np.ndarray:
+        """start行目からstop行目の手前までを，単精度の行列として返す．"""
+        block = self._matrix[start:stop]
+        if self._scales is not None:
+            return embedding_codec.dequantize_int8(block, self._scales[start:stop])
+        return block.astype(np.float32, copy=False)
+
+    def _scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        クエリ（単精度）と各行の内積を返す．rowsがNoneの場合は全ての行を計算する．
+        単精度の場合は1回の積で，コンパクトな型の場合はSCORE_BLOCK_ROWS行ずつ単精度に戻して計算する．
+        """
+        if self.dtype == np.float32:
+            matrix = self._matrix[:self._size] if rows is None else self._matrix[rows]
+            return (matrix @ query).astype(np.float32)
+        count = self._size if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SCORE_BLOCK_ROWS):
+            stop = min(start + SCORE_BLOCK_ROWS, count)
+            block_rows = slice(start, stop) if rows is None else rows[start:stop]
+            scores[start:stop] = self._matrix[block_rows].astype(np.float32) @ query
+            if self._scales is not None:
+                # int8の倍率は行ごとなので，内積を計算した後に掛ければよい
+                scores[start:stop] *= self._scales[block_rows]
+        return scores
+
+    def delete(self, item_id: str) -> bool:
+        """
+        IDを索引から削除する．最後の行を空いた行に移すため，他の行番号が変わることがある．
+        削除した場合はTrueを返す．
+        """
+        with self._lock:
+            row = self._rows.pop(item_id, None)
+            if row is None:
+                return False
+            last = self._size - 1
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                if self._scales is not None:
+                    self._scales[row] = self._scales[last]
+                self._ids[row] = self._ids[last]
+                self._payloads[row] = self._payloads[last]
+                self._rows[self._ids[row]] = row
+                self._on_row_moved(last, row)
+            self._ids.pop()
+            self._payloads.pop()
+            self._size -= 1
+            return True
+
+    def get_vector(self, item_id: str) -> Optional[np.ndarray]:
+        """IDの正規化済みのベクトルを返す．存在しない場合はNoneを返す．"""
+        with self._lock:
+            row = self._rows.get(item_id)
+            return None if row is None else self._dense_rows(row, row + 1)[0].copy()
+
+    def get_payload(self, item_id: str) -> Any:
+        """IDのpayloadを返す．存在しない場合はNoneを返す．"""
+        with self._lock:
+            row = self._rows.get(item_id)
+            return None if row is None else self._payloads[row]
+
+    def search(self, query_vector: Sequence[float], k: int, min_score: Optional[float] = None,
+               exclude_ids: Iterable[str] = ()) -> List[Tuple[str, float, Any]]:
+        """
+        クエリとのコサイン類似度が高い順に，最大k件の (ID, 類似度, payload) を返す．
+        min_scoreを指定した場合は，類似度がそれ未満のものを除く．
+        """
+        query = embedding_codec.l2_normalize(query_vector)
+        with self._lock:
+            if self._size == 0 or k <= 0:
+                return []
+            rows = self._candidate_rows(query)
+            # 全件の場合は，行列をコピーしないようにスライスで計算する
+            scores = self._scores(query, rows)
+            if rows is None:
+                rows = np.arange(self._size)
+            excluded_rows = [self._rows[item_id] for item_id in exclude_ids if item_id in self._rows]
+            if excluded_rows:
+                scores[np.isin(rows, excluded_rows)] = -np.inf
+
+            if k < len(rows):
+                # 上位k件だけを部分的に選んでから，その中を並べ替える
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(rows))
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            results = []
+            for position in top:
+                score = float(scores[position])
+                if score == -np.inf or (min_score is not None and score < min_score):
+                    break
+                row = rows[position]
+                results.append((self._ids[row], score, self._payloads[row]))
+            return results
+
+    def score_all(self, item_id: str) -> Optional[Tuple[List[str], np.ndarray]]:
+        """
+        IDのベクトルと全てのベクトルとのコサイン類似度を (IDのリスト, 類似度の配列) で返す（近似ではなく全件を計算する）．
+        IDが存在しない場合はNoneを返す．
+        """
+        with self._lock:
+            row = self._rows.get(item_id)
+            if row is None:
+                return None
+            return list(self._ids), self._scores(self._dense_rows(row, row + 1)[0])
+
+    def clear(self) -> None:
+        """全てのベクトルを削除する．"""
+        with self._lock:
+            self._matrix = None
+            self._scales = None
+            self._size = 0
+            self._ids = []
+            self._rows = {}
+            self._payloads = []
+
+    def ids(self) -> List[str]:
+        """索引に含まれる全てのIDを返す．"""
+        with self._lock:
+            return list(self._ids)
+
+    def save(self, path: str) -> None:
+        """
+        索引をファイル（NumPyの.npz形式）に保存する．payloadとmetadataはJSONに変換できる値であること．
+        """
+        with self._lock, open(path, "wb") as f:
+            # ファイルオブジェクトに書き込み，拡張子が自動で付け足されないようにする
+            np.savez(f, **self._state_arrays())
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        """
+        saveで保存した索引を読み込む．
+        """
+        with np.load(path, allow_pickle=False) as saved:
+            index = cls(dtype=saved["vectors"].dtype)
+            index._restore_state(saved)
+        return index
+
+    def _state_arrays(self) -> Dict[str, np.ndarray]:
+        vectors = self._matrix[:self._size] if self._matrix is not None else np.zeros((0, 0), dtype=self.dtype)
+        arrays = {
+            "vectors": vectors,
+            "ids": np.array(json.dumps(self._ids, ensure_ascii=False)),
+            "payloads": np.array(json.dumps(self._payloads, ensure_ascii=False, default=str)),
+            "metadata": np.array(json.dumps(self.metadata, ensure_ascii=False, default=str)),
+        }
+        if self._scales is not None:
+            arrays["scales"] = self._scales[:self._size]
+        return arrays
+
+    def _restore_state(self, saved: Any) -> None:
+        vectors = saved["vectors"]
+        self._ids = json.loads(str(saved["ids"]))
+        self._payloads = json.loads(str(saved["payloads"]))
+        self.metadata = json.loads(str(saved["metadata"])) if "metadata" in saved else {}
+        self._rows = {item_id: row for row, item_id in enumerate(self._ids)}
+        self._size = len(self._ids)
+        self._matrix = np.array(vectors, dtype=self.dtype) if self._size else None
+        if self._matrix is not None and self.dtype == np.int8:
+            self._scales = np.array(saved["scales"], dtype=np.float32)
+
+    # --- 派生クラスで行の割り当てを管理するためのフック ---
+    def _on_row_set(self, row: int, vector: np.ndarray) -> None:
+        """行にベクトルが書き込まれた後に呼ばれる．"""
+
+    def _on_row_moved(self, source: int, destination: int) -> None:
+        """削除のために，最後の行が空いた行に移された後に呼ばれる．"""
+
+    def _candidate_rows(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """検索で類似度を計算する行を返す．Noneの場合は全ての行を計算する（厳密な検索）．"""
+        return None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._size
+
+    def __contains__(self, item_id: str) -> bool:
+        with self._lock:
+            return item_id in self._rows
+
+
+class IVFIndex(VectorIndex):
+    """
+    転置ファイル（IVF）による近似最近傍探索の索引．VectorIndexと同じ操作で使える．
+    ベクトルをk-meansでn_lists個のクラスタに分け，検索時はクエリに近いn_probe個のクラスタの中だけで類似度を計算する．
+    学習前（件数がmin_train_size未満）は厳密な検索を行う．追加したベクトルは最も近いクラスタに割り当て，
+    件数が学習時のretrain_growth倍を超えたら学習し直す．
+    """
+    def __init__(self, dtype: Any = np.float32, n_lists: Optional[int] = None, n_probe: int = 8,
+                 min_train_size: int = 1000, retrain_growth: float = 4.0, seed: int = 0):
+        super().__init__(dtype=dtype)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.seed = seed
+        self._centroids: Optional[np.ndarray] = None
+        self._row_lists = np.zeros(0, dtype=np.int32)
+        self._trained_size = 0
+
+    def train(self, iterations: int = 10, sample_size: int = 50000) -> None:
+        """
+        現在のベクトルからk-means（コサイン類似度）でクラスタの中心を求め，全ての行をクラスタに割り当てる．
+        """
+        with self._lock:
+            if self._size == 0:
+                return
+            vectors = self._dense_rows(0, self._size)
+            n_lists = self.n_lists or max(1, int(np.sqrt(self._size)))
+            n_lists = min(n_lists, self._size)
+            rng = np.random.default_rng(self.seed)
+            sample = vectors[rng.choice(self._size, size=min(sample_size, self._size), replace=False)]
+
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+            for _ in range(iterations):
+                assignments = self._nearest_lists(sample, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignments, sample)
+                # 空になったクラスタは，前回の中心のままにする
+                empty = np.bincount(assignments, minlength=n_lists) == 0
+                sums[empty] = centroids[empty]
+                centroids = embedding_codec.l2_normalize(sums)
+
+            self._centroids = centroids
+            self._row_lists = np.zeros(self._matrix.shape[0], dtype=np.int32)
+            self._row_lists[:self._size] = self._nearest_lists(vectors, centroids)
+            self._trained_size = self._size
+
+    @staticmethod
+    def _nearest_lists(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            assignments[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+        return assignments
+
+    def _on_row_set(self, row: int, vector: np.ndarray) -> None:
+        if self._row_lists.shape[0] < self._matrix.shape[0]:
+            grown = np.zeros(self._matrix.shape[0], dtype=np.int32)
+            grown[:self._row_lists.shape[0]] = self._row_lists
+            self._row_lists = grown
+        if self._centroids is None:
+            if self._size >= self.min_train_size:
+                self.train()
+            return
+        if self._size > self._trained_size * self.retrain_growth:
+            self.train()
+            return
+        self._row_lists[row] = int(np.argmax(self._centroids @ vector))
+
+    def _on_row_moved(self, source: int, destination: int) -> None:
+        self._row_lists[destination] = self._row_lists[source]
+
+    def _candidate_rows(self, query: np.ndarray) -> Optional[np.ndarray]:
+        if self._centroids is None:
+            return None
+        n_probe = min(self.n_probe, len(self._centroids))
+        probed = np.argpartition(-(self._centroids @ query), n_probe - 1)[:n_probe]
+        probed_mask = np.zeros(len(self._centroids), dtype=bool)
+        probed_mask[probed] = True
+        return np.flatnonzero(probed_mask[self._row_lists[:self._size]])
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+            self._centroids = None
+            self._row_lists = np.zeros(0, dtype=np.int32)
+            self._trained_size = 0
+
+    def _state_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._state_arrays()
+        if self._centroids is not None:
+            arrays["centroids"] = self._centroids
+            arrays["row_lists"] = self._row_lists[:self._size]
+            arrays["trained_size"] = np.array(self._trained_size)
+        arrays["settings"] = np.array([self.n_lists or 0, self.n_probe, self.min_train_size], dtype=np.int64)
+        arrays["retrain_growth"] = np.array(self.retrain_growth)
+        return arrays
+
+    def _restore_state(self, saved: Any) -> None:
+        super()._restore_state(saved)
+        n_lists, self.n_probe, self.min_train_size = (int(value) for value in saved["settings"])
+        self.n_lists = n_lists or None
+        self.retrain_growth = float(saved["retrain_growth"])
+        self._row_lists = np.zeros(self._matrix.shape[0] if self._matrix is not None else 0, dtype=np.int32)
+        if "centroids" in saved:
+            self._centroids = np.array(saved["centroids"], dtype=np.float32)
+            self._row_lists[:self._size] = saved["row_lists"]
+            self._trained_size = int(saved["trained_size"])
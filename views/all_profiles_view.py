@@ -5,11 +5,15 @@ import sys
 import os
 from datetime import datetime
 import random
+import time
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-supabase_client=st.session_state.supabase_client
 profile_manager=st.session_state.profile_manager
 current_user=st.session_state.user
+# 一覧の1ページに表示するプロフィールの数
+PROFILE_PAGE_SIZE = 20
+# 読み込んだ一覧をセッションステートに保持する秒数（これより古い一覧は，次の表示で1ページ目から読み込み直す）
+PROFILE_LIST_TTL_SECONDS = 300
 
 def render_page():
     st.markdown("""
@@ -132,7 +136,6 @@ def render_page():
         # suggested_profilesが空で，ログインしている場合に類似ユーザを取得・抽選する
         if not st.session_state.suggested_profiles and st.session_state.user and st.session_state.profile_exists:
             try:
-                similar_profiles = profile_manager.find_similar_profiles(st.session_state.user['id'])
                 with st.spinner("あなたにぴったりの人を探しています..."):
                     similar_profiles = profile_manager.find_similar_profiles(st.session_state.user['id'])
                     if similar_profiles:
@@ -150,20 +153,20 @@ def render_page():
                 render_profile_card(profile, cols[i])
             st.divider()
 
-        with st.spinner("みんなのプロフィールを読み込んでいます..."):
-            try:
-                # ログインしているかチェック
-                if st.session_state.user:
-                    # ログインしていれば、自分のIDを渡して自分を除外
-                    current_user_id = st.session_state.user['id']
-                    profiles = profile_manager.get_all_profiles(current_user_id)
-                else:
-                    # ログインしていなければ、引数なしで呼び出し、全ユーザーを取得
-                    profiles = profile_manager.get_all_profiles()
-            except Exception as e:
-                st.error(f"プロフィールの取得中にエラーが発生しました: {e}")
-                return 
+        # 一覧は1ページずつ読み込み，読み込んだ分をセッションステートに保存して再実行のたびに取得し直さない
+        # （他のユーザーの登録や編集を反映するため，PROFILE_LIST_TTL_SECONDSを過ぎるか更新ボタンが押されたら読み込み直す）
+        current_user_id = st.session_state.user['id'] if st.session_state.user else None
+        profile_list = st.session_state.get('profile_list')
+        if (profile_list is None or profile_list["user_id"] != current_user_id
+                or time.monotonic() - profile_list["loaded_at"] > PROFILE_LIST_TTL_SECONDS):
+            profile_list = new_profile_list(current_user_id)
+        if st.button("🔄 一覧を更新", key="refresh_profile_list"):
+            profile_list = new_profile_list(current_user_id)
+        if not profile_list["profiles"] and profile_list["has_more"]:
+            if not load_next_profiles_page(profile_list):
+                return
 
+        profiles = profile_list["profiles"]
         if not profiles:
             st.info("まだ誰も登録していません。")
         else:
@@ -177,9 +180,73 @@ def render_page():
                 # 関数を呼び出してカードを描画
                 render_profile_card(profile, target_col)
 
+            # 3. 続きがあれば，ボタンで次のページを読み込む
+            if profile_list["has_more"]:
+                if st.button("もっと見る", key="load_more_profiles", use_container_width=True):
+                    if load_next_profiles_page(profile_list):
+                        st.rerun()
+
+def new_profile_list(current_user_id) -> dict:
+    '''
+        空のプロフィール一覧を作成してセッションステートに保存する関数（1ページ目から読み込み直すときに使う）．
+    '''
+    profile_list = {
+        "user_id": current_user_id, "profiles": [], "cursor": None, "has_more": True, "loaded_at": time.monotonic()
+    }
+    st.session_state.profile_list = profile_list
+    return profile_list
+
+def load_next_profiles_page(profile_list: dict) -> bool:
+    '''
+        プロフィール一覧の次のページを読み込み，セッションステートの一覧に追加する関数．
+        読み込みに失敗した場合はエラーを表示してFalseを返す．
+    '''
+    with st.spinner("みんなのプロフィールを読み込んでいます..."):
+        try:
+            # ログインしていれば自分のIDを渡して自分を除外し，していなければ全ユーザーから取得する
+            page, next_cursor = profile_manager.get_profiles_page(
+                current_user_id=profile_list["user_id"],
+                cursor=profile_list["cursor"],
+                limit=PROFILE_PAGE_SIZE
+            )
+        except Exception as e:
+            st.error(f"プロフィールの取得中にエラーが発生しました: {e}")
+            return False
+    profile_list["profiles"].extend(page)
+    profile_list["cursor"] = next_cursor
+    profile_list["has_more"] = next_cursor is not None
+    return True
+
+def render_conversation_starters_stream(starters_stream) -> dict:
+    '''
+        (キー, 要素) の組を順に返すストリームを受け取り，会話のヒントを届いた要素から順に描画する関数．
+        描画し終えた内容を辞書にまとめて返す．
+    '''
+    starters = {"common_points": [], "topics": []}
+    with st.container(border=True):
+        st.markdown("**🤝 2人の共通点**")
+        common_points_area = st.container()
+        st.markdown("**💡 話題の提案**")
+        topics_area = st.container()
+        with common_points_area:
+            waiting_message = st.empty()
+            waiting_message.caption("AIが会話のヒントを考えています...")
+
+        for key, item in starters_stream:
+            waiting_message.empty()
+            starters[key].append(item)
+            if key == "common_points":
+                with common_points_area:
+                    st.markdown(f"- {item}")
+            else:
+                with topics_area:
+                    st.info(item)
+        waiting_message.empty()
+    return starters
+
 def render_profile_card(profile:dict,target_col):
     '''
-        １人分のプロフカードと，その詳細を展開表示するExtenderを描画する関数
+        １人分のプロフカードと，その詳細の表示を切り替えるトグルを描画する関数
     '''
     with target_col:
         with st.container(border=True):
@@ -208,181 +275,197 @@ def render_profile_card(profile:dict,target_col):
             """, unsafe_allow_html=True)
 
 
-            # --- 詳細表示用のExpander ---
-            with st.expander("もっと見る"):
-                # 詳細ヘッダー
-                col1, col2 = st.columns([1, 2])
-                with col1:
-                    image_url=profile.get('profile_image_url')
-                    if image_url and image_url.startswith('http'):
-                        st.image(image_url, width=150)
-                    else:
-                        st.image('https://placehold.co/150x150/EFEFEF/333333?text=No+Img', width=150)
-                with col2:
-                    st.subheader(profile.get('nickname', 'No Name'))
-                    full_name=f"{profile.get('last_name','')} {profile.get('first_name','')}"
-                    st.markdown(f"<p style='color: grey; margin-top: -10px;'>{full_name}</p>", unsafe_allow_html=True)
-                    st.caption(f"{profile.get('catchphrase', '')}")
-                    tags=profile.get('tags',[])
-                    if tags:
-                        tag_spans="".join([f"<span style='background-color:#F0F2F6; border-radius:5px; padding:2px 6px; margin-right:4px;'>#{tag.lstrip('#')}</span>" for tag in tags])
-                        st.markdown(tag_spans, unsafe_allow_html=True)                
-                st.divider()
+            # --- 詳細表示 ---
+            # 詳細は開いたカードの分だけ取得する（一覧の取得にはカードに表示する列しか含まれない）
+            if st.toggle("もっと見る", key=f"detail_toggle_{profile['id']}"):
+                try:
+                    detail = profile_manager.get_profile_detail(profile['id'])
+                except Exception as e:
+                    st.error(f"プロフィールの詳細の取得に失敗しました: {e}")
+                    return
+                if detail:
+                    with st.container(border=True):
+                        render_profile_detail(detail)
 
-                # 動物診断結果
-                with st.container(border=True):
-                    animal_icon_col, animal_text_col = st.columns([1, 2]) # アイコンとテキストの比率
+def render_profile_detail(profile:dict):
+    '''
+        １人分のプロフィールの詳細（自己紹介・詳細情報・会話のヒント・メモ）を描画する関数
+    '''
+    # 詳細ヘッダー
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        image_url=profile.get('profile_image_url')
+        if image_url and image_url.startswith('http'):
+            st.image(image_url, width=150)
+        else:
+            st.image('https://placehold.co/150x150/EFEFEF/333333?text=No+Img', width=150)
+    with col2:
+        st.subheader(profile.get('nickname', 'No Name'))
+        full_name=f"{profile.get('last_name','')} {profile.get('first_name','')}"
+        st.markdown(f"<p style='color: grey; margin-top: -10px;'>{full_name}</p>", unsafe_allow_html=True)
+        st.caption(f"{profile.get('catchphrase', '')}")
+        tags=profile.get('tags',[])
+        if tags:
+            tag_spans="".join([f"<span style='background-color:#F0F2F6; border-radius:5px; padding:2px 6px; margin-right:4px;'>#{tag.lstrip('#')}</span>" for tag in tags])
+            st.markdown(tag_spans, unsafe_allow_html=True)                
+    st.divider()
 
-                    with animal_icon_col:
-                        # 1. 動物の名前を取得
-                        animal_name_detail = profile.get('animal_name')
-                        # 2. 動物名から画像データ(Base64)を取得
-                        if animal_name_detail:
-                            animal_image_data_detail = profile_manager.assign_animal_image_url(animal_name_detail)
-                        else:
-                            animal_image_data_detail = 'https://placehold.co/60x60/cccccc/333333?text=Animal'
-                        
-                        # 3. 取得した画像データを表示
-                        st.image(animal_image_data_detail, width=90)
+    # 動物診断結果
+    with st.container(border=True):
+        animal_icon_col, animal_text_col = st.columns([1, 2]) # アイコンとテキストの比率
 
-                    with animal_text_col:
-                        # 1. カテゴリ名の末尾の「タイプ」を削除
-                        category = profile.get('animal_category', 'カテゴリ未分類')
-                        category_without_type = category.removesuffix('タイプ') 
-                        
-                        st.markdown(f"**{category_without_type}**")
+        with animal_icon_col:
+            # 1. 動物の名前を取得
+            animal_name_detail = profile.get('animal_name')
+            # 2. 動物名から画像データ(Base64)を取得
+            if animal_name_detail:
+                animal_image_data_detail = profile_manager.assign_animal_image_url(animal_name_detail)
+            else:
+                animal_image_data_detail = 'https://placehold.co/60x60/cccccc/333333?text=Animal'
+            
+            # 3. 取得した画像データを表示
+            st.image(animal_image_data_detail, width=90)
+
+        with animal_text_col:
+            # 1. カテゴリ名の末尾の「タイプ」を削除
+            category = profile.get('animal_category', 'カテゴリ未分類')
+            category_without_type = category.removesuffix('タイプ') 
+            
+            st.markdown(f"**{category_without_type}**")
 
-                        # 2. 動物名には「タイプ」を付けて表示
-                        animal_name = profile.get('animal_name', '診断中...')
-                        st.subheader(f"“{animal_name}タイプ”")
+            # 2. 動物名には「タイプ」を付けて表示
+            animal_name = profile.get('animal_name', '診断中...')
+            st.subheader(f"“{animal_name}タイプ”")
 
-                        '''
-                        st.markdown(f"**{profile.get('animal_category', 'カテゴリ未分類')}**")
-                        
-                        animal_name = profile.get('animal_name')
-                        if animal_name:
-                            html_content = f"""
-                            <div style="display: flex; align-items: baseline; margin-top: -10px;">
-                            <span style="font-size: 1.5em; font-weight: 600; margin-right: 5px; line-height: 1.2;">{animal_name}</span>
-                            <span style="font-size: 0.8em; color: grey;">タイプ</span>
-                            </div>
-                            """
-                        else:
-                            html_content = f"""
-                            <div style="margin-top: -10px;">
-                            <span style="font-size: 1.75em; font-weight: 600; color: grey;">診断中...</span>
-                            </div>
-                            """
-                        st.markdown(html_content, unsafe_allow_html=True)
-                        '''
-                        
-                st.write("") # スペース
-                
-                # 自己紹介
-                st.markdown("#### 自己紹介")
-                st.write(profile.get('introduction_text','自己紹介文がありません。'))
-                
-                # 詳細情報
-                st.markdown("#### 詳細情報")
-                colA,colB=st.columns(2)
-                with colA:
-                    birth_date_str = profile.get('birth_date')
-                    if birth_date_str:
-                        # 1. まず、どの環境でも動作するstrptimeで日付オブジェクトに変換
-                        dt_obj = datetime.strptime(birth_date_str, '%Y-%m-%d')
-                        
-                        # 2. f-stringで直接、月と日の数値を文字列に埋め込む
-                        birth_date_formatted = f"{dt_obj.month}月{dt_obj.day}日"
-                    else:
-                        birth_date_formatted = '未設定'
-                    st.markdown(f"**誕生日:** {birth_date_formatted}")
-                    st.markdown(f"**出身地:** {profile.get('hometown', '未設定')}")
-                    st.markdown(f"**大学:** {profile.get('university', '未設定')}")
-                with colB:
-                    st.markdown(f"**趣味:** {', '.join(profile.get('hobbies', []))}")
-                    st.markdown(f"**話したいこと:** {profile.get('happy_topic', '未設定')}")
-                    st.markdown(f"**詳しいこと:** {profile.get('expert_topic', '未設定')}")
-                
-                if st.session_state.user:
-                    # 会話のきっかけ
-                    # 1. セッションステートを初期化
-                    if f'conv_starter_{profile.get("id")}' not in st.session_state:
-                        st.session_state[f'conv_starter_{profile.get("id")}'] = None
+            '''
+            st.markdown(f"**{profile.get('animal_category', 'カテゴリ未分類')}**")
+            
+            animal_name = profile.get('animal_name')
+            if animal_name:
+                html_content = f"""
+                <div style="display: flex; align-items: baseline; margin-top: -10px;">
+                <span style="font-size: 1.5em; font-weight: 600; margin-right: 5px; line-height: 1.2;">{animal_name}</span>
+                <span style="font-size: 0.8em; color: grey;">タイプ</span>
+                </div>
+                """
+            else:
+                html_content = f"""
+                <div style="margin-top: -10px;">
+                <span style="font-size: 1.75em; font-weight: 600; color: grey;">診断中...</span>
+                </div>
+                """
+            st.markdown(html_content, unsafe_allow_html=True)
+            '''
+            
+    st.write("") # スペース
+    
+    # 自己紹介
+    st.markdown("#### 自己紹介")
+    st.write(profile.get('introduction_text','自己紹介文がありません。'))
+    
+    # 詳細情報
+    st.markdown("#### 詳細情報")
+    colA,colB=st.columns(2)
+    with colA:
+        birth_date_str = profile.get('birth_date')
+        if birth_date_str:
+            # 1. まず、どの環境でも動作するstrptimeで日付オブジェクトに変換
+            dt_obj = datetime.strptime(birth_date_str, '%Y-%m-%d')
+            
+            # 2. f-stringで直接、月と日の数値を文字列に埋め込む
+            birth_date_formatted = f"{dt_obj.month}月{dt_obj.day}日"
+        else:
+            birth_date_formatted = '未設定'
+        st.markdown(f"**誕生日:** {birth_date_formatted}")
+        st.markdown(f"**出身地:** {profile.get('hometown', '未設定')}")
+        st.markdown(f"**大学:** {profile.get('university', '未設定')}")
+    with colB:
+        st.markdown(f"**趣味:** {', '.join(profile.get('hobbies', []))}")
+        st.markdown(f"**話したいこと:** {profile.get('happy_topic', '未設定')}")
+        st.markdown(f"**詳しいこと:** {profile.get('expert_topic', '未設定')}")
+    
+    if st.session_state.user:
+        # 会話のきっかけ
+        # 1. セッションステートを初期化
+        if f'conv_starter_{profile.get("id")}' not in st.session_state:
+            st.session_state[f'conv_starter_{profile.get("id")}'] = None
 
-                    # 2. ボタンが押されたら、APIを呼び出して結果をセッションステートに保存
-                    if st.button("AIに会話のヒントをもらう", key=f"conv_starter_button_{profile.get('id')}"):
-                        current_user_id = st.session_state.user.get('id')
-                        
-                        if not current_user_id:
-                            st.warning("ログイン情報が見つかりません。")
-                        else:
-                            try:
-                                with st.spinner("AIが会話のヒントを考えています..."):
-                                    starters = profile_manager.generate_conversation_starters(
-                                        my_id=current_user_id,
-                                        opponent_id=profile.get("id")
-                                    )
-                                # 結果をセッションステートに保存
-                                st.session_state[f'conv_starter_{profile.get("id")}'] = starters
-                            except Exception as e:
-                                # エラーもセッションステートに保存
-                                st.session_state[f'conv_starter_{profile.get("id")}'] = {"error": str(e)}
+        # 2. ボタンが押されたら、生成された要素から順に表示し、結果をセッションステートに保存
+        streamed = False
+        if st.button("AIに会話のヒントをもらう", key=f"conv_starter_button_{profile.get('id')}"):
+            current_user_id = st.session_state.user.get('id')
+            
+            if not current_user_id:
+                st.warning("ログイン情報が見つかりません。")
+            else:
+                try:
+                    starters_stream = profile_manager.stream_conversation_starters(
+                        my_id=current_user_id,
+                        opponent_id=profile.get("id")
+                    )
+                    starters = render_conversation_starters_stream(starters_stream)
+                    # 結果をセッションステートに保存
+                    st.session_state[f'conv_starter_{profile.get("id")}'] = starters
+                    streamed = True
+                except Exception as e:
+                    # エラーもセッションステートに保存
+                    st.session_state[f'conv_starter_{profile.get("id")}'] = {"error": str(e)}
 
-                    # 3. セッションステートにデータがあれば、常に表示する
-                    starters_data = st.session_state[f'conv_starter_{profile.get("id")}']
-                    if starters_data:
-                        if "error" in starters_data:
-                            st.error(f"ヒントの生成に失敗しました: {starters_data['error']}")
-                        else:
-                            with st.container(border=True):
-                                st.markdown("**🤝 2人の共通点**")
-                                if starters_data.get("common_points"):
-                                    for point in starters_data["common_points"]:
-                                        st.markdown(f"- {point}")
-                                
-                                st.markdown("**💡 話題の提案**")
-                                if starters_data.get("topics"):
-                                    for topic in starters_data["topics"]:
-                                        st.info(topic)
-                    st.divider()
-                    st.markdown("#### このユーザーに関するメモ")
+        # 3. セッションステートにデータがあれば、常に表示する（今回の実行で表示済みの場合を除く）
+        starters_data = st.session_state[f'conv_starter_{profile.get("id")}']
+        if starters_data and not streamed:
+            if "error" in starters_data:
+                st.error(f"ヒントの生成に失敗しました: {starters_data['error']}")
+            else:
+                with st.container(border=True):
+                    st.markdown("**🤝 2人の共通点**")
+                    if starters_data.get("common_points"):
+                        for point in starters_data["common_points"]:
+                            st.markdown(f"- {point}")
+                    
+                    st.markdown("**💡 話題の提案**")
+                    if starters_data.get("topics"):
+                        for topic in starters_data["topics"]:
+                            st.info(topic)
+        st.divider()
+        st.markdown("#### このユーザーに関するメモ")
 
-                    current_user_id = st.session_state.user['id']
-                    target_user_id = profile['id']
+        current_user_id = st.session_state.user['id']
+        target_user_id = profile['id']
 
-                    # 1. 既存のメモを取得して表示
-                    try:
-                        existing_memo = profile_manager.get_memo_for_target(current_user_id, target_user_id)
-                        memo_content = existing_memo['content'] if existing_memo else ""
-                    except Exception as e:
-                        st.error(f"メモの読み込みに失敗しました: {e}")
-                        memo_content = "" # エラー時は空にする
+        # 1. 既存のメモを取得して表示
+        try:
+            existing_memo = profile_manager.get_memo_for_target(current_user_id, target_user_id)
+            memo_content = existing_memo['content'] if existing_memo else ""
+        except Exception as e:
+            st.error(f"メモの読み込みに失敗しました: {e}")
+            memo_content = "" # エラー時は空にする
 
-                    # 2. メモ入力用のテキストエリアを配置
-                    new_memo = st.text_area(
-                        "メモを編集:", 
-                        value=memo_content, 
-                        key=f"memo_{profile['id']}",
-                        height=150
-                    )
+        # 2. メモ入力用のテキストエリアを配置
+        new_memo = st.text_area(
+            "メモを編集:", 
+            value=memo_content, 
+            key=f"memo_{profile['id']}",
+            height=150
+        )
 
-                    # 3. 保存ボタンと削除ボタンを横並びに配置
-                    col_save, col_delete = st.columns(2)
-                    with col_save:
-                        if st.button("メモを保存", key=f"save_memo_{profile['id']}", use_container_width=True):
-                            try:
-                                profile_manager.save_memo(current_user_id, target_user_id, new_memo)
-                                st.success("メモを保存しました。")
-                                # ページをリロードして、表示を最新の状態に更新
-                                st.rerun() 
-                            except Exception as e:
-                                st.error(f"メモの保存に失敗しました: {e}")
-                    
-                    with col_delete:
-                        if st.button("メモを削除", key=f"delete_memo_{profile['id']}", use_container_width=True):
-                            try:
-                                profile_manager.delete_memo(current_user_id, target_user_id)
-                                st.success("メモを削除しました。")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"メモの削除に失敗しました: {e}")
\ No newline at end of file
+        # 3. 保存ボタンと削除ボタンを横並びに配置
+        col_save, col_delete = st.columns(2)
+        with col_save:
+            if st.button("メモを保存", key=f"save_memo_{profile['id']}", use_container_width=True):
+                try:
+                    profile_manager.save_memo(current_user_id, target_user_id, new_memo)
+                    st.success("メモを保存しました。")
+                    # ページをリロードして、表示を最新の状態に更新
+                    st.rerun() 
+                except Exception as e:
+                    st.error(f"メモの保存に失敗しました: {e}")
+        
+        with col_delete:
+            if st.button("メモを削除", key=f"delete_memo_{profile['id']}", use_container_width=True):
+                try:
+                    profile_manager.delete_memo(current_user_id, target_user_id)
+                    st.success("メモを削除しました。")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"メモの削除に失敗しました: {e}")
\ No newline at end of file
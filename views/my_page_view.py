@@ -2,7 +2,6 @@ import streamlit as st
 import datetime
 from .profile_detail_component import display_profile_detail
 import streamlit as st
-import qrcode
 from io import BytesIO
 
 
@@ -69,7 +68,8 @@ def render_page():
                 # QRコードに含めるURLを生成
                 my_profile_url = f"{BASE_URL}/?page=profile_detail&id={current_user_id}"
 
-                # QRコードを画像としてメモリ上に生成
+                # QRコードを画像としてメモリ上に生成（qrcodeは表示するときに初めて読み込む）
+                import qrcode
                 img = qrcode.make(my_profile_url)
                 buf = BytesIO()
                 img.save(buf, format="PNG")
@@ -15,7 +15,7 @@ def render_page():
         st.stop()
         
     try:
-        profile = profile_manager.get_profile_by_id(profile_id)
+        profile = profile_manager.get_profile_detail(profile_id)
         
         # --- ここに、all_profiles_view.pyのexpander内にあった
         # --- 詳細表示のロジックを全てコピー＆ペーストする ---